@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""compare greenlet timers with mainloop callbacks
+
+- one-shot: a batch of timers is set to go off right away and the loop is
+  run until all of them have, with schedule_in() (a greenlet per timer) and
+  with call_later() (no greenlet)
+- recurring: a number of recurring timers tick for a while, the way
+  metrics flushers or keepalive pings would, with schedule_recurring() (a new
+  greenlet every tick) and with RecurringTimer (one re-armed handle each).
+  the loop is mostly idle in between, so this is reported as CPU time used
+  per call as well as the rate.
+
+one-shot timers are reported as calls per second.
+"""
+
+import optparse
+import os
+import time
+
+import greenhouse
+
+
+def one_shot(count, callbacks):
+    remaining = [count]
+    done = greenhouse.Event()
+
+    def fire():
+        remaining[0] -= 1
+        if not remaining[0]:
+            done.set()
+
+    start = time.time()
+    for i in xrange(count):
+        if callbacks:
+            greenhouse.call_later(0, fire)
+        else:
+            greenhouse.schedule_in(0, fire)
+    done.wait()
+    return count / (time.time() - start)
+
+
+def recurring(count, duration, callbacks):
+    calls = [0]
+    interval = 0.001
+
+    # both kinds stop by themselves, so neither is left running afterwards
+    maxtimes = int(duration / interval)
+
+    def tick():
+        calls[0] += 1
+
+    for i in xrange(count):
+        if callbacks:
+            # schedule_recurring never drops a call, so neither should this
+            greenhouse.RecurringTimer(interval, tick, maxtimes=maxtimes,
+                    catch_up=True)
+        else:
+            greenhouse.schedule_recurring(interval, tick, maxtimes=maxtimes)
+
+    start, cpu = time.time(), sum(os.times()[:2])
+    greenhouse.pause_for(duration)
+    elapsed, cpu = time.time() - start, sum(os.times()[:2]) - cpu
+
+    # let any stragglers finish
+    greenhouse.pause_for(0.1)
+    return calls[0] / elapsed, cpu / calls[0] * 1e6
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--count", type=int, default=100000,
+            help="one-shot timers per run (default 100000)")
+    parser.add_option("-r", "--recurring", type=int, default=100,
+            help="recurring timers, ticking every ms (default 100)")
+    parser.add_option("-d", "--duration", type=float, default=1.0,
+            help="seconds to run the recurring timers for (default 1)")
+    options, args = parser.parse_args()
+
+    print "%-10s %-20s %14s %14s" % ("timers", "via", "calls/sec",
+            "cpu us/call")
+    for name, runs in (
+            ("one-shot", (("schedule_in", lambda: one_shot(
+                options.count, False)),
+                ("call_later", lambda: one_shot(options.count, True)))),
+            ("recurring", (("schedule_recurring", lambda: recurring(
+                options.recurring, options.duration, False)),
+                ("RecurringTimer", lambda: recurring(
+                    options.recurring, options.duration, True))))):
+        costs = []
+        for via, run in runs:
+            result = run()
+            if name == "recurring":
+                rate, cost = result
+                print "%-10s %-20s %14d %14.2f" % (name, via, rate, cost)
+            else:
+                rate, cost = result, 1e6 / result
+                print "%-10s %-20s %14d" % (name, via, rate)
+            costs.append(cost)
+        print "%-10s %-20s %13.2fx" % ("", "speedup:", costs[0] / costs[1])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""compare per-socket timeouts with a deadline() scope per request
+
+a client greenlet makes requests to an echo server greenlet over a socket
+pair, each request being a few small send/recv round trips. every request
+is bounded in time either by a timeout set on the client socket, which puts
+a timer in for each blocking recv(), or by wrapping the whole request in a
+deadline() scope, which puts in one timer for all of them.
+
+reported are requests per second, and how many timers were set per request.
+"""
+
+import optparse
+import socket
+import time
+
+import greenhouse
+
+
+def run(requests, trips, use_deadline):
+    a, b = socket.socketpair()
+    client = greenhouse.Socket(fromsock=a)
+    server = greenhouse.Socket(fromsock=b)
+    del a, b
+    done = greenhouse.Event()
+
+    @greenhouse.schedule
+    def echo():
+        while 1:
+            data = server.recv(64)
+            if not data:
+                break
+            server.sendall(data)
+        server.close()
+        done.set()
+
+    if not use_deadline:
+        client.settimeout(5.0)
+
+    # count what goes into the timer queue, deadline or per-call
+    timers = [0]
+    timed_paused = greenhouse.scheduler.state.timed_paused
+    insert = timed_paused.insert
+
+    def counting_insert(*args):
+        timers[0] += 1
+        return insert(*args)
+    timed_paused.insert = counting_insert
+
+    try:
+        start = time.time()
+        for i in xrange(requests):
+            if use_deadline:
+                with greenhouse.deadline(5.0):
+                    for j in xrange(trips):
+                        client.sendall("ping")
+                        client.recv(64)
+            else:
+                for j in xrange(trips):
+                    client.sendall("ping")
+                    client.recv(64)
+        elapsed = time.time() - start
+    finally:
+        del timed_paused.insert
+
+    client.close()
+    done.wait()
+    return requests / elapsed, float(timers[0]) / requests
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--requests", type=int, default=5000,
+            help="requests per run (default 5000)")
+    parser.add_option("-t", "--trips", type=int, default=5,
+            help="round trips per request (default 5)")
+    options, args = parser.parse_args()
+
+    print "%-16s %14s %14s" % ("bounded by", "requests/sec", "timers/req")
+    rates = []
+    for name, use_deadline in (("socket timeout", False),
+            ("deadline()", True)):
+        rate, timers = run(options.requests, options.trips, use_deadline)
+        rates.append(rate)
+        print "%-16s %14d %14.1f" % (name, rate, timers)
+    print "speedup: %.2fx" % (rates[1] / rates[0])
+
+
+if __name__ == "__main__":
+    main()
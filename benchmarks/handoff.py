@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""measure direct handoff between greenlets on util.Queue and Pool
+
+three workloads are timed with the queues created with handoff off (the
+default) and on:
+
+- ping-pong: two greenlets bounce a counter back and forth over a pair of
+  queues, reported as round trips per second and microseconds per trip
+- pipeline: a producer feeds a consumer through a small bounded queue,
+  reported as items per second
+- pool: items go through a Pool of workers and the results are collected,
+  reported as items per second
+"""
+
+import optparse
+import time
+
+import greenhouse
+
+
+def ping_pong(rounds, handoff):
+    pings = greenhouse.Queue(handoff=handoff)
+    pongs = greenhouse.Queue(handoff=handoff)
+
+    def bounce():
+        while 1:
+            x = pings.get()
+            if x is None:
+                break
+            pongs.put(x + 1)
+    greenhouse.schedule(bounce)
+
+    start = time.time()
+    for i in xrange(rounds):
+        pings.put(i)
+        pongs.get()
+    elapsed = time.time() - start
+    pings.put(None)
+    return rounds / elapsed
+
+
+def pipeline(items, handoff):
+    q = greenhouse.Queue(4, handoff=handoff)
+    done = greenhouse.Event()
+
+    def consume():
+        while q.get() is not None:
+            pass
+        done.set()
+    greenhouse.schedule(consume)
+
+    start = time.time()
+    for i in xrange(items):
+        q.put(i)
+    q.put(None)
+    done.wait()
+    return items / (time.time() - start)
+
+
+def pool(items, handoff):
+    p = greenhouse.Pool(lambda x: x, 4, handoff=handoff)
+    p.start()
+
+    start = time.time()
+    for i in xrange(0, items, 100):
+        for j in xrange(100):
+            p.put(j)
+        for j in xrange(100):
+            p.get()
+    elapsed = time.time() - start
+    p.close()
+    return items / elapsed
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--items", type=int, default=100000,
+            help="round trips or items per run (default 100000)")
+    options, args = parser.parse_args()
+
+    print "%-10s %-8s %14s %10s" % ("workload", "handoff", "per second",
+            "polls")
+    for name, func in (("ping-pong", ping_pong), ("pipeline", pipeline),
+            ("pool", pool)):
+        rates = []
+        for handoff in (False, True):
+            polls = greenhouse.stats()["polls"]
+            rates.append(func(options.items, handoff))
+            polls = greenhouse.stats()["polls"] - polls
+            print "%-10s %-8s %14d %10d" % (
+                    name, handoff and "on" or "off", rates[-1], polls)
+        if name == "ping-pong":
+            print "%-10s %-8s %14s %.2fus -> %.2fus per round trip" % (
+                    "", "", "", 1e6 / rates[0], 1e6 / rates[1])
+        print "%-10s %-8s %14s %.2fx" % ("", "", "speedup:",
+                rates[1] / rates[0])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""measure what skipping polls between passes buys, and what it costs
+
+a few greenlets do a little CPU work and pause() in a tight loop, so the run
+queue never empties and every pass would normally end in a non-blocking
+call into the poller. alongside them a pipe carries a timestamped message
+every few milliseconds to a reader greenlet, which records how late each one
+is seen.
+
+this is run with poll skipping off (POLL_SKIP_PASSES = 0, the default) and
+then with it on, reporting pause() throughput and the average and worst I/O
+latency for each.
+"""
+
+import optparse
+import os
+import struct
+import time
+
+import greenhouse
+from greenhouse import compat, scheduler
+
+
+def run(greenlets, duration, work, message_interval):
+    stop = [False]
+    pauses = [0]
+    latencies = []
+    rfd, wfd = os.pipe()
+    reader = greenhouse.File.fromfd(rfd, 'rb')
+    done = greenhouse.Event()
+    remaining = [greenlets + 2]
+
+    def finished():
+        remaining[0] -= 1
+        if not remaining[0]:
+            done.set()
+
+    def worker():
+        count = 0
+        while not stop[0]:
+            for i in xrange(work):
+                pass
+            greenhouse.pause()
+            count += 1
+        pauses[0] += count
+        finished()
+
+    def writer():
+        while not stop[0]:
+            greenhouse.pause_for(message_interval)
+            os.write(wfd, struct.pack("d", compat.monotonic()))
+        os.write(wfd, struct.pack("d", -1))
+        finished()
+
+    def read():
+        while 1:
+            sent, = struct.unpack("d", reader.read(8))
+            if sent < 0:
+                break
+            latencies.append(compat.monotonic() - sent)
+        finished()
+
+    for i in xrange(greenlets):
+        greenhouse.schedule(worker)
+    greenhouse.schedule(writer)
+    greenhouse.schedule(read)
+
+    start = time.time()
+    greenhouse.pause_for(duration)
+    stop[0] = True
+    elapsed = time.time() - start
+    done.wait()
+
+    reader.close()
+    os.close(wfd)
+    return (pauses[0] / elapsed, sum(latencies) / len(latencies) * 1e6,
+            max(latencies) * 1e6)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-g", "--greenlets", type=int, default=10,
+            help="number of greenlets pausing (default 10)")
+    parser.add_option("-d", "--duration", type=float, default=2.0,
+            help="seconds to run each policy for (default 2)")
+    parser.add_option("-w", "--work", type=int, default=20,
+            help="loop iterations of CPU work between pauses (default 20)")
+    parser.add_option("-m", "--message-interval", type=float, default=0.005,
+            help="seconds between timestamped messages (default 0.005)")
+    parser.add_option("-p", "--passes", type=int, default=64,
+            help="POLL_SKIP_PASSES when skipping (default 64)")
+    parser.add_option("-i", "--interval", type=float, default=0.0005,
+            help="POLL_SKIP_INTERVAL when skipping (default 0.0005)")
+    options, args = parser.parse_args()
+
+    results = []
+    for name, passes in (("every pass", 0), ("skipping", options.passes)):
+        scheduler.POLL_SKIP_PASSES = passes
+        scheduler.POLL_SKIP_INTERVAL = options.interval
+        before = greenhouse.stats()
+        pauses, mean, worst = run(options.greenlets, options.duration,
+                options.work, options.message_interval)
+        polls = greenhouse.stats()["polls"] - before["polls"]
+        results.append((name, pauses, polls, mean, worst))
+
+    print "%-12s %12s %10s %14s %14s" % (
+            "polling", "pauses/sec", "polls", "mean I/O us", "worst I/O us")
+    for name, pauses, polls, mean, worst in results:
+        print "%-12s %12d %10d %14.1f %14.1f" % (
+                name, pauses, polls, mean, worst)
+    print "speedup: %.2fx" % (results[1][1] / results[0][1])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""compare the OS pollers with many open connections
+
+a number of socket pairs are opened and one end of each is registered for
+reading, the way a server's idle connections sit waiting in recv(). each
+round a few of them get some data written to them, and the poller is asked
+which are ready. a greenlet's recv() registers its socket for the duration
+of the call, so every connection that fired then has its registration
+dropped and re-added before the next round.
+
+this is timed for epoll and for io_uring at increasing connection counts,
+as microseconds per round. the number of busy connections per round stays
+the same, so ideally so does the time.
+"""
+
+import optparse
+import resource
+import socket
+import time
+
+from greenhouse import poller
+
+
+def run(cls, pairs, active, rounds):
+    p = cls()
+    mask = p.INMASK | p.ERRMASK
+    readers = dict((reader.fileno(), reader) for reader, writer in pairs)
+    counters = {}
+    for reader, writer in pairs:
+        counters[reader.fileno()] = p.register(reader.fileno(), mask)
+    p.poll(0)
+
+    start = time.time()
+    for i in xrange(rounds):
+        for j in xrange(active):
+            pairs[(i * active + j) % len(pairs)][1].send("x")
+
+        fired = 0
+        while fired < active:
+            for fd, events in p.poll(1.0):
+                fired += 1
+                readers[fd].recv(1)
+                p.unregister(fd, counters[fd])
+                counters[fd] = p.register(fd, mask)
+    elapsed = time.time() - start
+
+    for fd, counter in counters.iteritems():
+        p.unregister(fd, counter)
+    p.poll(0)
+    return elapsed / rounds * 1e6
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--connections", default="100,1000,5000",
+            help="comma-separated connection counts (default 100,1000,5000)")
+    parser.add_option("-a", "--active", type=int, default=10,
+            help="connections with data each round (default 10)")
+    parser.add_option("-r", "--rounds", type=int, default=2000,
+            help="rounds at each connection count (default 2000)")
+    options, args = parser.parse_args()
+
+    pollers = [("epoll", poller.Epoll)]
+    if poller.IoUringPoller._POLLER:
+        pollers.append(("io_uring", poller.IoUringPoller))
+    else:
+        print "io_uring isn't available here, only running epoll"
+
+    limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    counts = [int(n) for n in options.connections.split(",")]
+
+    print "%-12s %-10s %16s" % ("connections", "poller", "us/round")
+    for count in counts:
+        count = min(count, (limit - 32) // 2)
+        pairs = [socket.socketpair() for i in xrange(count)]
+        for name, cls in pollers:
+            us = run(cls, pairs, min(options.active, count), options.rounds)
+            print "%-12d %-10s %16.1f" % (count, name, us)
+        for reader, writer in pairs:
+            reader.close()
+            writer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""measure the poller's registration bookkeeping with many descriptors
+
+every blocking socket call registers its descriptor with the poller and
+unregisters it again afterwards, so this is on the path of nearly all I/O.
+
+all of a number of descriptors are registered (by one or more greenlets
+each), and then a registration is repeatedly added and removed again on
+each of them, the way another greenlet blocking in recv() would do it. this
+is timed for the refcounted registry, and for the previous layout which kept
+every registration's mask and OR-ed them all together on each change.
+
+by default the OS poller is left out so that tens of thousands of
+descriptors can be simulated without opening them; --epoll runs it against
+a real epoll with pipes instead (limited by the open file rlimit).
+"""
+
+import collections
+import operator
+import optparse
+import os
+import resource
+import time
+
+from greenhouse import poller
+
+
+class Bookkeeping(poller._Registry):
+    INMASK, OUTMASK, ERRMASK = 1, 2, 4
+
+    def _update_registration(self, fd, from_mask, to_mask):
+        pass
+
+
+class Legacy(Bookkeeping):
+    "the previous layout: every registration's mask, OR-ed on each change"
+    def __init__(self):
+        self._registry = collections.defaultdict(dict)
+        self._counter = 0
+
+    def register(self, fd, eventmask):
+        registrations = self._registry[fd]
+        registered = self._combined(registrations.values())
+        self._update_registration(fd, registered,
+                self._combined(registrations.values() + [eventmask]))
+        self._counter += 1
+        registrations[self._counter] = eventmask
+        return self._counter
+
+    def unregister(self, fd, counter):
+        registrations = self._registry[fd]
+        if counter not in registrations:
+            self._registry.pop(fd)
+            return
+        mask = registrations.pop(counter)
+        the_rest = registrations.values()
+        self._update_registration(fd, self._combined(the_rest + [mask]),
+                self._combined(the_rest))
+        if not registrations:
+            self._registry.pop(fd)
+
+    def _combined(self, masks):
+        return reduce(operator.or_, masks, 0)
+
+
+def run(registry, fds, waiters, rounds):
+    # what a greenlet waiting to read registers
+    mask = registry.INMASK | registry.ERRMASK
+
+    for fd in fds:
+        for i in xrange(waiters):
+            registry.register(fd, mask)
+
+    start = time.time()
+    for i in xrange(rounds):
+        for fd in fds:
+            registry.unregister(fd, registry.register(fd, mask))
+    return (time.time() - start) / (rounds * len(fds)) * 1e9
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--descriptors", type=int, default=100000,
+            help="registered descriptors (default 100000)")
+    parser.add_option("-w", "--waiters", type=int, default=1,
+            help="registrations kept on each descriptor (default 1)")
+    parser.add_option("-r", "--rounds", type=int, default=5,
+            help="register/unregister rounds over all of them (default 5)")
+    parser.add_option("--epoll", action="store_true",
+            help="use a real epoll and real descriptors")
+    options, args = parser.parse_args()
+
+    if options.epoll:
+        limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        pipes = [os.pipe() for i in xrange(
+                min(options.descriptors, (limit - 32) // 2))]
+        fds = [r for r, w in pipes]
+        results = [("epoll", run(
+            poller.Epoll(), fds, options.waiters, options.rounds))]
+    else:
+        fds = range(options.descriptors)
+        results = [
+            ("refcounted", run(
+                Bookkeeping(), fds, options.waiters, options.rounds)),
+            ("legacy", run(
+                Legacy(), fds, options.waiters, options.rounds)),
+        ]
+
+    print "%d descriptors, %d registrations kept on each" % (
+            len(fds), options.waiters)
+    print "%-12s %18s" % ("registry", "ns/register+unreg")
+    for name, ns in results:
+        print "%-12s %18d" % (name, ns)
+
+
+if __name__ == "__main__":
+    main()
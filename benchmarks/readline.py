@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""measure readline() on socket files, the way line protocols use them
+
+a writer greenlet sends lines over a socket pair as fast as it can, and the
+other end reads them back with makefile().readline(). two kinds of traffic:
+
+- short lines: chat-protocol sized lines of about 80 bytes
+- long lines: lines of a megabyte each, which arrive in many pieces
+
+each runs against the current bytearray read buffer, and against a copy of
+the cStringIO buffering that FileBase used before (kept here in
+OldSocketFile). reported are lines and megabytes per second.
+"""
+
+import optparse
+import socket
+import time
+from cStringIO import StringIO
+
+import greenhouse
+from greenhouse.io import sockets
+
+
+class OldSocketFile(sockets.SocketFile):
+    def __init__(self, *args, **kwargs):
+        super(OldSocketFile, self).__init__(*args, **kwargs)
+        self._rbuf = StringIO()
+
+    def readline(self, max_len=-1):
+        buf = self._rbuf
+        newline, chunksize = self.NEWLINE, self.CHUNKSIZE
+        buf.seek(0)
+
+        text = buf.read()
+        while text.find(newline) < 0:
+            text = self._read_chunk(chunksize)
+            if not text:
+                break
+            buf.write(text)
+        else:
+            rc = buf.getvalue()
+            index = rc.find(newline) + len(newline)
+
+            buf.seek(0)
+            buf.truncate()
+            buf.write(rc[index:])
+            return rc[:index]
+
+        rc = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return rc
+
+
+def run(line_size, count, old):
+    a, b = socket.socketpair()
+    writer = greenhouse.Socket(fromsock=a)
+    reader = (OldSocketFile if old else sockets.SocketFile)(b)
+    del a, b
+    line = "x" * (line_size - 1) + "\n"
+    batch = line * max(1, 65536 // line_size)
+    lines_per_batch = len(batch) // line_size
+
+    @greenhouse.schedule
+    def write():
+        for i in xrange(0, count, lines_per_batch):
+            writer.sendall(batch)
+        writer.close()
+
+    start = time.time()
+    got = 0
+    while reader.readline():
+        got += 1
+    elapsed = time.time() - start
+    reader.close()
+    return got / elapsed, got * line_size / elapsed / 1e6
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--short", type=int, default=500000,
+            help="short lines to read (default 500000)")
+    parser.add_option("-l", "--long", type=int, default=20,
+            help="long lines to read (default 20)")
+    options, args = parser.parse_args()
+
+    print "%-12s %-10s %12s %10s" % ("lines", "buffer", "lines/sec",
+            "MB/sec")
+    for name, size, count in (("short", 80, options.short),
+            ("long", 1 << 20, options.long)):
+        rates = []
+        for buf, old in (("cStringIO", True), ("bytearray", False)):
+            lines, mb = run(size, count, old)
+            rates.append(lines)
+            print "%-12s %-10s %12d %10.1f" % (name, buf, lines, mb)
+        print "%-12s %-10s %11.2fx" % ("", "speedup:", rates[1] / rates[0])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""measure sendall() on big payloads, and sendall_many() against joining
+
+- big payloads: a reader greenlet drains a socket pair while a payload of a
+  few megabytes goes in with sendall(). the socket's send buffer only takes
+  a piece at a time, and this compares sending the rest from a memoryview
+  with the old way of slicing a new copy of the rest off every time.
+- header + body: many small responses, each a short header and a body, are
+  sent by joining them into one string for sendall(), by two sendall()
+  calls, and by sendall_many().
+
+both are reported as megabytes per second.
+"""
+
+import optparse
+import socket
+import time
+
+import greenhouse
+
+
+def pair(sndbuf=None):
+    a, b = socket.socketpair()
+    if sndbuf:
+        a.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+    writer = greenhouse.Socket(fromsock=a)
+    reader = greenhouse.Socket(fromsock=b)
+    del a, b
+    done = greenhouse.Event()
+
+    @greenhouse.schedule
+    def drain():
+        while reader.recv(262144):
+            pass
+        reader.close()
+        done.set()
+
+    return writer, done
+
+
+def sendall_sliced(sock, data):
+    # the way sendall used to go about it
+    sent = sock.send(data)
+    while sent < len(data):
+        sent += sock.send(data[sent:])
+
+
+def big_payloads(size, count, sliced):
+    writer, done = pair(65536)
+    data = "x" * size
+    start = time.time()
+    for i in xrange(count):
+        if sliced:
+            sendall_sliced(writer, data)
+        else:
+            writer.sendall(data)
+    writer.close()
+    done.wait()
+    return size * count / (time.time() - start) / 1e6
+
+
+def responses(count, header, body, how):
+    writer, done = pair()
+    header = "h" * header
+    body = "b" * body
+    start = time.time()
+    for i in xrange(count):
+        if how == "join":
+            writer.sendall(header + body)
+        elif how == "two calls":
+            writer.sendall(header)
+            writer.sendall(body)
+        else:
+            writer.sendall_many((header, body))
+    writer.close()
+    done.wait()
+    return (len(header) + len(body)) * count / (time.time() - start) / 1e6
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-s", "--size", type=int, default=8 << 20,
+            help="bytes in each big payload (default 8MB)")
+    parser.add_option("-c", "--count", type=int, default=5,
+            help="big payloads to send (default 5)")
+    parser.add_option("-r", "--responses", type=int, default=20000,
+            help="header + body responses to send (default 20000)")
+    parser.add_option("--header", type=int, default=200,
+            help="bytes in each response header (default 200)")
+    parser.add_option("--body", type=int, default=64 << 10,
+            help="bytes in each response body (default 64KB)")
+    options, args = parser.parse_args()
+
+    print "%-14s %-12s %10s" % ("workload", "sent with", "MB/sec")
+    for how, sliced in (("slicing", True), ("memoryview", False)):
+        print "%-14s %-12s %10.1f" % ("big payloads", how,
+                big_payloads(options.size, options.count, sliced))
+    for how in ("join", "two calls", "sendall_many"):
+        print "%-14s %-12s %10.1f" % ("header + body", how,
+                responses(options.responses, options.header, options.body,
+                    how))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""compare Socket.sendfile() with reading a file and sending what was read
+
+a file of a few megabytes is written to a temporary directory, then sent a
+number of times over a connected TCP pair on localhost to a reader greenlet
+which just drains it. it is sent either with sendfile(), which has the
+kernel move it straight from the page cache to the socket, or by a loop of
+read() into a string and sendall() of that string, the way files were
+served before.
+
+reported are megabytes per second, and the CPU time used per megabyte.
+"""
+
+import optparse
+import os
+import shutil
+import socket
+import tempfile
+import time
+
+import greenhouse
+
+
+def connected_pair():
+    listener = greenhouse.Socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    client = greenhouse.Socket()
+    client.connect(listener.getsockname())
+    server = listener.accept()[0]
+    listener.close()
+    return client, server
+
+
+def run(path, size, count, use_sendfile, chunk):
+    writer, reader = connected_pair()
+    done = greenhouse.Event()
+
+    @greenhouse.schedule
+    def drain():
+        while reader.recv(262144):
+            pass
+        reader.close()
+        done.set()
+
+    start, cpu = time.time(), sum(os.times()[:2])
+    for i in xrange(count):
+        with open(path, 'rb') as fp:
+            if use_sendfile:
+                writer.sendfile(fp)
+            else:
+                while 1:
+                    data = fp.read(chunk)
+                    if not data:
+                        break
+                    writer.sendall(data)
+    writer.close()
+    done.wait()
+    elapsed, cpu = time.time() - start, sum(os.times()[:2]) - cpu
+
+    mb = size * count / 1e6
+    return mb / elapsed, cpu / mb * 1e3
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-s", "--size", type=int, default=16 << 20,
+            help="bytes in the file (default 16MB)")
+    parser.add_option("-c", "--count", type=int, default=20,
+            help="times to send the file (default 20)")
+    parser.add_option("--chunk", type=int, default=65536,
+            help="read size for the read/send loop (default 64KB)")
+    options, args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, "payload")
+        with open(path, 'wb') as fp:
+            fp.write(os.urandom(1 << 20) * (options.size >> 20))
+        size = os.path.getsize(path)
+
+        print "%-14s %10s %14s" % ("sent with", "MB/sec", "cpu ms/MB")
+        rates = []
+        for name, use_sendfile in (("read + send", False),
+                ("sendfile", True)):
+            rate, cost = run(path, size, options.count, use_sendfile,
+                    options.chunk)
+            rates.append(rate)
+            print "%-14s %10.1f %14.3f" % (name, rate, cost)
+        print "speedup: %.2fx" % (rates[1] / rates[0])
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
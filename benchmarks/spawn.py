@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""measure the cost of fanning out to lots of short-lived greenlets
+
+two workloads, each run in a forked child process so that its peak memory
+can be read on its own:
+
+- fan-out: a burst of small functions is passed to schedule(), and then the
+  scheduling greenlet waits for them all to finish
+- pool.map: many small maps, each of which starts (and closes) a pool of
+  worker greenlets
+
+these are run three ways: eager, making every greenlet up front the way
+schedule() used to; lazy, the default, where each one is made when its turn
+in the run queue comes up; and recycled, with RECYCLE_GREENLETS set so that
+finished greenlets get reused for later functions. time taken and the peak
+resident memory added are reported for each.
+"""
+
+import optparse
+import os
+import resource
+import struct
+import time
+
+import greenhouse
+from greenhouse import compat, scheduler
+
+
+def fan_out(count, eager):
+    remaining = [count]
+    done = greenhouse.Event()
+
+    def task(x):
+        x * 2
+        remaining[0] -= 1
+        if not remaining[0]:
+            done.set()
+
+    for i in xrange(count):
+        if eager:
+            greenhouse.schedule(greenhouse.greenlet(task, args=(i,)))
+        else:
+            greenhouse.schedule(task, args=(i,))
+    done.wait()
+
+
+def pool_map(count, eager):
+    if eager:
+        # make the pool's workers up front too
+        schedule = scheduler.schedule
+
+        def eager_schedule(target, *args, **kwargs):
+            if not isinstance(target, compat.greenlet):
+                target = greenhouse.greenlet(target)
+            return schedule(target, *args, **kwargs)
+        scheduler.schedule = eager_schedule
+
+    for i in xrange(0, count, 100):
+        for result in greenhouse.map(abs, xrange(100)):
+            pass
+
+
+def measure(func, count, eager, recycle):
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(rfd)
+        scheduler.RECYCLE_GREENLETS = recycle
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        func(count, eager)
+        elapsed = time.time() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(wfd, struct.pack("dl", elapsed, peak - before))
+        os._exit(0)
+
+    os.close(wfd)
+    result = struct.unpack("dl", os.read(rfd, struct.calcsize("dl")))
+    os.close(rfd)
+    os.waitpid(pid, 0)
+    return result
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--count", type=int, default=100000,
+            help="functions scheduled, or items mapped (default 100000)")
+    parser.add_option("-r", "--recycle", type=int, default=64,
+            help="RECYCLE_GREENLETS when recycling (default 64)")
+    options, args = parser.parse_args()
+
+    print "%-10s %-10s %14s %14s" % ("workload", "greenlets", "per second",
+            "peak KB added")
+    for name, func in (("fan-out", fan_out), ("pool.map", pool_map)):
+        rates = []
+        for how, eager, recycle in (("eager", True, 0), ("lazy", False, 0),
+                ("recycled", False, options.recycle)):
+            elapsed, peak = measure(func, options.count, eager, recycle)
+            rates.append(options.count / elapsed)
+            print "%-10s %-10s %14d %14d" % (name, how, rates[-1], peak)
+        print "%-10s %-10s %14s %.2fx, %.2fx" % ("", "", "speedup:",
+                rates[1] / rates[0], rates[2] / rates[0])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""measure how fast the mainloop can switch between greenlets
+
+a number of greenlets each pause() in a tight loop, so nearly all of the time
+goes to the mainloop picking the next one to run and switching into it.
+
+the same run is repeated with a no-op global hook installed, which pushes the
+mainloop onto its instrumented path, and the difference between the two is
+the cost of the hook and exception checks on every switch.
+"""
+
+import optparse
+import time
+
+import greenhouse
+
+
+def run(greenlets, switches):
+    per_glet = switches // greenlets
+    done = greenhouse.Event()
+    remaining = [greenlets]
+
+    def worker():
+        for i in xrange(per_glet):
+            greenhouse.pause()
+        remaining[0] -= 1
+        if not remaining[0]:
+            done.set()
+
+    for i in xrange(greenlets):
+        greenhouse.schedule(worker)
+
+    start = time.time()
+    done.wait()
+    return (per_glet * greenlets) / (time.time() - start)
+
+
+def noop_hook(coming_from, going_to):
+    pass
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-g", "--greenlets", type=int, default=100,
+            help="number of greenlets switching (default 100)")
+    parser.add_option("-s", "--switches", type=int, default=500000,
+            help="total number of switches to time (default 500000)")
+    options, args = parser.parse_args()
+
+    fast = run(options.greenlets, options.switches)
+
+    greenhouse.global_hook(noop_hook)
+    hooked = run(options.greenlets, options.switches)
+    greenhouse.remove_global_hook(noop_hook)
+
+    print "%-12s %14s" % ("mainloop", "switches/sec")
+    print "%-12s %14d" % ("fast path", fast)
+    print "%-12s %14d" % ("with a hook", hooked)
+    print "speedup: %.2fx" % (fast / hooked)
+
+
+if __name__ == "__main__":
+    main()
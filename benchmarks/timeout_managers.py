@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""compare the scheduler's TimeoutManager implementations
+
+with N timers already pending (spread over the minute after next), time:
+
+- insert+remove: adding a timer and then taking it back out again, which is
+  what every timed wait that doesn't time out does
+- check: a scheduler pass over the manager with nothing due yet
+- first: finding the earliest pending timer
+"""
+
+import optparse
+import random
+import time
+
+from greenhouse import scheduler
+
+
+def managers():
+    yield "bisect", scheduler.BisectingTimeoutManager
+    try:
+        import btree
+    except ImportError:
+        pass
+    else:
+        yield "btree", scheduler.BTreeTimeoutManager
+    yield "wheel", scheduler.TimingWheelTimeoutManager
+
+
+def per_op(func, count):
+    start = time.time()
+    func(count)
+    return (time.time() - start) / count * 1e6
+
+
+def bench(klass, pending, ops):
+    now = scheduler.now()
+    data = sorted((now + 60 + random.random() * 60, object())
+            for i in xrange(pending))
+    mgr = klass(data)
+    glet = object()
+    times = [now + 60 + random.random() * 60 for i in xrange(ops)]
+
+    def insert_remove(count):
+        for t in times[:count]:
+            mgr.insert(t, glet)
+            mgr.remove(t, glet)
+
+    def check(count):
+        for i in xrange(count):
+            mgr.check()
+
+    def first(count):
+        for i in xrange(count):
+            mgr.first()
+
+    return (per_op(insert_remove, ops),
+            per_op(check, ops),
+            per_op(first, ops))
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--pending", action="append", type=int,
+            help="pending timer counts to try (default 1k, 100k, 1M)")
+    parser.add_option("-o", "--ops", type=int, default=10000,
+            help="operations to time at each size (default 10000)")
+    options, args = parser.parse_args()
+
+    print "%-8s %10s %16s %12s %12s" % (
+            "manager", "pending", "insert+remove", "check", "first")
+    for pending in options.pending or (1000, 100000, 1000000):
+        for name, klass in managers():
+            results = bench(klass, pending, options.ops)
+            print "%-8s %10d %14.2fus %10.2fus %10.2fus" % (
+                    (name, pending) + results)
+
+
+if __name__ == "__main__":
+    main()
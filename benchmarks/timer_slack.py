@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""measure how timer slack cuts down on wakeups from many timeouts
+
+a number of greenlets stand in for idle connections: each one waits on an
+Event that never gets set, with a timeout of its own (spread out over a
+range, the way connections' recv timeouts are set at different moments),
+then waits again as soon as it times out.
+
+this is run for a while at a few settings of TIMER_SLACK, reporting the trips
+through the poller per second (each one a wakeup of the process), the
+timeouts handled per second, the CPU time used and how late timeouts fired
+on average.
+"""
+
+import optparse
+import os
+import random
+import time
+
+import greenhouse
+from greenhouse import scheduler
+
+
+def run(waiters, duration, timeout, spread):
+    stop = [False]
+    late = [0.0, 0]
+    done = greenhouse.Event()
+    remaining = [waiters]
+
+    def waiter(secs):
+        ev = greenhouse.Event()
+        while not stop[0]:
+            start = time.time()
+            ev.wait(secs)
+            late[0] += time.time() - start - secs
+            late[1] += 1
+        remaining[0] -= 1
+        if not remaining[0]:
+            done.set()
+
+    rand = random.Random(0)
+    for i in xrange(waiters):
+        greenhouse.schedule(waiter, args=(
+            timeout + rand.random() * spread,))
+
+    before = greenhouse.stats()["polls"]
+    start, cpu = time.time(), sum(os.times()[:2])
+    greenhouse.pause_for(duration)
+    elapsed, cpu = time.time() - start, sum(os.times()[:2]) - cpu
+    polls = greenhouse.stats()["polls"] - before
+    timeouts = late[1]
+
+    stop[0] = True
+    done.wait()
+    return (polls / elapsed, timeouts / elapsed, cpu / elapsed * 100,
+            late[0] / late[1] * 1e3)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--waiters", type=int, default=2000,
+            help="greenlets waiting with timeouts (default 2000)")
+    parser.add_option("-d", "--duration", type=float, default=2.0,
+            help="seconds to run each setting for (default 2)")
+    parser.add_option("-t", "--timeout", type=float, default=0.1,
+            help="shortest timeout in seconds (default 0.1)")
+    parser.add_option("-s", "--spread", type=float, default=0.1,
+            help="range the timeouts are spread over (default 0.1)")
+    parser.add_option("--slack", default="0,0.005,0.02",
+            help="comma-separated TIMER_SLACK values (default 0,0.005,0.02)")
+    options, args = parser.parse_args()
+
+    print "%-8s %12s %14s %8s %10s" % (
+            "slack", "polls/sec", "timeouts/sec", "cpu %", "late ms")
+    for slack in [float(s) for s in options.slack.split(",")]:
+        scheduler.TIMER_SLACK = slack
+        polls, timeouts, cpu, late = run(options.waiters, options.duration,
+                options.timeout, options.spread)
+        print "%-8g %12d %14d %8.1f %10.2f" % (
+                slack, polls, timeouts, cpu, late)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""measure write buffering on socket files, for protocol encoders
+
+a writer greenlet produces responses the way a protocol encoder would: a
+status line, a few header lines and a short body, each with its own write()
+on a makefile() file, then it pauses as if waiting on the next request. a
+reader greenlet drains the other end of the socket pair.
+
+this runs with writes unbuffered (the default), with a write buffer that
+flushes itself at the end of each mainloop pass, and with a write buffer
+flushed explicitly after every response. reported are responses per second
+and system calls per response.
+"""
+
+import optparse
+import socket
+import time
+
+import greenhouse
+
+
+RESPONSE = ["HTTP/1.1 200 OK\r\n", "Content-Type: text/plain\r\n",
+        "Content-Length: 13\r\n", "Connection: keep-alive\r\n", "\r\n",
+        "hello, world\n"]
+
+
+def run(count, bufsize, auto_flush):
+    a, b = socket.socketpair()
+    client = greenhouse.Socket(fromsock=a)
+    reader = greenhouse.Socket(fromsock=b)
+    del a, b
+    writer = client.makefile('w', bufsize)
+    writer.AUTO_FLUSH = auto_flush
+    done = greenhouse.Event()
+
+    # count the system calls, with the same overhead in every mode
+    calls = [0]
+
+    def counting(method):
+        def counted(data):
+            calls[0] += 1
+            return method(data)
+        return counted
+    writer._write_chunk = counting(writer._write_chunk)
+    writer._try_write = counting(writer._try_write)
+
+    @greenhouse.schedule
+    def drain():
+        while reader.recv(65536):
+            pass
+        reader.close()
+        done.set()
+
+    start = time.time()
+    for i in xrange(count):
+        for line in RESPONSE:
+            writer.write(line)
+        if not auto_flush:
+            writer.flush()
+        greenhouse.pause()
+    writer.close()
+    client.close()
+    done.wait()
+    elapsed = time.time() - start
+    return count / elapsed, float(calls[0]) / count
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--responses", type=int, default=100000,
+            help="responses to write (default 100000)")
+    options, args = parser.parse_args()
+
+    print "%-22s %14s %14s" % ("writes", "responses/sec", "syscalls/resp")
+    rates = []
+    for name, bufsize, auto_flush in (("unbuffered", -1, False),
+            ("buffered, auto-flush", 8192, True),
+            ("buffered, flush()", 8192, False)):
+        rate, calls = run(options.responses, bufsize, auto_flush)
+        rates.append(rate)
+        print "%-22s %14d %14.2f" % (name, rate, calls)
+    print "speedup: %.2fx auto-flush, %.2fx flush()" % (
+            rates[1] / rates[0], rates[2] / rates[0])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""measure the per-socket write queue, for many greenlets sharing a socket
+
+a number of sender greenlets share one TCP connection, each sending a short
+message and pausing, the way chat broadcasts or pub/sub fan-out look from
+the sending side. a reader greenlet drains the other end.
+
+this runs with plain sendall() (one send per message), with queue_writes()
+(one writev per mainloop pass for everything the senders queued in it), and
+with queue_writes(cork=True). reported are messages per second and messages
+per system call.
+"""
+
+import optparse
+import socket
+import time
+
+import greenhouse
+from greenhouse.io import sockets
+
+
+MESSAGE = "PUBLISH news.sports 42\r\nscore update: 3-1\r\n"
+
+
+def tcp_pair():
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    a = socket.create_connection(listener.getsockname())
+    b, address = listener.accept()
+    listener.close()
+    return greenhouse.Socket(fromsock=a), greenhouse.Socket(fromsock=b)
+
+
+def run(senders, count, queue, cork):
+    client, reader = tcp_pair()
+    if queue:
+        client.queue_writes(cork=cork)
+    done = greenhouse.Event()
+    total = senders * count * len(MESSAGE)
+
+    # count the system calls that put data on the wire
+    calls = [0]
+    writev = sockets._writev
+
+    class CountingSocket(object):
+        def __init__(self, sock):
+            self._real = sock
+
+        def __getattr__(self, name):
+            return getattr(self._real, name)
+
+        def send(self, *args):
+            calls[0] += 1
+            return self._real.send(*args)
+
+    def counted_writev(*args):
+        calls[0] += 1
+        return writev(*args)
+
+    client._sock = CountingSocket(client._sock)
+    sockets._writev = counted_writev
+
+    @greenhouse.schedule
+    def drain():
+        got = 0
+        while got < total:
+            got += len(reader.recv(65536))
+        done.set()
+
+    def sender():
+        for i in xrange(count):
+            client.sendall(MESSAGE)
+            greenhouse.pause()
+
+    start = time.time()
+    for i in xrange(senders):
+        greenhouse.schedule(sender)
+    done.wait()
+    elapsed = time.time() - start
+    sockets._writev = writev
+    client.close()
+    reader.close()
+    return senders * count / elapsed, float(senders * count) / calls[0]
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-s", "--senders", type=int, default=100,
+            help="sender greenlets (default 100)")
+    parser.add_option("-n", "--messages", type=int, default=2000,
+            help="messages per sender (default 2000)")
+    options, args = parser.parse_args()
+
+    print "%-20s %14s %14s" % ("sends", "messages/sec", "msgs/syscall")
+    rates = []
+    for name, queue, cork in (("sendall", False, False),
+            ("queue_writes", True, False),
+            ("queue_writes, cork", True, True)):
+        rate, batch = run(options.senders, options.messages, queue, cork)
+        rates.append(rate)
+        print "%-20s %14d %14.1f" % (name, rate, batch)
+    print "speedup: %.2fx queued, %.2fx queued and corked" % (
+            rates[1] / rates[0], rates[2] / rates[0])
+
+
+if __name__ == "__main__":
+    main()
@@ -38,6 +38,8 @@ def broadcast(msg, skip=None):
             sock.sendall(msg)
 
 def connection_handler(clientsock):
+    # broadcasts from many greenlets share this socket
+    clientsock.queue_writes()
     clientsock.sendall("enter your name up to 20 characters\r\n")
     name = clientsock.recv(8192).rstrip("\r\n")
 
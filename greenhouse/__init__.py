@@ -7,9 +7,12 @@ from greenhouse.compat import *
 from greenhouse.scheduler import *
 from greenhouse.util import *
 from greenhouse.pool import *
+from greenhouse.threadpool import *
 
 from greenhouse.io import *
 from greenhouse.backdoor import *
+from greenhouse.watchdog import *
+from greenhouse.cluster import *
 from greenhouse.emulation import *
 
 
@@ -0,0 +1,336 @@
+"""
+run a greenhouse server across several processes to make use of every core
+
+greenhouse runs in a single thread, so one process can only keep one CPU
+busy. a :class:`Cluster` binds a listening socket once, forks a number of
+worker processes which all accept connections from it, and then stays on in
+the parent to supervise them: it restarts workers that die, passes shutdown
+along to them so they can drain, and collects a little health information
+from each.
+
+>>> def handler(client, address):
+...     client.sendall(client.recv(8192))
+...     client.close()
+>>> Cluster(handler, ("", 9000)).serve_forever()
+"""
+from __future__ import absolute_import, with_statement
+
+import errno
+import fcntl
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+
+from . import compat, io, scheduler, threadpool, util
+
+
+__all__ = ["Cluster"]
+
+
+log = logging.getLogger("greenhouse.cluster")
+
+# how often (in seconds) the supervisor checks for exited workers
+SUPERVISE_INTERVAL = 0.1
+
+# extra time a worker gets past its drain timeout before it is killed
+KILL_GRACE = 5.0
+
+_SO_REUSEPORT = getattr(socket, "SO_REUSEPORT",
+        15 if sys.platform.startswith("linux") else None)
+
+
+def _cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+class Cluster(object):
+    """a pre-forking supervisor for a greenhouse server
+
+    :param handler:
+        function to run in a new greenlet in a worker process for each
+        accepted connection, with the connected :class:`Socket<greenhouse.io.
+        sockets.Socket>` and the remote address as arguments
+    :type handler: function
+    :param address: the address to listen on
+    :type address: tuple
+    :param workers: number of worker processes (defaults to the CPU count)
+    :type workers: int or None
+    :param backlog: the listen(2) backlog
+    :type backlog: int
+    :param reuse_port:
+        rather than sharing one listening socket, have each worker bind its
+        own with ``SO_REUSEPORT`` and let the kernel spread connections out
+    :type reuse_port: bool
+    :param drain_timeout:
+        on shutdown, the longest a worker waits for its open connections to
+        finish before it exits anyway
+    :type drain_timeout: int or float
+    :param restart_delay:
+        a worker that dies within this many seconds of starting isn't
+        replaced until this much time has passed, so that a crashing server
+        doesn't turn into a fork loop
+    :type restart_delay: int or float
+    :param health_interval: seconds between workers' health reports
+    :type health_interval: int or float
+    """
+    def __init__(self, handler, address, workers=None, backlog=128,
+            reuse_port=False, drain_timeout=30.0, restart_delay=1.0,
+            health_interval=1.0):
+        if reuse_port and _SO_REUSEPORT is None:
+            raise ValueError("SO_REUSEPORT isn't available on this platform")
+
+        self.handler = handler
+        self.address = address
+        self.workers = workers or _cpu_count()
+        self.backlog = backlog
+        self.reuse_port = reuse_port
+        self.drain_timeout = drain_timeout
+        self.restart_delay = restart_delay
+        self.health_interval = health_interval
+
+        self._listener = None
+        self._pids = {}
+        self._health = {}
+        self._stopping = False
+        self._killer = None
+        self._done = util.Event()
+
+    def start(self):
+        "bind the listening socket and fork the workers"
+        if not self.reuse_port:
+            self._listener = self._listen()
+        for i in xrange(self.workers):
+            self._spawn()
+        scheduler.schedule(self._supervise)
+
+    def stop(self):
+        """shut the cluster down
+
+        each worker stops accepting connections and exits once the ones it
+        has open are finished, or its ``drain_timeout`` runs out. use
+        :meth:`join` to wait for them all to be gone.
+        """
+        if self._stopping:
+            return
+        self._stopping = True
+        log.info("stopping %d workers" % len(self._pids))
+
+        for pid in self._pids:
+            self._signal(pid, signal.SIGTERM)
+        self._killer = scheduler.schedule_in(
+                self.drain_timeout + KILL_GRACE, self._kill, handle=True)
+
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+
+    def join(self, timeout=None):
+        """wait for the cluster to finish shutting down
+
+        .. note:: this method will block the current greenlet
+
+        :param timeout: maximum time in seconds to wait
+        :type timeout: int, float or None
+
+        :returns: bool, whether the timeout expired first
+        """
+        return self._done.wait(timeout)
+
+    def serve_forever(self):
+        """start the cluster and run it until SIGTERM or SIGINT
+
+        .. note:: this method will block the current greenlet
+        """
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *args: scheduler.schedule(self.stop))
+        self.start()
+        self.join()
+
+    def health(self):
+        """the latest health report from each worker
+
+        :returns:
+            a dict mapping worker pids to their last report, a dict with keys
+            ``accepted`` (connections so far), ``active`` (open connections),
+            ``switches``, ``run_queue`` and ``loop_lag`` (the last
+            measurement, if the worker runs :func:`start_lag_probe
+            <greenhouse.scheduler.start_lag_probe>`). a worker that hasn't
+            reported yet maps to an empty dict.
+        """
+        return dict((pid, dict(report))
+                for pid, report in self._health.iteritems())
+
+    def _listen(self):
+        sock = io.Socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, _SO_REUSEPORT, 1)
+        sock.bind(self.address)
+        sock.listen(self.backlog)
+        return sock
+
+    def _spawn(self):
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+
+        if not pid:
+            # never let a worker back out into the parent's greenlets
+            os.close(rfd)
+            code = 0
+            try:
+                self._work(wfd)
+            except BaseException:
+                log.exception("worker %d failed" % os.getpid())
+                code = 1
+            os._exit(code)
+
+        os.close(wfd)
+        self._pids[pid] = (rfd, compat.monotonic())
+        self._health[pid] = {}
+        scheduler.schedule(self._read_health, args=(pid, rfd))
+        log.info("started worker %d" % pid)
+
+    def _supervise(self):
+        while not (self._stopping and not self._pids):
+            scheduler.pause_for(SUPERVISE_INTERVAL)
+            for pid in self._pids.keys():
+                try:
+                    done, status = os.waitpid(pid, os.WNOHANG)
+                except OSError, exc:
+                    if exc.args[0] != errno.ECHILD:
+                        raise
+                    done, status = pid, 0
+                if done:
+                    self._exited(pid, status)
+
+        self._killer.cancel()
+        self._done.set()
+
+    def _exited(self, pid, status):
+        rfd, started = self._pids.pop(pid)
+        self._health.pop(pid, None)
+
+        if self._stopping:
+            log.info("worker %d finished" % pid)
+            return
+
+        log.warning("worker %d died (status %d), replacing it" % (pid, status))
+        lived = compat.monotonic() - started
+        scheduler.schedule_in(max(self.restart_delay - lived, 0), self._replace)
+
+    def _replace(self):
+        if not self._stopping:
+            self._spawn()
+
+    def _kill(self):
+        for pid in self._pids:
+            log.warning("worker %d didn't drain in time, killing it" % pid)
+            self._signal(pid, signal.SIGKILL)
+
+    def _signal(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError, exc:
+            if exc.args[0] != errno.ESRCH:
+                raise
+
+    def _read_health(self, pid, fd):
+        fp = io.File.fromfd(fd, 'rb')
+        try:
+            while 1:
+                line = fp.readline()
+                if not line:
+                    break
+                try:
+                    report = json.loads(line)
+                except ValueError:
+                    continue
+                if pid in self._health:
+                    self._health[pid] = report
+        finally:
+            fp.close()
+
+    #
+    # everything from here on runs in the worker processes
+    #
+
+    def _work(self, wfd):
+        self._reset_child()
+
+        listener = self._listener or self._listen()
+        listener.settimeout(self.health_interval)
+
+        # SIGTERM mustn't break open connections with EINTR, the accept loop
+        # notices it at its next timeout instead
+        draining = []
+        signal.signal(signal.SIGTERM, lambda *args: draining.append(True))
+        scheduler.set_ignore_interrupts()
+
+        counts = {'accepted': 0, 'active': 0}
+        drained = util.Event()
+        next_report = 0
+
+        while not draining:
+            if scheduler.now() >= next_report:
+                self._report(wfd, counts)
+                next_report = scheduler.now() + self.health_interval
+
+            try:
+                client, address = listener.accept()
+            except socket.timeout:
+                continue
+
+            counts['accepted'] += 1
+            counts['active'] += 1
+            scheduler.schedule(self._serve,
+                    args=(client, address, counts, draining, drained))
+
+        listener.close()
+        if counts['active']:
+            drained.wait(self.drain_timeout)
+        self._report(wfd, counts)
+        os.close(wfd)
+
+    def _serve(self, client, address, counts, draining, drained):
+        try:
+            self.handler(client, address)
+        finally:
+            counts['active'] -= 1
+            if draining and not counts['active']:
+                drained.set()
+
+    def _reset_child(self):
+        # nothing the parent had going carries over into a worker
+        for rfd, started in self._pids.itervalues():
+            os.close(rfd)
+        self._pids.clear()
+        self._health.clear()
+
+        scheduler._reset_after_fork()
+        threadpool.default_pool = None
+
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    def _report(self, wfd, counts):
+        stats = scheduler.stats()
+        report = dict(counts,
+                switches=stats['switches'],
+                run_queue=stats['run_queue'],
+                loop_lag=stats['loop_lag']['last'])
+
+        # never block the worker on a parent that isn't keeping up
+        flags = fcntl.fcntl(wfd, fcntl.F_GETFL)
+        if not flags & os.O_NONBLOCK:
+            fcntl.fcntl(wfd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        try:
+            os.write(wfd, json.dumps(report) + "\n")
+        except EnvironmentError, exc:
+            if exc.args[0] not in (errno.EAGAIN, errno.EPIPE):
+                raise
@@ -1,3 +1,7 @@
+import os
+import sys
+import time
+
 try:
     from greenlet import greenlet
     try:
@@ -25,3 +29,91 @@ getcurrent = greenlet.getcurrent
 main_greenlet = getcurrent()
 while main_greenlet.parent:
     main_greenlet = main_greenlet.parent
+
+
+def _clock_gettime(clock_ids):
+    # a function reading the platform's clock_gettime() clock from
+    # clock_ids (a dict of sys.platform prefixes), or None if it can't
+    for prefix, clock_id in clock_ids.iteritems():
+        if sys.platform.startswith(prefix):
+            break
+    else:
+        return None
+
+    try:
+        import ctypes
+        import ctypes.util
+        # PyDLL keeps the GIL through the call, which makes sharing the
+        # one timespec safe when other threads read the clock too
+        libc = ctypes.PyDLL(
+                ctypes.util.find_library("rt") or
+                ctypes.util.find_library("c"),
+                use_errno=True)
+        clock_gettime = libc.clock_gettime
+    except (ImportError, OSError, AttributeError):
+        return None
+
+    class timespec(ctypes.Structure):
+        _fields_ = [("tv_sec", ctypes.c_long),
+                    ("tv_nsec", ctypes.c_long)]
+
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    ts = timespec()
+    tsref = ctypes.byref(ts)
+
+    def gettime():
+        if clock_gettime(clock_id, tsref):
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+
+    try:
+        gettime()
+    except OSError:
+        return None
+    return gettime
+
+
+def _monotonic_clock():
+    if hasattr(time, "monotonic"):
+        return time.monotonic
+
+    monotonic = _clock_gettime({"linux": 1, "freebsd": 4, "darwin": 6})
+    if monotonic is not None:
+        return monotonic
+
+    # no monotonic clock available, at least never step backwards
+    last = [time.time()]
+
+    def monotonic():
+        now = time.time()
+        if now < last[0]:
+            return last[0]
+        last[0] = now
+        return now
+
+    return monotonic
+
+# seconds from an arbitrary starting point, unaffected by system clock changes
+monotonic = _monotonic_clock()
+
+
+def _cpu_clock():
+    if hasattr(time, "thread_time"):
+        return time.thread_time
+
+    # CLOCK_THREAD_CPUTIME_ID. a process-wide clock would charge the time of
+    # threadpool workers and other threads to whichever greenlet is running
+    thread_time = _clock_gettime({"linux": 3, "freebsd": 14, "darwin": 16})
+    if thread_time is not None:
+        return thread_time
+
+    if hasattr(time, "process_time"):
+        return time.process_time
+
+    # python 2's time.clock is processor time everywhere but windows
+    return time.clock
+
+# seconds of CPU time the calling thread has used, only meaningful as a
+# difference between two calls
+cpu_time = _cpu_clock()
@@ -1,7 +1,6 @@
 from __future__ import absolute_import
 
-import time
-
+from .. import scheduler
 from ..io import descriptor
 import zmq.backend
 
@@ -58,7 +57,7 @@ def wait_socks(sock_events, inmask=1, outmask=2, timeout=None):
         fd_events.append((fd, mask))
 
     while 1:
-        started = time.time()
+        started = scheduler._refresh_clock()
         active = descriptor.wait_fds(fd_events, inmask, outmask, timeout)
         if not active:
             # timed out
@@ -76,7 +75,8 @@ def wait_socks(sock_events, inmask=1, outmask=2, timeout=None):
         if results:
             return results
 
-        timeout -= time.time() - started
+        if timeout is not None:
+            timeout -= scheduler.now() - started
 
 
 def _check_events(sock, mask, inmask=1, outmask=2):
@@ -3,11 +3,12 @@ from __future__ import absolute_import
 from . import descriptor, files, ipc, sockets, ssl
 
 
-__all__ = ["Socket", "File", "pipe", "stdin", "stdout", "stderr", "wait_fds",
-        "SSLSocket", "wrap_socket"]
+__all__ = ["Socket", "File", "IncompleteRead", "pipe", "stdin", "stdout",
+        "stderr", "wait_fds", "SSLSocket", "wrap_socket"]
 
 
 File = files.File
+IncompleteRead = files.IncompleteRead
 stdin = files.stdin
 stdout = files.stdout
 stderr = files.stderr
@@ -2,7 +2,6 @@ from __future__ import absolute_import
 
 import errno
 import functools
-import time
 
 from .. import compat, scheduler
 
@@ -27,7 +26,9 @@ def wait_fds(fd_events, inmask=1, outmask=2, timeout=None):
     :param outmask: the mask to use for writable events (default 2)
     :type outmask: int
     :param timeout:
-        the maximum time to wait before raising an exception (default None)
+        the maximum time to wait before raising an exception (default None).
+        a :func:`deadline<greenhouse.scheduler.deadline>` that comes sooner
+        cuts it short the same way.
     :type timeout: int, float or None
 
     :returns:
@@ -37,6 +38,7 @@ def wait_fds(fd_events, inmask=1, outmask=2, timeout=None):
     """
     current = compat.getcurrent()
     activated = {}
+    timer = None
     poll_regs = {}
     callback_refs = {}
 
@@ -46,10 +48,9 @@ def wait_fds(fd_events, inmask=1, outmask=2, timeout=None):
             # `wait_fds` call, so re-schedule the blocked coroutine
             scheduler.schedule(current)
 
-            # if there was a timeout then also have to pull
-            # the coroutine from the timed_paused structure
-            if timeout:
-                scheduler._remove_timer(waketime, current)
+            # if there was a timeout then also have to call off the timer
+            if timer is not None:
+                timer.cancel()
 
         # in any case, set the event information
         activated.setdefault(fd, 0)
@@ -66,16 +67,17 @@ def wait_fds(fd_events, inmask=1, outmask=2, timeout=None):
         callback_refs[fd] = (readable, writable)
         poll_regs[fd] = scheduler._register_fd(fd, readable, writable)
 
-    if timeout:
-        # real timeout value, schedule ourself `timeout` seconds in the future
-        waketime = time.time() + timeout
-        scheduler.pause_until(waketime)
-    elif timeout == 0:
-        # timeout == 0, only pause for 1 loop iteration
+    if timeout == 0:
+        # only pause for 1 loop iteration
         scheduler.pause()
     else:
-        # timeout is None, it's up to _hit_poller->activate to bring us back
+        # a real timeout value or a deadline schedules ourself in the future,
+        # otherwise it's up to _hit_poller->activate to bring us back
+        timer = scheduler._wait_timer(timeout, current)
         scheduler.state.mainloop.switch()
+        if timer is not None and not activated:
+            # settle up with the timer that woke us
+            timer.cancel()
 
     for fd, reg in poll_regs.iteritems():
         readable, writable = callback_refs[fd]
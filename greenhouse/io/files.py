@@ -4,16 +4,14 @@ import contextlib
 import errno
 import fcntl
 import os
+import io
 import sys
-try:
-    from cStringIO import StringIO
-except ImportError:
-    from StringIO import StringIO
+import weakref
 
 from .. import scheduler, util
 
 
-__all__ = ["File", "stdin", "stdout", "stderr"]
+__all__ = ["File", "IncompleteRead", "stdin", "stdout", "stderr"]
 
 _open = open
 _file = file
@@ -25,14 +23,79 @@ _osclose = os.close
 _fcntl = fcntl.fcntl
 
 
+def _flush_soon(ref):
+    # the mainloop only holds a weak reference to a file with writes queued,
+    # so that dropping it gets to __del__ (and writes them) right away
+    fp = ref()
+    if fp is not None:
+        fp._flush_soon()
+
+
+def _view(data):
+    # slices of a memoryview share the data rather than copying it, which
+    # makes writing out the rest of a buffer in pieces O(n) instead of O(n^2)
+    try:
+        return memoryview(data)
+    except TypeError:
+        return data
+
+
+class IncompleteRead(EOFError):
+    """raised when the end of a file comes before an expected amount of data
+
+    .. attribute:: partial
+
+        the data that was read before the end of the file
+
+    .. attribute:: expected
+
+        the number of bytes that were asked for, or None if reading up to a
+        delimiter
+    """
+    def __init__(self, partial, expected=None):
+        super(IncompleteRead, self).__init__(partial, expected)
+        self.partial = partial
+        self.expected = expected
+
+    def __str__(self):
+        if self.expected is None:
+            return "%d bytes read before the end of the file" % (
+                    len(self.partial),)
+        return "%d bytes read, %d expected" % (
+                len(self.partial), self.expected)
+
+
 class FileBase(object):
     CHUNKSIZE = 8192
     NEWLINE = "\n"
 
+    # how much written data to collect before writing it out. files don't
+    # buffer writes unless they were made with a bufsize > 0 (or this is set)
+    WRITE_BUFSIZE = 0
+
+    # whether buffered writes go out by themselves once the mainloop's pass
+    # is over, or only when the buffer fills or on flush() and close()
+    AUTO_FLUSH = True
+
+    # made with bufsize 1: write out the buffer whenever a newline goes in
+    _line_buffered = False
+
     def __init__(self):
-        self._rbuf = StringIO()
+        self._reset_rbuf()
+        self._wbuf = bytearray()
+        self._wlock = util.Lock()
+        self._flush_queued = False
         self.encoding = None
 
+    def _set_bufsize(self, bufsize):
+        # this only sizes the write buffer. reads always go in CHUNKSIZE
+        # pieces, or makefile('r', 1) would read a byte per system call
+        if bufsize == 1:
+            self._line_buffered = True
+            self.WRITE_BUFSIZE = self.CHUNKSIZE
+        elif bufsize > 1:
+            self.WRITE_BUFSIZE = bufsize
+
     def __iter__(self):
         line = self.readline()
         while line:
@@ -45,6 +108,84 @@ class FileBase(object):
     def __exit__(self, type, value, traceback):
         self.close()
 
+    def _reset_rbuf(self):
+        # unread data is _rbuf[_rstart:_rend], and new data is read straight
+        # into the space after it
+        self._rbuf = bytearray()
+        self._rstart = self._rend = 0
+
+    def _fill(self, size):
+        # read up to size more bytes onto the end of the buffer. returns how
+        # many came in, 0 at the end of the file, or None to try again
+        buf, start, end = self._rbuf, self._rstart, self._rend
+        if len(buf) - end < size:
+            if start:
+                # move the unread data down to the front to make room
+                buf[:end - start] = buf[start:end]
+                start, end = 0, end - start
+            if len(buf) - end < size:
+                buf.extend(bytearray(max(size - len(buf) + end, len(buf))))
+
+        view = memoryview(buf)[end:end + size]
+        try:
+            count = self._readinto_chunk(view)
+        except:
+            # the traceback's frames keep the view alive, and buf can't be
+            # resized while it is, so go on with a copy of the unread data
+            self._rbuf = buf[start:end]
+            self._rstart, self._rend = 0, end - start
+            raise
+        del view
+
+        if count:
+            end += count
+        self._rstart, self._rend = start, end
+        return count
+
+    def _take(self, size):
+        data = str(buffer(self._rbuf, self._rstart, size))
+        self._consume(size)
+        return data
+
+    def _consume(self, size):
+        start = self._rstart
+        if start + size == self._rend:
+            if len(self._rbuf) > 16 * self.CHUNKSIZE:
+                # don't hang on to the room a big read needed
+                self._rbuf = bytearray()
+            self._rstart = self._rend = 0
+        else:
+            self._rstart = start + size
+
+    def _find(self, delim, max_len=-1):
+        # wait until the buffer holds delim or max_len bytes, or the file
+        # ends. returns how much to take, and whether it ends with delim
+        buf, searched = self._rbuf, 0
+        while 1:
+            start, end = self._rstart, self._rend
+            if max_len >= 0:
+                end = min(end, start + max_len)
+            index = buf.find(delim, start + searched, end)
+            if index >= 0:
+                return index - start + len(delim), True
+            if end - start == max_len:
+                return max_len, False
+
+            # only the tail could still be the start of a delimiter
+            searched = max(0, end - start - len(delim) + 1)
+
+            count = self._fill(self.CHUNKSIZE)
+            if count == 0:
+                return self._rend - self._rstart, False
+
+    def _readinto_chunk(self, view):
+        # for files that only know how to read a new string
+        data = self._read_chunk(len(view))
+        if data is None:
+            return None
+        view[:len(data)] = data
+        return len(data)
+
     def read(self, size=-1):
         """read a number of bytes from the file and return it as a string
 
@@ -57,38 +198,101 @@ class FileBase(object):
 
         :returns: a string of the read file contents
         """
-        chunksize = size < 0 and self.CHUNKSIZE or min(self.CHUNKSIZE, size)
+        if size < 0:
+            while self._fill(self.CHUNKSIZE) != 0:
+                pass
+            return self._take(self._rend - self._rstart)
+
+        while self._rend - self._rstart < size:
+            if self._fill(max(self.CHUNKSIZE,
+                    size - self._rend + self._rstart)) == 0:
+                break
+        return self._take(min(size, self._rend - self._rstart))
 
-        buf = self._rbuf
-        buf.seek(0, os.SEEK_END)
-        collected = buf.tell()
+    def readinto(self, buffer):
+        """read data from the file into a writable buffer
 
-        while 1:
-            if size >= 0 and collected >= size:
-                # we have read enough already
-                break
+        this fills the buffer unless the file ends first, reading directly
+        into the buffer whatever isn't already buffered here.
+
+        .. note:: this method will block if there is no data already available
 
-            output = self._read_chunk(chunksize)
-            if output is None:
-                continue
+        :param buffer: the buffer to fill, like a ``bytearray``
 
-            if not output:
-                # nothing more to read
+        :returns: the number of bytes placed in the buffer
+        """
+        view = memoryview(buffer)
+        got = min(len(view), self._rend - self._rstart)
+        if got:
+            view[:got] = memoryview(self._rbuf)[
+                    self._rstart:self._rstart + got]
+            self._consume(got)
+
+        while got < len(view):
+            count = self._readinto_chunk(view[got:])
+            if count == 0:
                 break
+            if count:
+                got += count
+        return got
+
+    def readexactly(self, size):
+        """read exactly a number of bytes from the file
+
+        .. note:: this method will block until enough data is available
+
+        :param size: the number of bytes to read
+        :type size: int
+
+        :returns: a string of ``size`` bytes
+
+        :raises:
+            :class:`IncompleteRead` if the file ends first, with the bytes
+            that were read in its ``partial`` attribute
+        """
+        data = self.read(size)
+        if len(data) < size:
+            raise IncompleteRead(data, size)
+        return data
+
+    def readuntil(self, delim):
+        """read from the file up to and including a delimiter
+
+        .. note:: this method will block until the delimiter arrives
 
-            collected += len(output)
-            buf.write(output)
+        :param delim: the delimiter to read up to
+        :type delim: str
+
+        :returns: a string ending with ``delim``
+
+        :raises:
+            :class:`IncompleteRead` if the file ends first, with everything
+            that was left in its ``partial`` attribute
+        """
+        size, found = self._find(delim)
+        data = self._take(size)
+        if not found:
+            raise IncompleteRead(data)
+        return data
 
-        # get rid of the old buffer
-        rc = buf.getvalue()
-        buf.seek(0)
-        buf.truncate()
+    def peek(self, size=1):
+        """look at upcoming data without consuming it
 
-        if size >= 0:
-            # leave the overflow in the buffer
-            buf.write(rc[size:])
-            return rc[:size]
-        return rc
+        .. note:: this method will block until ``size`` bytes are available
+
+        :param size: the number of bytes to look at
+        :type size: int
+
+        :returns:
+            a string of the next ``size`` bytes in the file (fewer only if the
+            file ends first), which a subsequent read will still return
+        """
+        while self._rend - self._rstart < size:
+            if self._fill(max(self.CHUNKSIZE,
+                    size - self._rend + self._rstart)) == 0:
+                break
+        size = min(size, self._rend - self._rstart)
+        return str(buffer(self._rbuf, self._rstart, size))
 
     def readline(self, max_len=-1):
         """read from the file until a newline is encountered
@@ -105,46 +309,7 @@ class FileBase(object):
             a string of the line it read from the file, including the newline
             at the end
         """
-        buf = self._rbuf
-        newline, chunksize = self.NEWLINE, self.CHUNKSIZE
-        buf.seek(0)
-
-        text = buf.read()
-        if len(text) >= max_len >= 0:
-            buf.seek(0)
-            buf.truncate()
-            buf.write(text[max_len:])
-            return text[:max_len]
-
-        while text.find(newline) < 0:
-            text = self._read_chunk(chunksize)
-            if text is None:
-                text = ''
-                continue
-            if buf.tell() + len(text) >= max_len >= 0:
-                text = buf.getvalue() + text
-                buf.seek(0)
-                buf.truncate()
-                buf.write(text[max_len:])
-                return text[:max_len]
-            if not text:
-                break
-            buf.write(text)
-        else:
-            # found a newline
-            rc = buf.getvalue()
-            index = rc.find(newline) + len(newline)
-
-            buf.seek(0)
-            buf.truncate()
-            buf.write(rc[index:])
-            return rc[:index]
-
-        # hit the end of the file, no more newlines
-        rc = buf.getvalue()
-        buf.seek(0)
-        buf.truncate()
-        return rc
+        return self._take(self._find(self.NEWLINE, max_len)[0])
 
     def readlines(self, bufsize=-1):
         """reads the entire file, producing the lines one at a time
@@ -161,16 +326,101 @@ class FileBase(object):
     def write(self, data):
         """write data to the file
 
+        with a write buffer (a ``bufsize`` was given when the file was made),
+        writes are collected and go out together when it fills (or with a
+        ``bufsize`` of 1, on a newline), on :meth:`flush` or :meth:`close`,
+        or with ``AUTO_FLUSH`` (the default)
+        as soon as the mainloop has finished its current pass through the run
+        queue. so a burst of small writes costs a single system call, and is
+        still sent by the time the writing greenlet has blocked on anything
+        else. a file dropped without a :meth:`close` writes out what it can
+        of its buffer without blocking. without a buffer the data is written
+        out before this returns.
+
         :param data:
             the data to write into the file, at the descriptor's current
             position
         :type data: str
         """
+        if not self._wbuf and len(data) >= self.WRITE_BUFSIZE:
+            # nothing for it to wait behind, and too big to be worth copying
+            with self._wlock:
+                self._write_out(data)
+            return
+
+        if isinstance(data, unicode):
+            data = str(data)
+        self._wbuf += data
+        if len(self._wbuf) >= self.WRITE_BUFSIZE or (
+                self._line_buffered and "\n" in data):
+            self.flush()
+        elif self.AUTO_FLUSH and not self._flush_queued:
+            self._flush_queued = True
+            scheduler.call_soon(_flush_soon, weakref.ref(self))
+
+    def flush(self):
+        """write out anything waiting in the write buffer
+
+        .. note:: this method may block if the data can't all go out yet
+        """
+        if self._wbuf:
+            with self._wlock:
+                data, self._wbuf = self._wbuf, bytearray()
+                self._write_out(data)
+
+    def _write_out(self, data):
+        # only with _wlock held, so that writes go out in order
+        view, written = _view(data), 0
+        try:
+            while written < len(data):
+                went = self._write_chunk(view[written:])
+                if went is None:
+                    continue
+                written += went
+        finally:
+            if written < len(data) and self.WRITE_BUFSIZE:
+                # keep what didn't go out for the next try
+                self._wbuf[:0] = data[written:]
+
+    def _flush_soon(self):
+        # called by the mainloop itself, so it can't block. whatever won't
+        # go out right away is left to a greenlet
+        self._flush_queued = False
+        data = self._wbuf
+        if not data:
+            return
+        if self._wlock.locked():
+            # a flush is already underway, and this has to come after it
+            scheduler.schedule(self.flush)
+            return
+        try:
+            sent = self._try_write(data)
+        except EnvironmentError:
+            # a flush() in a greenlet will raise it to the exception handlers
+            sent = None
+        if sent:
+            del data[:sent]
+        if data:
+            scheduler.schedule(self.flush)
+
+    def _try_write(self, data):
+        # write without blocking, returning how much went out, or None if
+        # this kind of file can't do that
+        return None
+
+    def __del__(self):
+        # the built-in file writes out its buffer when it is dropped without
+        # a close(), and so does this. it can't block here (this may be the
+        # mainloop, or the interpreter exiting), so it gets as far as it can
+        if getattr(self, "closed", False):
+            # another file may have the descriptor number by now
+            return
+        data = getattr(self, "_wbuf", None)
         while data:
-            went = self._write_chunk(data)
-            if went is None:
-                continue
-            data = data[went:]
+            sent = self._try_write(data)
+            if not sent:
+                break
+            del data[:sent]
 
     def writelines(self, lines):
         """write a sequence of strings into the file
@@ -211,8 +461,15 @@ class File(FileBase):
     to block only a single coroutine rather than the whole process.
     unfortunately filesystems tend to be very unreliable in this regard.
     """
-    def __init__(self, name, mode='rb'):
+    # reads into the buffer, made on the first read
+    _raw = None
+
+    # the events for the poller to wake us with, if it supports the file
+    _readable = _writable = None
+
+    def __init__(self, name, mode='rb', bufsize=-1):
         super(File, self).__init__()
+        self._set_bufsize(bufsize)
         self.mode = mode
         self.name = name
         self._closed = False
@@ -256,11 +513,16 @@ class File(FileBase):
 
     def _set_up_waiting(self):
         if scheduler.state.poller.supports(self):
-            self._wait = self._wait_event
             self._readable = util.Event()
             self._writable = util.Event()
+
+    def _wait(self, reading):
+        # not chosen once and stored as a bound method: that would be a
+        # reference cycle, and FileBase.__del__ would keep it from the gc
+        if self._readable is None:
+            self._wait_yield(reading)
         else:
-            self._wait = self._wait_yield
+            self._wait_event(reading)
 
     def _on_readable(self):
         self._readable.set()
@@ -291,6 +553,27 @@ class File(FileBase):
                 return None
             raise
 
+    def _try_write(self, data):
+        try:
+            return _write(self._fileno, data)
+        except EnvironmentError, err:
+            if err.args[0] in (errno.EAGAIN, errno.EINTR):
+                return 0
+            raise
+
+    def _readinto_chunk(self, view):
+        if self._raw is None:
+            self._raw = io.FileIO(self._fileno, 'r', closefd=False)
+        try:
+            count = self._raw.readinto(view)
+        except EnvironmentError, err:
+            if err.args[0] != errno.EINTR:
+                raise
+            count = None
+        if count is None:
+            self._wait(reading=True)
+        return count
+
     def _write_chunk(self, data):
         try:
             return _write(self._fileno, data)
@@ -315,14 +598,14 @@ class File(FileBase):
         :param mode: the file mode
         :type mode: str
         :param bufsize:
-            the size of read buffer to use. 0 indicates unbuffered, and < 0
-            means use the system default. defaults to -1
+            the size of the write buffer to use. <= 0 means unbuffered writes,
+            and 1 means writes buffered up to each newline. defaults to -1
 
         :returns: a new :class:`File` object connected to the descriptor
         """
         fp = object.__new__(cls)  # bypass __init__
-        fp._rbuf = StringIO()
-        fp.encoding = None
+        FileBase.__init__(fp)
+        fp._set_bufsize(bufsize)
         fp.mode = mode
         fp._fileno = fd
         fp._closed = False
@@ -333,9 +616,14 @@ class File(FileBase):
         return fp
 
     def close(self):
-        "close the file, and its underlying descriptor"
-        self._closed = True
-        _osclose(self._fileno)
+        "write out any buffered data, then close the file and its descriptor"
+        try:
+            self.flush()
+        finally:
+            # what a failed flush left behind can't go anywhere now
+            self._wbuf = bytearray()
+            self._closed = True
+            _osclose(self._fileno)
 
     @property
     def closed(self):
@@ -346,14 +634,6 @@ class File(FileBase):
         "get the file descriptor integer"
         return self._fileno
 
-    def flush(self):
-        """flush buffered writes to disk immediately
-
-        this is provided for compatibility -- this class does no write
-        buffering itself, so it is a no-op
-        """
-        return None
-
     def isatty(self):
         "return whether the file is connected to a tty or not"
         try:
@@ -376,17 +656,23 @@ class File(FileBase):
 
             the default is ``os.SEEK_SET``
         """
+        self.flush()
+        if modifier == os.SEEK_CUR:
+            # relative to where reading has got to, not the read-ahead
+            position -= self._rend - self._rstart
         os.lseek(self._fileno, position, modifier)
 
         # clear out the buffer
-        buf = self._rbuf
-        buf.seek(0)
-        buf.truncate()
+        self._reset_rbuf()
 
     def tell(self):
         "get the file descriptor's position relative to the file's beginning"
-        with _fdopen(os.dup(self._fileno)) as fp:
-            return fp.tell()
+        self.flush()
+        try:
+            position = os.lseek(self._fileno, 0, os.SEEK_CUR)
+        except OSError, exc:
+            raise IOError(*exc.args)
+        return position - (self._rend - self._rstart)
 
 
 class _StdIOFile(FileBase):
@@ -431,14 +717,15 @@ class _StdIOFile(FileBase):
         return _write(self._fileno, data)
 
     def close(self):
-        _osclose(self._fileno)
+        try:
+            self.flush()
+        finally:
+            self._wbuf = bytearray()
+            _osclose(self._fileno)
 
     def fileno(self):
         return self._fileno
 
-    def flush(self):
-        return None
-
     def isatty(self):
         try:
             return os.isatty(self._fileno)
@@ -5,11 +5,49 @@ import errno
 import fcntl
 import os
 import socket
+import stat
 import sys
+import weakref
 
 from .. import scheduler, util
 from . import files
 
+try:
+    import ctypes
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _writev = _libc.writev
+except (ImportError, OSError, AttributeError):
+    ctypes = _libc = _writev = None
+else:
+    class _iovec(ctypes.Structure):
+        _fields_ = [("iov_base", ctypes.c_void_p),
+                    ("iov_len", ctypes.c_size_t)]
+
+    _writev.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+    _writev.restype = ctypes.c_ssize_t
+
+    # reads the address out of a c_char_p (cheaper than ctypes.cast)
+    _pointer_value = ctypes.c_void_p.from_buffer
+
+if hasattr(os, "sendfile"):
+    _sendfile = os.sendfile
+elif _libc is not None and sys.platform.startswith("linux"):
+    # the BSDs' sendfile(2) takes different arguments, so only Linux's is used
+    _libc_sendfile = getattr(_libc, "sendfile64", None) or _libc.sendfile
+    _libc_sendfile.argtypes = [ctypes.c_int, ctypes.c_int,
+            ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+    _libc_sendfile.restype = ctypes.c_ssize_t
+
+    def _sendfile(out_fd, in_fd, offset, count):
+        sent = _libc_sendfile(out_fd, in_fd,
+                ctypes.byref(ctypes.c_int64(offset)), count)
+        if sent < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return sent
+else:
+    _sendfile = None
+
 
 __all__ = ["Socket"]
 
@@ -22,6 +60,19 @@ _BLOCKING_OP = frozenset((
         errno.EINPROGRESS, errno.EAGAIN, errno.EWOULDBLOCK, errno.EALREADY))
 _CANT_SEND = frozenset((errno.EWOULDBLOCK, errno.ENOTCONN))
 
+# sendall_many joins buffers adding up to less than this: copying that little
+# costs less than setting up the writev() call
+_JOIN_UNDER = 65536
+
+# the most buffers that one writev() call may be given
+try:
+    _IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (ValueError, OSError, AttributeError):
+    _IOV_MAX = 1024
+
+# the default for new sockets' ``edge_triggered`` argument
+EDGE_TRIGGERED = bool(os.environ.get("GREENHOUSE_EDGE_TRIGGERED"))
+
 
 class Socket(object):
     """a replacement class for the standard library's ``socket.socket``
@@ -31,9 +82,35 @@ class Socket(object):
     coroutine where appropriate.
 
     They provide a totally matching API, however
+
+    with the extra keyword argument ``edge_triggered=True`` (or the
+    ``GREENHOUSE_EDGE_TRIGGERED`` environment variable set), and an epoll
+    poller, the socket registers its descriptor with the poller once when it
+    is created and keeps that edge-triggered registration until it is closed,
+    rather than registering and unregistering around every blocking call.
+    readiness is remembered on the socket between calls, so after a call has
+    found it would block the next one waits without going to the kernel for
+    another ``EAGAIN``. other pollers ignore the argument.
     """
+    # the persistent registration, when the socket has one
+    _edge = None
+    _edge_ref = None
+
+    # readiness latches, only ever cleared with a persistent registration
+    _can_read = _can_write = True
+
+    # timer slack for the timeout, None for the scheduler's default
+    _slack = None
+
+    # the outgoing queue and its state, with queue_writes() on
+    _wqueue = None
+    _wqueued = _woffset = 0
+    _wdraining = _wcork = False
+    _werror = None
+
     def __init__(self, *args, **kwargs):
         sock = kwargs.pop('fromsock', None)
+        edge_triggered = kwargs.pop('edge_triggered', None)
         if sock is None:
             sock = socket._realsocket(*args, **kwargs)
         while hasattr(sock, "_sock"):
@@ -57,16 +134,99 @@ class Socket(object):
         self._readable = util.Event()
         self._writable = util.Event()
 
+        if edge_triggered is None:
+            edge_triggered = EDGE_TRIGGERED
+        if edge_triggered and scheduler.state.poller.EDGEMASK:
+            self._register_edge()
+
     def _on_readable(self):
+        self._can_read = True
         self._readable.set()
         self._readable.clear()
 
     def _on_writable(self):
+        self._can_write = True
         self._writable.set()
         self._writable.clear()
 
-    @contextlib.contextmanager
+    def _wait_readable(self):
+        if self._downgraded():
+            with self._register_for('r'):
+                timed_out = self._readable.wait(self.gettimeout(), self._slack)
+        else:
+            if self._edge:
+                # with no new edge there will still be nothing to read
+                self._can_read = False
+            timed_out = self._readable.wait(self.gettimeout(), self._slack)
+        if timed_out:
+            raise socket.timeout("timed out")
+        if scheduler.state.interrupted:
+            raise IOError(errno.EINTR, "interrupted system call")
+
+    def _wait_writable(self):
+        if self._downgraded():
+            with self._register_for('w'):
+                timed_out = self._writable.wait(self.gettimeout(), self._slack)
+        else:
+            if self._edge:
+                self._can_write = False
+            timed_out = self._writable.wait(self.gettimeout(), self._slack)
+        if timed_out:
+            raise socket.timeout("timed out")
+        if scheduler.state.interrupted:
+            raise IOError(errno.EINTR, "interrupted system call")
+
+    def _downgraded(self):
+        # a level-triggered registration of the same descriptor leaves the
+        # edge-triggered one listening only for errors, so until it goes
+        # away this socket has to wait like a level-triggered one
+        return bool(self._edge) and \
+                not scheduler.state.poller.edge_triggered(self._fileno)
+
+    def _register_edge(self):
+        fd = self._fileno
+        if not self._edge:
+            record = []
+
+            # the poller only gets weak references, so a socket that is
+            # dropped without close() still goes away (and unregisters)
+            ref = weakref.ref(self, lambda r: _drop_edge(fd, record))
+
+            def on_readable():
+                sock = ref()
+                if sock is not None:
+                    sock._on_readable()
+
+            def on_writable():
+                sock = ref()
+                if sock is not None:
+                    sock._on_writable()
+
+            record.extend([None, on_readable, on_writable, None])
+            self._edge, self._edge_ref = record, ref
+
+        # also used to re-register after the scheduler's poller is replaced
+        record = self._edge
+        try:
+            record[3] = scheduler._register_fd(
+                    fd, record[1], record[2], edge_triggered=True)
+        except EnvironmentError, exc:
+            tb = sys.exc_info()[2]
+            if exc.args and exc.args[0] in errno.errorcode:
+                raise socket.error, socket.error(*exc.args), tb
+            raise
+        record[0] = scheduler.state.poller
+        self._can_read = self._can_write = True
+
     def _registered(self, events=None):
+        if self._edge:
+            if self._edge[0] is not scheduler.state.poller:
+                self._register_edge()
+            return _already_registered
+        return self._register_for(events)
+
+    @contextlib.contextmanager
+    def _register_for(self, events):
         rd = self._on_readable if events and 'r' in events else None
         wr = self._on_writable if events and 'w' in events else None
         try:
@@ -114,18 +274,15 @@ class Socket(object):
         with self._registered('re'):
             while 1:
                 try:
-                    client, addr = self._sock.accept()
+                    if self._can_read or not self._blocking:
+                        client, addr = self._sock.accept()
+                        return type(self)(fromsock=client,
+                                edge_triggered=bool(self._edge)), addr
                 except socket.error, exc:
                     if not self._blocking or exc[0] not in _BLOCKING_OP:
                         raise
                     sys.exc_clear()
-                    if self._readable.wait(self.gettimeout()):
-                        raise socket.timeout("timed out")
-                    if scheduler.state.interrupted:
-                        raise IOError(errno.EINTR,
-                                "interrupted system call")
-                    continue
-                return type(self)(fromsock=client), addr
+                self._wait_readable()
 
     def bind(self, address):
         """set the socket to operate on an address
@@ -143,9 +300,18 @@ class Socket(object):
         After this point all operations attempted on this socket will fail, and
         once any queued data is flushed, the remote end will not receive any
         more data
+
+        with :meth:`queue_writes` on, this first waits for the queue to be
+        written out
         """
-        self._closed = True
-        self._sock = socket._closedsocket()
+        try:
+            if self._wdraining and not self._closed:
+                self.flush()
+        finally:
+            self._closed = True
+            if self._edge:
+                _drop_edge(self._fileno, self._edge)
+            self._sock = socket._closedsocket()
 
     def connect(self, address):
         """initiate a new connection to a remote socket bound to an address
@@ -165,11 +331,7 @@ class Socket(object):
                     if err not in (0, errno.EISCONN):
                         raise socket.error(err, errno.errorcode[err])
                     return
-                if self._writable.wait(self.gettimeout()):
-                    raise socket.timeout("timed out")
-                if scheduler.state.interrupted:
-                    raise IOError(errno.EINTR,
-                            "interrupted system call")
+                self._wait_writable()
 
     def connect_ex(self, address):
         """initiate a connection without blocking
@@ -189,7 +351,8 @@ class Socket(object):
 
         :returns: a new :class:`Socket`
         """
-        return type(self)(fromsock=self._sock.dup())
+        return type(self)(fromsock=self._sock.dup(),
+                edge_triggered=bool(self._edge))
 
     def fileno(self):
         """get the file descriptor
@@ -264,16 +427,18 @@ class Socket(object):
             write ``'w'``, or both ``'r+'`` (default ``'r'``)
         :type mode: str
         :param bufsize:
-            the length of the read buffer to use. 0 means unbuffered, < 0 means
-            use the system default (default -1)
+            the length of the write buffer to use. <= 0 means unbuffered
+            writes, and 1 means writes buffered up to each newline (default
+            -1)
         :type bufsize: int
 
         :returns:
             a file-like object for which reading and writing sends and receives
             data over the socket connection
         """
-        f = SocketFile(self._sock, mode)
-        f._sock.settimeout(self.gettimeout())
+        f = SocketFile(self._sock, mode, bufsize,
+                edge_triggered=bool(self._edge))
+        f._sock.settimeout(self.gettimeout(), self._slack)
         return f
 
     def recv(self, bufsize, flags=0):
@@ -299,15 +464,13 @@ class Socket(object):
                 if self._closed:
                     raise socket.error(errno.EBADF, "Bad file descriptor")
                 try:
-                    return self._sock.recv(bufsize, flags)
+                    if self._can_read or not self._blocking:
+                        return self._sock.recv(bufsize, flags)
                 except socket.error, exc:
                     if not self._blocking or exc[0] not in _BLOCKING_OP:
                         raise
                     sys.exc_clear()
-                    if self._readable.wait(self.gettimeout()):
-                        raise socket.timeout("timed out")
-                    if scheduler.state.interrupted:
-                        raise IOError(errno.EINTR, "interrupted system call")
+                self._wait_readable()
 
     def recv_into(self, buffer, bufsize=0, flags=0):
         """receive data from the connection and place it into a buffer
@@ -333,15 +496,13 @@ class Socket(object):
                 if self._closed:
                     raise socket.error(errno.EBADF, "Bad file descriptor")
                 try:
-                    return self._sock.recv_into(buffer, bufsize, flags)
+                    if self._can_read or not self._blocking:
+                        return self._sock.recv_into(buffer, bufsize, flags)
                 except socket.error, exc:
                     if not self._blocking or exc[0] not in _BLOCKING_OP:
                         raise
                     sys.exc_clear()
-                    if self._readable.wait(self.gettimeout()):
-                        raise socket.timeout("timed out")
-                    if scheduler.state.interrupted:
-                        raise IOError(errno.EINTR, "interrupted system call")
+                self._wait_readable()
 
     def recvfrom(self, bufsize, flags=0):
         """receive data on a socket that isn't necessarily a 1-1 connection
@@ -366,15 +527,13 @@ class Socket(object):
                 if self._closed:
                     raise socket.error(errno.EBADF, "Bad file descriptor")
                 try:
-                    return self._sock.recvfrom(bufsize, flags)
+                    if self._can_read or not self._blocking:
+                        return self._sock.recvfrom(bufsize, flags)
                 except socket.error, exc:
                     if not self._blocking or exc[0] not in _BLOCKING_OP:
                         raise
                     sys.exc_clear()
-                    if self._readable.wait(self.gettimeout()):
-                        raise socket.timeout("timed out")
-                    if scheduler.state.interrupted:
-                        raise IOError(errno.EINTR, "interrupted system call")
+                self._wait_readable()
 
     def recvfrom_into(self, buffer, bufsize=0, flags=0):
         """receive data on a non-TCP socket and place it in a buffer
@@ -402,15 +561,13 @@ class Socket(object):
                 if self._closed:
                     raise socket.error(errno.EBADF, "Bad file descriptor")
                 try:
-                    return self._sock.recvfrom_into(buffer, bufsize, flags=0)
+                    if self._can_read or not self._blocking:
+                        return self._sock.recvfrom_into(buffer, bufsize, flags=0)
                 except socket.error, exc:
                     if not self._blocking or exc[0] not in _BLOCKING_OP:
                         raise
                     sys.exc_clear()
-                    if self._readable.wait(self.gettimeout()):
-                        raise socket.timeout("timed out")
-                    if scheduler.state.interrupted:
-                        raise IOError(errno.EINTR, "interrupted system call")
+                self._wait_readable()
 
     def send(self, data, flags=0):
         """send data over the socket connection
@@ -428,17 +585,22 @@ class Socket(object):
             the number of bytes successfully sent, which may not necessarily be
             all the provided data
         """
+        if self._wqueue is not None:
+            if not flags:
+                self._queue((data,))
+                return len(data)
+            # flags apply to a single send, so it can't join the queue
+            self.flush()
         with self._registered('we'):
             while 1:
                 try:
-                    return self._sock.send(data)
+                    if self._can_write or not self._blocking:
+                        return self._sock.send(data, flags)
                 except socket.error, exc:
                     if exc[0] not in _CANT_SEND or not self._blocking:
                         raise
-                    if self._writable.wait(self.gettimeout()):
-                        raise socket.timeout("timed out")
-                    if scheduler.state.interrupted:
-                        raise IOError(errno.EINTR, "interrupted system call")
+                    sys.exc_clear()
+                self._wait_writable()
 
     def sendall(self, data, flags=0):
         """send data over the connection, and keep sending until it all goes
@@ -452,9 +614,317 @@ class Socket(object):
             :meth:`recv`
         :type flags: int
         """
+        if self._wqueue is not None and not flags:
+            return self._queue((data,))
         sent = self.send(data, flags)
-        while sent < len(data):
-            sent += self.send(data[sent:], flags)
+        if sent < len(data):
+            view = files._view(data)
+            while sent < len(data):
+                sent += self.send(view[sent:], flags)
+
+    def sendall_many(self, buffers):
+        """send a number of buffers over the connection, one after another
+
+        this sends the same as ``sendall("".join(buffers))`` without joining
+        the buffers together first. they go out with ``writev``, so a header
+        and a body (for instance) can leave in one system call. str and
+        bytearray buffers are sent from where they sit, anything else with
+        the buffer interface is copied into a str first. buffers that only
+        add up to a little data are simply joined.
+
+        .. note:: this method may block if the socket's send buffer is full
+
+        :param buffers: the data to send
+        :type buffers: iterable of str or bytearray
+        """
+        if self._wqueue is not None:
+            return self._queue(buffers)
+        if _writev is None:
+            return self.sendall("".join(map(_bytes, buffers)))
+        if not isinstance(buffers, (list, tuple)):
+            buffers = list(buffers)
+        if sum(map(len, buffers)) < _JOIN_UNDER:
+            return self.sendall("".join(map(_bytes, buffers)))
+        if self._closed:
+            raise socket.error(errno.EBADF, os.strerror(errno.EBADF))
+
+        iovs, keep = _iovecs(buffers)
+        first = 0
+        with self._registered('we'):
+            while first < len(iovs):
+                if self._can_write or not self._blocking:
+                    batch = iovs[first:first + _IOV_MAX]
+                    array = (_iovec * len(batch))(*batch)
+                    sent = _writev(self._fileno, array, len(batch))
+                    if sent >= 0:
+                        # skip what went, and move up the start of a buffer
+                        # that only partly did
+                        while first < len(iovs) and sent >= iovs[first][1]:
+                            sent -= iovs[first][1]
+                            first += 1
+                        if sent:
+                            iovs[first] = (iovs[first][0] + sent,
+                                    iovs[first][1] - sent)
+                        continue
+                    err = ctypes.get_errno()
+                    if err == errno.EINTR:
+                        continue
+                    if err not in _CANT_SEND or not self._blocking:
+                        raise socket.error(err, os.strerror(err))
+                self._wait_writable()
+
+    def sendfile(self, file, offset=0, count=None):
+        """send the contents of a file over the connection
+
+        regular files are handed to the kernel with ``sendfile`` (where that
+        is Linux's), so their data goes straight to the socket without being
+        copied through python strings. anything else, like pipes or objects
+        without a ``fileno()``, is read and sent a chunk at a time.
+
+        as with ``socket.sendfile`` in python 3, the file's position is left
+        just after the last byte sent, even if this raises part way through.
+
+        .. note:: this method may block if the socket's send buffer is full
+
+        :param file: the file to send, opened for reading in binary mode
+        :type file: file-like
+        :param offset: where in the file to start sending from
+        :type offset: int
+        :param count:
+            the most bytes to send. the default of None sends up to the end of
+            the file
+        :type count: int or None
+
+        :returns: the number of bytes sent
+        """
+        fileno = _regular_fileno(file)
+        if fileno is None:
+            return self._sendfile_copy(file, offset, count)
+        if self._closed:
+            raise socket.error(errno.EBADF, os.strerror(errno.EBADF))
+
+        # anything queued has to go out ahead of the file
+        self.flush()
+
+        total = 0
+        try:
+            with self._registered('we'):
+                while count is None or total < count:
+                    if self._can_write or not self._blocking:
+                        size = 1 << 30
+                        if count is not None:
+                            size = min(count - total, size)
+                        try:
+                            sent = _sendfile(self._fileno, fileno,
+                                    offset + total, size)
+                        except OSError, exc:
+                            if exc.args[0] == errno.EINTR:
+                                continue
+                            if (exc.args[0] not in _CANT_SEND
+                                    or not self._blocking):
+                                raise socket.error(*exc.args)
+                            sys.exc_clear()
+                        else:
+                            if not sent:
+                                # reached the end of the file
+                                break
+                            total += sent
+                            continue
+                    self._wait_writable()
+        finally:
+            if total and hasattr(file, "seek"):
+                file.seek(offset + total)
+        return total
+
+    def _sendfile_copy(self, file, offset, count):
+        if offset:
+            file.seek(offset)
+        total = read = 0
+        try:
+            while count is None or total < count:
+                size = 65536
+                if count is not None:
+                    size = min(count - total, size)
+                data = file.read(size)
+                if not data:
+                    break
+                read += len(data)
+                self.sendall(data)
+                total += len(data)
+        finally:
+            if read != total:
+                # put back what was read but never went out
+                file.seek(offset + total)
+        return total
+
+    def queue_writes(self, limit=262144, cork=False):
+        """send through a queue, written out once per pass of the mainloop
+
+        from here on :meth:`send`, :meth:`sendall` and :meth:`sendall_many`
+        just add their data to the socket's queue and return. once the
+        mainloop has finished its current pass through the run queue it
+        writes out everything queued with ``writev``, and if that can't all
+        go at once, a single writer greenlet finishes the job. so greenlets
+        sharing a connection can't interleave their sends, and all the sends
+        made in a pass cost one system call between them.
+
+        - each call's data goes out whole, in the order of the calls.
+        - with ``limit`` bytes queued, senders block until there is room
+          again (or the socket's timeout runs out), in the order they
+          blocked.
+        - if writing out the queue fails, what was in it is dropped, and the
+          error is raised by every send after that and by :meth:`flush`.
+
+        :param limit: how many bytes may be queued before senders block
+        :type limit: int
+        :param cork:
+            set ``TCP_CORK`` while the queue is being written out, so that the
+            kernel only sends full segments until it is empty (this only
+            applies to TCP sockets on Linux)
+        :type cork: bool
+        """
+        self._wlimit = limit
+        self._wcork = bool(cork and hasattr(socket, "TCP_CORK") and
+                self.type == socket.SOCK_STREAM and
+                self.family in (socket.AF_INET, socket.AF_INET6))
+        if self._wqueue is None:
+            self._wqueue = []
+            self._wdone = util.Event()
+            self._wadmit = util.Lock()
+
+    def flush(self):
+        """wait until everything queued by :meth:`queue_writes` is written
+
+        .. note:: this method may block until the peer takes the data
+
+        :raises: the error, if writing out the queue failed
+        """
+        if self._wqueue is None:
+            return
+        while self._wdraining:
+            self._wait_drained()
+        if self._werror is not None:
+            raise self._werror
+
+    def _queue(self, buffers):
+        if self._werror is not None:
+            raise self._werror
+        if self._closed:
+            raise socket.error(errno.EBADF, os.strerror(errno.EBADF))
+
+        buffers = [b if type(b) is str else _bytes(b) for b in buffers]
+        size = sum(map(len, buffers))
+        if not size:
+            return
+
+        if self._wadmit.locked() or (self._wqueued and
+                self._wqueued + size > self._wlimit):
+            if not self._blocking:
+                raise socket.error(errno.EWOULDBLOCK,
+                        os.strerror(errno.EWOULDBLOCK))
+            # wait for room, behind any senders already waiting
+            with self._wadmit:
+                while self._wqueued and self._wqueued + size > self._wlimit:
+                    self._wait_drained()
+
+        self._wqueue.extend(b for b in buffers if b)
+        self._wqueued += size
+        if not self._wdraining:
+            self._wdraining = True
+            scheduler.call_soon(self._drain_queue)
+
+    def _wait_drained(self):
+        if self._wdone.wait(self.gettimeout(), self._slack):
+            raise socket.timeout("timed out")
+        if self._werror is not None:
+            raise self._werror
+        if scheduler.state.interrupted:
+            raise IOError(errno.EINTR, "interrupted system call")
+
+    def _drain_queue(self):
+        # called by the mainloop, so this mustn't block. anything that won't
+        # go out right away is left to a greenlet
+        try:
+            if self._wcork:
+                self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+            if self._write_queued():
+                self._queue_drained()
+            else:
+                scheduler.schedule(self._drain_queue_blocking)
+        except EnvironmentError, exc:
+            self._queue_failed(exc)
+
+    def _drain_queue_blocking(self):
+        try:
+            with self._registered('we'):
+                while not self._write_queued():
+                    self._wait_writable()
+            self._queue_drained()
+        except EnvironmentError, exc:
+            self._queue_failed(exc)
+
+    def _write_queued(self):
+        # write as much of the queue as will go without blocking, and return
+        # whether that was all of it
+        queue = self._wqueue
+        while queue:
+            batch = queue[:_IOV_MAX]
+            wanted = sum(map(len, batch)) - self._woffset
+            if len(batch) == 1 or _writev is None:
+                try:
+                    sent = self._sock.send(buffer(batch[0], self._woffset))
+                except socket.error, exc:
+                    if exc.args[0] not in _CANT_SEND:
+                        raise
+                    sys.exc_clear()
+                    return False
+                wanted = len(batch[0]) - self._woffset
+            else:
+                iovs, keep = _iovecs(batch)
+                if self._woffset:
+                    iovs[0] = (iovs[0][0] + self._woffset,
+                            iovs[0][1] - self._woffset)
+                sent = _writev(self._fileno,
+                        (_iovec * len(iovs))(*iovs), len(iovs))
+                if sent < 0:
+                    err = ctypes.get_errno()
+                    if err in _CANT_SEND or err == errno.EINTR:
+                        return False
+                    raise socket.error(err, os.strerror(err))
+
+            # drop whatever went out from the front of the queue
+            short = sent < wanted
+            self._wqueued -= sent
+            done, sent = 0, sent + self._woffset
+            while done < len(batch) and sent >= len(batch[done]):
+                sent -= len(batch[done])
+                done += 1
+            del queue[:done]
+            self._woffset = sent
+
+            # there may be room for blocked senders now
+            self._wdone.set()
+            self._wdone.clear()
+
+            if short:
+                return False
+        return True
+
+    def _queue_drained(self):
+        if self._wcork:
+            # let out the last partial segment
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+        self._wdraining = False
+        self._wdone.set()
+        self._wdone.clear()
+
+    def _queue_failed(self, exc):
+        self._werror = exc
+        del self._wqueue[:]
+        self._wqueued = self._woffset = 0
+        self._wdraining = False
+        self._wdone.set()
+        self._wdone.clear()
 
     def sendto(self, data, *args):
         """send data to a particular address
@@ -474,14 +944,13 @@ class Socket(object):
         with self._registered('we'):
             while 1:
                 try:
-                    return self._sock.sendto(data, *args)
+                    if self._can_write or not self._blocking:
+                        return self._sock.sendto(data, *args)
                 except socket.error, exc:
                     if exc[0] not in _CANT_SEND or not self._blocking:
                         raise
-                    if self._writable.wait(self.gettimeout()):
-                        raise socket.timeout("timed out")
-                    if scheduler.state.interrupted:
-                        raise IOError(errno.EINTR, "interrupted system call")
+                    sys.exc_clear()
+                self._wait_writable()
 
     def setblocking(self, flag):
         """modify the behavior of blocking methods on the socket
@@ -523,19 +992,29 @@ class Socket(object):
             ``socket.SHUT_RD``, ``socket.SHUT_WR``, and ``socket.SHUT_RW``
             for shutting down the read end, the write end, or both respectively
         """
+        if how != socket.SHUT_RD:
+            # queued data has to go out while it still can
+            self.flush()
         return self._sock.shutdown(how)
 
-    def settimeout(self, timeout):
+    def settimeout(self, timeout, slack=None):
         """set the timeout for this specific socket
 
         :param timeout:
             the number of seconds the socket's blocking operations should block
             before raising a ``socket.timeout``
         :type timeout: float or None
+        :param slack:
+            how much longer than ``timeout`` they may be let block, so that
+            the timeouts of many sockets can fire together (see
+            :func:`schedule_at<greenhouse.scheduler.schedule_at>`). the
+            default of ``None`` uses the scheduler's ``TIMER_SLACK``.
+        :type slack: float or None
         """
         if timeout is not None:
             timeout = float(timeout)
         self._timeout = timeout
+        self._slack = slack
 
 
 def socket_fromfd(fd, family, type_, *args):
@@ -544,32 +1023,113 @@ def socket_fromfd(fd, family, type_, *args):
 
 
 class SocketFile(files.FileBase):
-    def __init__(self, sock, mode='b', bufsize=-1):
+    def __init__(self, sock, mode='b', bufsize=-1, edge_triggered=None):
         super(SocketFile, self).__init__()
-        self._sock = Socket(fromsock=sock)
+        self._set_bufsize(bufsize)
+        self._sock = Socket(fromsock=sock, edge_triggered=edge_triggered)
         self.mode = mode
-        if bufsize > 0:
-            self.CHUNKSIZE = bufsize
 
     @property
     def closed(self):
         return isinstance(self._sock._sock, socket._closedsocket)
 
     def close(self):
-        self._sock.close()
+        try:
+            self.flush()
+        finally:
+            self._wbuf = bytearray()
+            self._sock.close()
 
     def fileno(self):
         return self._sock.fileno()
 
-    def flush(self):
-        pass
-
     def _read_chunk(self, size):
         return self._sock.recv(size)
 
+    def _readinto_chunk(self, view):
+        return self._sock.recv_into(view, len(view))
+
     def _write_chunk(self, data):
         return self._sock.send(data)
 
+    def _try_write(self, data):
+        sock = self._sock
+        if getattr(sock, "_sslobj", None):
+            # SSL wants a blocked write retried with the same data, which
+            # flush() in a greenlet will do
+            return None
+        try:
+            return sock._sock.send(data)
+        except socket.error, exc:
+            if exc.args[0] in _CANT_SEND or exc.args[0] == errno.EINTR:
+                return 0
+            raise
+
+
+class _AlreadyRegistered(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, klass, value, tb):
+        pass
+
+_already_registered = _AlreadyRegistered()
+
+
+def _bytes(data):
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return str(data)
+
+
+def _iovecs(buffers):
+    # (address, length) pairs for the non-empty buffers, along with the
+    # ctypes objects that keep those addresses good
+    iovs, keep = [], []
+    for buf in buffers:
+        if isinstance(buf, bytearray):
+            if not buf:
+                continue
+            ref = (ctypes.c_char * len(buf)).from_buffer(buf)
+            address = ctypes.addressof(ref)
+        else:
+            if not isinstance(buf, str):
+                buf = _bytes(buf)
+            if not buf:
+                continue
+            ref = ctypes.c_char_p(buf)
+            address = _pointer_value(ref).value
+        keep.append(ref)
+        iovs.append((address, len(buf)))
+    return iovs, keep
+
+
+def _regular_fileno(file):
+    # the descriptor to sendfile() from, or None if it has to be copied
+    if _sendfile is None:
+        return None
+    try:
+        fileno = file.fileno()
+        if stat.S_ISREG(os.fstat(fileno).st_mode):
+            return fileno
+    except (AttributeError, ValueError, EnvironmentError):
+        pass
+    return None
+
+
+def _drop_edge(fd, record):
+    # unregister a socket's persistent registration, at most once
+    if not record:
+        return
+    poller, readable, writable, reg = record
+    del record[:]
+    if poller is scheduler.state.poller:
+        try:
+            scheduler._unregister_fd(fd, readable, writable, reg)
+        except EnvironmentError:
+            # the descriptor is already gone, and the kernel with it
+            pass
+
 
 def _dns_resolve(sock, address):
     try:
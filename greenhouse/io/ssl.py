@@ -7,7 +7,6 @@ import socket
 import _ssl
 import ssl
 import sys
-import time
 
 from greenhouse import scheduler, util
 from greenhouse.io import sockets as gsock, files as gfiles
@@ -89,6 +88,7 @@ class SSLSocket(gsock.Socket):
         clone.do_handshake_on_connect = self.do_handshake_on_connect
         clone.suppress_ragged_eofs = self.suppress_ragged_eofs
         clone._timeout = self._timeout
+        clone._slack = self._slack
         clone._blocking = self._blocking
         clone._connected = self._connected
         clone._sslobj = self._sslobj
@@ -96,8 +96,9 @@ class SSLSocket(gsock.Socket):
         clone._writable = util.Event()
         return clone
 
-    def settimeout(self, timeout):
+    def settimeout(self, timeout, slack=None):
         self._timeout = timeout
+        self._slack = slack
 
     def gettimeout(self):
         return self._timeout
@@ -167,15 +168,32 @@ class SSLSocket(gsock.Socket):
                 raise ValueError(
                     "non-zero flags not allowed in calls to sendall() on %s" %
                     self.__class__)
-            sent = 0
-            sent = self.send(data[sent:])
+            view = gfiles._view(data)
+            sent = self.send(view)
             while (sent < len(data)):
                 if self._blocking:
                     self._wait_event(tout.now, write=True)
-                sent += self.send(data[sent:])
+                sent += self.send(view[sent:])
             return sent
         else:
-            return super(SSLSocket, self).sendall(self, data, flags)
+            return super(SSLSocket, self).sendall(data, flags)
+
+    def sendall_many(self, buffers):
+        if self._sslobj:
+            # it all gets encrypted into new buffers anyway
+            return self.sendall("".join(map(gsock._bytes, buffers)))
+        return super(SSLSocket, self).sendall_many(buffers)
+
+    def sendfile(self, file, offset=0, count=None):
+        if self._sslobj:
+            # the data has to pass through here to be encrypted
+            return self._sendfile_copy(file, offset, count)
+        return super(SSLSocket, self).sendfile(file, offset, count)
+
+    def queue_writes(self, limit=262144, cork=False):
+        # the queue is written straight to the descriptor, unencrypted
+        raise ValueError("queue_writes not allowed on instances of %s" %
+                self.__class__)
 
     def recv(self, buflen=1024, flags=0):
         if self._sslobj:
@@ -325,10 +343,9 @@ class SSLSocket(gsock.Socket):
         'return a file-like object that operates on the ssl connection'
         sockfile = gsock.SocketFile.__new__(gsock.SocketFile)
         gfiles.FileBase.__init__(sockfile)
+        sockfile._set_bufsize(bufsize)
         sockfile._sock = self
         sockfile.mode = mode
-        if bufsize > 0:
-            sockfile.CHUNKSIZE = bufsize
         return sockfile
 
     def _on_readable(self):
@@ -355,7 +372,7 @@ class SSLSocket(gsock.Socket):
             raise
 
         try:
-            if event.wait(timeout):
+            if event.wait(timeout, self._slack):
                 raise socket.timeout("timed out")
         finally:
             try:
@@ -385,7 +402,7 @@ class SSLSocket(gsock.Socket):
 class _timeout(object):
     def __init__(self, timeout, exc=socket.timeout):
         if timeout is not None:
-            self._deadline = time.time() + timeout
+            self._deadline = scheduler._refresh_clock() + timeout
         self._timeout = timeout
         self._exc = exc
 
@@ -393,7 +410,7 @@ class _timeout(object):
     def now(self):
         if self._timeout is None:
             return None
-        timeout = self._deadline - time.time()
+        timeout = self._deadline - scheduler.now()
         if timeout < 0:
             raise self._exc('timed out')
         return timeout
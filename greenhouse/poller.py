@@ -2,24 +2,48 @@ from __future__ import absolute_import
 
 import collections
 import errno
+import mmap
 import operator
+import os
 import select
+import stat
+import struct
 import sys
 
+try:
+    import ctypes
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _libc.syscall.restype = ctypes.c_long
+except (ImportError, OSError, AttributeError):
+    ctypes = None
+else:
+    def _syscall(*args):
+        # syscall(2) is variadic, so ctypes can't be left to guess the
+        # widths, and every argument goes in as a full long
+        return _libc.syscall(*map(ctypes.c_long, args))
+
 _original_select = select.select
 
+_MAP_POPULATE = getattr(mmap, "MAP_POPULATE", 0x8000)
 
-class Poll(object):
-    "a greenhouse poller using the poll system call"
-    INMASK = getattr(select, 'POLLIN', 0)
-    OUTMASK = getattr(select, 'POLLOUT', 0)
-    ERRMASK = getattr(select, 'POLLERR', 0) | getattr(select, "POLLHUP", 0)
 
-    _POLLER = getattr(select, "poll", None)
+class _Registry(object):
+    """registration bookkeeping shared by all the pollers
+
+    registrations on a descriptor are refcounted by their mask, so the
+    combined mask is only ever rebuilt from the handful of distinct masks in
+    use, however many greenlets are waiting on the descriptor. and only the
+    first registration with a given mask, or the last one to go away, needs
+    it rebuilt and the OS poller updated. anything else is a counter change.
+    """
+    INMASK = OUTMASK = ERRMASK = EDGEMASK = 0
 
     def __init__(self):
-        self._poller = self._POLLER()
-        self._registry = collections.defaultdict(dict)
+        # {fd: {mask: refcount}}
+        self._registry = {}
+
+        # {counter: (fd, mask)}
+        self._masks = {}
         self._counter = 0
 
     def register(self, fd, eventmask=None):
@@ -30,17 +54,26 @@ class Poll(object):
         if eventmask is None:
             eventmask = self.INMASK | self.OUTMASK | self.ERRMASK
 
-        # get the current registrations dictionary
-        registrations = self._registry[fd]
-        registered = reduce(
-            operator.or_, registrations.itervalues(), 0)
-
-        # update registrations in the OS poller
-        self._update_registration(fd, registered, registered | eventmask)
+        counts = self._registry.get(fd)
+        if counts is None:
+            # the first registration for the descriptor
+            self._update_registration(fd, 0, eventmask)
+            self._registry[fd] = {eventmask: 1}
+        else:
+            count = counts.get(eventmask, 0)
+            if not count:
+                # a new mask, update registrations in the OS poller
+                registered = reduce(operator.or_, counts, 0)
+                mask = registered | eventmask
+                if mask & self.EDGEMASK:
+                    registered = self._edge_adjusted(registered, counts)
+                    mask = self._edge_adjusted(mask, counts, eventmask)
+                self._update_registration(fd, registered, mask)
+            counts[eventmask] = count + 1
 
         # store the registration
         self._counter += 1
-        registrations[self._counter] = eventmask
+        self._masks[self._counter] = (fd, eventmask)
 
         return self._counter
 
@@ -48,21 +81,83 @@ class Poll(object):
         # integer file descriptor
         fd = fd if isinstance(fd, int) else fd.fileno()
 
-        registrations = self._registry[fd]
-
         # allow for extra noop calls
-        if counter not in registrations:
-            self._registry.pop(fd)
+        registration = self._masks.pop(counter, None)
+        if registration is None:
+            return
+        if registration[0] != fd:
+            self._masks[counter] = registration
             return
 
-        mask = registrations.pop(counter)
-        the_rest = reduce(operator.or_, registrations.itervalues(), 0)
+        counts = self._registry[fd]
+        eventmask = registration[1]
+        count = counts.pop(eventmask) - 1
+        if count:
+            counts[eventmask] = count
+        elif not counts:
+            # the last registration for the descriptor
+            del self._registry[fd]
+            self._update_registration(fd, eventmask, 0)
+        else:
+            # the last of its mask, update the OS poller's registration
+            mask = reduce(operator.or_, counts, 0)
+            registered = mask | eventmask
+            if registered & self.EDGEMASK:
+                registered = self._edge_adjusted(
+                        registered, counts, eventmask)
+                mask = self._edge_adjusted(mask, counts)
+            self._update_registration(fd, registered, mask)
+
+    def edge_triggered(self, fd):
+        # whether the descriptor is registered edge-triggered right now,
+        # which takes nothing level-triggered registered alongside
+        counts = self._registry.get(fd)
+        if not counts:
+            return False
+        for eventmask in counts:
+            if not eventmask & self.EDGEMASK:
+                return False
+        return True
+
+    def _edge_adjusted(self, mask, counts, extra=None):
+        # the descriptor is only edge-triggered if every registration is,
+        # a level-triggered waiter must still hear about earlier readiness.
+        # meanwhile the edge-triggered registrations only keep their errors:
+        # their standing interest in IN and OUT, level-triggered, would make
+        # every poll return at once. their sockets wait with a registration
+        # of their own until the descriptor is edge-triggered again
+        edge = self.EDGEMASK
+        masks = list(counts)
+        if extra is not None:
+            masks.append(extra)
+        for eventmask in masks:
+            if not eventmask & edge:
+                break
+        else:
+            return mask
+
+        mask = 0
+        for eventmask in masks:
+            if eventmask & edge:
+                eventmask &= self.ERRMASK
+            mask |= eventmask
+        return mask
+
+
+class Poll(_Registry):
+    "a greenhouse poller using the poll system call"
+    INMASK = getattr(select, 'POLLIN', 0)
+    OUTMASK = getattr(select, 'POLLOUT', 0)
+    ERRMASK = getattr(select, 'POLLERR', 0) | getattr(select, "POLLHUP", 0)
 
-        # update the OS poller's registration
-        self._update_registration(fd, the_rest | mask, the_rest)
+    # extra flags for an edge-triggered registration, 0 where unsupported
+    EDGEMASK = 0
 
-        if not registrations:
-            self._registry.pop(fd)
+    _POLLER = getattr(select, "poll", None)
+
+    def __init__(self):
+        super(Poll, self).__init__()
+        self._poller = self._POLLER()
 
     def poll(self, timeout):
         if timeout is not None:
@@ -97,6 +192,10 @@ class Epoll(Poll):
     OUTMASK = getattr(select, 'EPOLLOUT', 0)
     ERRMASK = getattr(select, 'EPOLLERR', 0) | getattr(select, "EPOLLHUP", 0)
 
+    # python 2's select module is missing EPOLLRDHUP
+    EDGEMASK = getattr(select, 'EPOLLET', 0) | getattr(select, 'EPOLLRDHUP',
+            0x2000 if sys.platform.startswith("linux") else 0)
+
     _POLLER = getattr(select, "epoll", None)
 
     def poll(self, timeout):
@@ -110,6 +209,7 @@ class KQueue(Poll):
     INMASK = 1
     OUTMASK = 2
     ERRMASK = 0
+    EDGEMASK = 0
 
     _POLLER = getattr(select, "kqueue", None)
 
@@ -154,51 +254,316 @@ class KQueue(Poll):
                 self._poller.control(events, 0)
 
 
-class Select(object):
-    "a greenhouse poller using the select system call"
-    INMASK = 1
-    OUTMASK = 2
-    ERRMASK = 4
+class _IoUringRing(object):
+    "an io_uring instance and its memory-mapped queues, driven through ctypes"
+    SETUP, ENTER = 425, 426
+
+    # enter flags, setup flags and features
+    GETEVENTS, EXT_ARG = 1 << 0, 1 << 3
+    CQSIZE = 1 << 3
+    FEAT_SINGLE_MMAP, FEAT_EXT_ARG, FEAT_CQE_SKIP = 1 << 0, 1 << 8, 1 << 11
+
+    # mmap offsets
+    OFF_SQ_RING, OFF_CQ_RING, OFF_SQES = 0, 0x8000000, 0x10000000
+
+    # opcodes, poll flags and cqe flags
+    OP_POLL_ADD, OP_POLL_REMOVE = 6, 7
+    POLL_ADD_MULTI = 1 << 0
+    SQE_CQE_SKIP_SUCCESS = 1 << 6
+    CQE_F_MORE = 1 << 1
+    SQ_CQ_OVERFLOW = 1 << 1
+
+    # packing them with struct is much quicker than filling in ctypes
+    # structures field by field
+    SQE = struct.Struct("=BBHiQQIIQ24x")
+    CQE = struct.Struct("=QiI")
+
+    def __init__(self, entries, cq_entries):
+        params = _io_uring_params(flags=self.CQSIZE, cq_entries=cq_entries)
+        fd = _syscall(self.SETUP, entries, ctypes.addressof(params))
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise EnvironmentError(err, os.strerror(err))
+        self.fd = fd
+
+        if not params.features & self.FEAT_EXT_ARG:
+            raise EnvironmentError(errno.ENOSYS,
+                    "io_uring_enter(2) doesn't take a timeout here")
+
+        sq, cq = params.sq_off, params.cq_off
+        sq_size = sq.array + params.sq_entries * 4
+        cq_size = cq.cqes + params.cq_entries * self.CQE.size
+        # sqe flags that silence the completion of requests that succeed
+        self.quiet = self.SQE_CQE_SKIP_SUCCESS \
+                if params.features & self.FEAT_CQE_SKIP else 0
+
+        if params.features & self.FEAT_SINGLE_MMAP:
+            sq_size = cq_size = max(sq_size, cq_size)
+            self._sq_map = self._cq_map = self._map(sq_size, self.OFF_SQ_RING)
+        else:
+            self._sq_map = self._map(sq_size, self.OFF_SQ_RING)
+            self._cq_map = self._map(cq_size, self.OFF_CQ_RING)
+        self._sqe_map = self._map(
+                params.sq_entries * self.SQE.size, self.OFF_SQES)
+
+        sq_base = ctypes.addressof(ctypes.c_char.from_buffer(self._sq_map))
+        cq_base = ctypes.addressof(ctypes.c_char.from_buffer(self._cq_map))
+        u32 = ctypes.c_uint32
+
+        self.sq_head = u32.from_address(sq_base + sq.head)
+        self.sq_tail = u32.from_address(sq_base + sq.tail)
+        self.sq_flags = u32.from_address(sq_base + sq.flags)
+        self.sq_mask = u32.from_address(sq_base + sq.ring_mask).value
+        self.sq_entries = params.sq_entries
+        self.sqes = self._sqe_map
+
+        # the indirection array never changes, sqe i always goes in slot i
+        array = (u32 * params.sq_entries).from_address(sq_base + sq.array)
+        for i in xrange(params.sq_entries):
+            array[i] = i
+
+        self.cq_head = u32.from_address(cq_base + cq.head)
+        self.cq_tail = u32.from_address(cq_base + cq.tail)
+        self.cq_mask = u32.from_address(cq_base + cq.ring_mask).value
+        self.cqes = self._cq_map
+        self.cqes_offset = cq.cqes
+
+        self._ts = _kernel_timespec()
+        self._arg = _io_uring_getevents_arg(ts=ctypes.addressof(self._ts))
+        self._argaddr = ctypes.addressof(self._arg)
+        self._argsize = ctypes.sizeof(self._arg)
+
+    def _map(self, size, offset):
+        return mmap.mmap(self.fd, size, mmap.MAP_SHARED | _MAP_POPULATE,
+                mmap.PROT_READ | mmap.PROT_WRITE, offset=offset)
+
+    def __del__(self):
+        if getattr(self, "fd", None) is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def enter(self, to_submit, min_complete, timeout=None):
+        flags, arg, argsize = self.GETEVENTS, 0, 0
+        if timeout is not None and min_complete:
+            self._ts.tv_sec = int(timeout)
+            self._ts.tv_nsec = int((timeout - int(timeout)) * 1e9)
+            flags |= self.EXT_ARG
+            arg, argsize = self._argaddr, self._argsize
+        result = _syscall(self.ENTER, self.fd, to_submit, min_complete,
+                flags, arg, argsize)
+        if result < 0:
+            err = ctypes.get_errno()
+            if err != errno.ETIME:
+                raise EnvironmentError(err, os.strerror(err))
+            result = to_submit
+        return result
+
+
+if ctypes is not None:
+    class _io_sqring_offsets(ctypes.Structure):
+        _fields_ = [(name, ctypes.c_uint32) for name in (
+                "head", "tail", "ring_mask", "ring_entries", "flags",
+                "dropped", "array", "resv1")] + [
+                ("user_addr", ctypes.c_uint64)]
+
+    class _io_cqring_offsets(ctypes.Structure):
+        _fields_ = [(name, ctypes.c_uint32) for name in (
+                "head", "tail", "ring_mask", "ring_entries", "overflow",
+                "cqes", "flags", "resv1")] + [
+                ("user_addr", ctypes.c_uint64)]
+
+    class _io_uring_params(ctypes.Structure):
+        _fields_ = [(name, ctypes.c_uint32) for name in (
+                "sq_entries", "cq_entries", "flags", "sq_thread_cpu",
+                "sq_thread_idle", "features", "wq_fd")] + [
+                ("resv", ctypes.c_uint32 * 3),
+                ("sq_off", _io_sqring_offsets),
+                ("cq_off", _io_cqring_offsets)]
+
+    class _kernel_timespec(ctypes.Structure):
+        _fields_ = [("tv_sec", ctypes.c_int64), ("tv_nsec", ctypes.c_int64)]
+
+    class _io_uring_getevents_arg(ctypes.Structure):
+        _fields_ = [
+                ("sigmask", ctypes.c_uint64),
+                ("sigmask_sz", ctypes.c_uint32),
+                ("pad", ctypes.c_uint32),
+                ("ts", ctypes.c_uint64)]
+
+
+def _io_uring_ring():
+    # multishot polls need linux 5.13
+    if ctypes is None or not sys.platform.startswith("linux"):
+        return None
+    try:
+        version = tuple(map(int, os.uname()[2].split("-")[0].split(".")[:2]))
+        if version < (5, 13):
+            return None
+        _IoUringRing(1, 2).__del__()
+    except (EnvironmentError, ValueError, AttributeError):
+        return None
+    return _IoUringRing
+
+
+class IoUringPoller(_Registry):
+    """a greenhouse poller using linux's io_uring
+
+    every registered descriptor gets a single multishot poll request, which
+    keeps delivering completions until it is removed, so there is nothing to
+    re-arm after each event. registration changes go into the submission
+    queue and reach the kernel in one batch with the next :meth:`poll`.
+
+    needs linux 5.13 or later. instantiating it anywhere else raises an
+    ``EnvironmentError``, and :func:`best` never picks it on its own.
+    """
+    INMASK = getattr(select, 'POLLIN', 0)
+    OUTMASK = getattr(select, 'POLLOUT', 0)
+    ERRMASK = getattr(select, 'POLLERR', 0) | getattr(select, "POLLHUP", 0)
+    EDGEMASK = 0
 
-    def __init__(self):
-        self._registry = collections.defaultdict(dict)
-        self._currentmasks = {}
-        self._counter = 0
+    ENTRIES = 256
+    CQ_ENTRIES = 4096
 
-    def register(self, fd, eventmask=None):
-        # integer file descriptor
-        fd = fd if isinstance(fd, int) else fd.fileno()
+    # marks the user_data of removal requests
+    _REMOVAL = 1 << 63
 
-        # mask nothing by default
-        if eventmask is None:
-            eventmask = self.INMASK | self.OUTMASK | self.ERRMASK
+    _POLLER = _io_uring_ring()
 
-        # store the registration
-        self._counter += 1
-        self._registry[fd][self._counter] = eventmask
+    def __init__(self):
+        if self._POLLER is None:
+            raise EnvironmentError(errno.ENOSYS, "io_uring isn't available")
+        super(IoUringPoller, self).__init__()
+        self._ring = self._POLLER(self.ENTRIES, self.CQ_ENTRIES)
 
-        # update the full mask
-        self._currentmasks[fd] = self._currentmasks.get(fd, 0) | eventmask
+        # {fd: poll request token}, {token: (fd, mask)}
+        self._tokens = {}
+        self._polls = {}
+        self._next_token = 1
+        self._unsubmitted = 0
 
-        return self._counter
+        # tokens of replaced polls that haven't finished yet
+        self._removing = set()
 
-    def unregister(self, fd, counter):
-        # integer file descriptor
-        fd = fd if isinstance(fd, int) else fd.fileno()
+    def poll(self, timeout):
+        ring = self._ring
+        if timeout is not None and timeout <= 0:
+            self._unsubmitted -= ring.enter(self._unsubmitted, 0)
+        else:
+            self._unsubmitted -= ring.enter(self._unsubmitted, 1, timeout)
+
+        events = []
+        polls = self._polls
+        while 1:
+            head, tail = ring.cq_head.value, ring.cq_tail.value
+            if head == tail:
+                break
+            cqes, mask = ring.cqes, ring.cq_mask
+            unpack, offset, size = ring.CQE.unpack_from, ring.cqes_offset, \
+                    ring.CQE.size
+            while head != tail:
+                token, result, flags = unpack(
+                        cqes, offset + (head & mask) * size)
+                head = (head + 1) & 0xffffffff
+
+                poll = polls.get(token)
+                if poll is None:
+                    if token & self._REMOVAL:
+                        self._removed(token & ~self._REMOVAL, result)
+                    elif not flags & ring.CQE_F_MORE:
+                        # the replaced poll has finished for good
+                        self._removing.discard(token)
+                    continue
+                fd, eventmask = poll
+                events.append((fd, result if result > 0 else self.ERRMASK))
+
+                if not flags & ring.CQE_F_MORE:
+                    # the kernel ended the multishot poll, so start another
+                    del polls[token]
+                    del self._tokens[fd]
+                    self._add(fd, eventmask)
+            ring.cq_head.value = head
+
+            # completions that didn't fit in the ring wait in the kernel
+            if not ring.sq_flags.value & ring.SQ_CQ_OVERFLOW:
+                break
+            self._unsubmitted -= ring.enter(self._unsubmitted, 0)
+
+        return events
 
-        # just drop it from the registrations dict
-        self._registry.get(fd, {}).pop(counter, None)
+    def supports(self, fd):
+        if not isinstance(fd, int):
+            fd = fd.fileno()
 
-        # rewrite the full mask
-        newmask = reduce(
-            operator.or_, self._registry[fd].itervalues(), 0)
-        if newmask:
-            self._currentmasks[fd] = newmask
+        # like epoll, don't pretend regular files ever have to wait
+        try:
+            mode = os.fstat(fd).st_mode
+        except EnvironmentError:
+            return False
+        return not (stat.S_ISREG(mode) or stat.S_ISDIR(mode))
+
+    def _update_registration(self, fd, from_mask, to_mask):
+        if from_mask == to_mask:
+            return
+        token = self._tokens.pop(fd, None)
+        if token is not None:
+            del self._polls[token]
+            self._removing.add(token)
+            self._remove(token)
+        if to_mask:
+            self._add(fd, to_mask)
+
+    def _remove(self, token):
+        # only a failed removal needs to be heard about
+        self._submit(self._ring.OP_POLL_REMOVE, -1, 0, token,
+                token | self._REMOVAL, flags=self._ring.quiet)
+
+    def _removed(self, token, result):
+        # a poll that is busy posting a completion can't be removed just
+        # then, and until it is gone it keeps its file open
+        if result == -errno.EALREADY and token in self._removing:
+            self._remove(token)
         else:
-            self._currentmasks.pop(fd, 0)
+            self._removing.discard(token)
+
+    def _add(self, fd, eventmask):
+        token = self._next_token
+        self._next_token += 1
+        self._tokens[fd] = token
+        self._polls[token] = (fd, eventmask)
+        self._submit(self._ring.OP_POLL_ADD, fd, eventmask, 0, token,
+                self._ring.POLL_ADD_MULTI)
+
+    def _submit(self, opcode, fd, eventmask, addr, user_data, length=0,
+            flags=0):
+        ring = self._ring
+        tail = ring.sq_tail.value
+        if tail - ring.sq_head.value & 0xffffffff >= ring.sq_entries:
+            # the submission queue is full, hand it over to the kernel now
+            self._unsubmitted -= ring.enter(self._unsubmitted, 0)
+
+        ring.SQE.pack_into(ring.sqes, (tail & ring.sq_mask) * ring.SQE.size,
+                opcode, flags, 0, fd, 0, addr, length, eventmask, user_data)
+
+        ring.sq_tail.value = (tail + 1) & 0xffffffff
+        self._unsubmitted += 1
+
 
-        if not self._registry[fd]:
-            self._registry.pop(fd)
+class Select(_Registry):
+    "a greenhouse poller using the select system call"
+    INMASK = 1
+    OUTMASK = 2
+    ERRMASK = 4
+    EDGEMASK = 0
+
+    def __init__(self):
+        super(Select, self).__init__()
+        self._currentmasks = {}
+
+    def _update_registration(self, fd, from_mask, to_mask):
+        if to_mask:
+            self._currentmasks[fd] = to_mask
+        else:
+            self._currentmasks.pop(fd, None)
 
     def poll(self, timeout):
         rlist, wlist, xlist = [], [], []
@@ -23,14 +23,21 @@ class OneWayPool(object):
     :type func: function
     :param size: the number of workers to run
     :type size: int
+    :param handoff:
+        create the pool's queues with ``handoff=True``, so that handing an
+        item to an idle worker (or a result to a waiting :meth:`get
+        <Pool.get>`) switches straight to it. see :class:`Queue
+        <greenhouse.util.Queue>`.
+    :type handoff: bool
 
     this class can be used as a context manager, in which case :meth:`start` is
     called at entry and :meth:`close` is called on exit from the context.
     """
-    def __init__(self, func, size=10):
+    def __init__(self, func, size=10, handoff=False):
         self.func = func
         self.size = size
-        self.inq = util.Queue()
+        self.handoff = handoff
+        self.inq = util.Queue(handoff=handoff)
         self._closing = False
 
     def start(self):
@@ -46,8 +53,14 @@ class OneWayPool(object):
         work has been completed it will set the :attr:`closed` attribute
         """
         self._closing = True
-        for i in xrange(self.size):
-            self.inq.put(_STOP)
+
+        # this is __del__ too, so it mustn't switch away
+        handoff, self.inq._handoff = self.inq._handoff, False
+        try:
+            for i in xrange(self.size):
+                self.inq.put(_STOP)
+        finally:
+            self.inq._handoff = handoff
 
     __del__ = close
 
@@ -119,7 +132,7 @@ class Pool(OneWayPool):
     """
     def __init__(self, *args, **kwargs):
         super(Pool, self).__init__(*args, **kwargs)
-        self.outq = util.Queue()
+        self.outq = util.Queue(handoff=self.handoff)
 
     def __iter__(self):
         while True:
@@ -152,6 +165,10 @@ class Pool(OneWayPool):
             :class:`PoolClosed` if the pool was closed before a result could be
             produced for thie call
 
+        :raises:
+            ``Queue.Empty`` if a :func:`deadline
+            <greenhouse.scheduler.deadline>` passes first
+
         :raises: any exception that was raised inside the worker function
         """
         if self.closed:
@@ -172,7 +189,7 @@ class Pool(OneWayPool):
         blocked on :meth:`get`.
         """
         super(Pool, self).close()
-        for waiter, waketime in self.outq._waiters:
+        for waiter, timer in self.outq._waiters:
             scheduler.schedule_exception(PoolClosed(), waiter)
 
     @property
@@ -194,8 +211,8 @@ class OrderedPool(Pool):
     this class supports context manager usage and iteration just as its parent
     class does.
     """
-    def __init__(self, func, size=10):
-        super(OrderedPool, self).__init__(func, size)
+    def __init__(self, func, size=10, handoff=False):
+        super(OrderedPool, self).__init__(func, size, handoff)
         self._putcount = 0
         self._getcount = 0
         self._cache = {}
@@ -234,6 +251,10 @@ class OrderedPool(Pool):
             :class:`PoolClosed` if the pool was closed before a result could be
             produced for thie call
 
+        :raises:
+            ``Queue.Empty`` if a :func:`deadline
+            <greenhouse.scheduler.deadline>` passes first
+
         :raises: any exception that was raised inside the worker function
         """
         if self.closed:
@@ -1,8 +1,12 @@
 import bisect
 import collections
 import errno
+import fcntl
 import logging
+import math
+import os
 import sys
+import thread
 import time
 import weakref
 
@@ -17,13 +21,83 @@ __all__ = ["pause", "pause_until", "pause_for", "schedule", "schedule_at",
            "handle_exception", "greenlet", "global_hook", "remove_global_hook",
            "local_incoming_hook", "remove_local_incoming_hook",
            "local_outgoing_hook", "remove_local_outgoing_hook",
-           "set_ignore_interrupts", "reset_poller"]
+           "set_ignore_interrupts", "reset_poller", "now", "schedule_idle",
+           "PRIORITY_HIGH", "PRIORITY_NORMAL", "PRIORITY_LOW",
+           "PRIORITY_IDLE", "stats", "start_lag_probe", "stop_lag_probe",
+           "start_accounting", "stop_accounting", "top", "call_threadsafe",
+           "submit_threadsafe", "start_loop_thread", "stop_loop_thread",
+           "handoff", "call_later", "call_soon", "RecurringTimer", "deadline",
+           "Deadline"]
 
 BTREE_ORDER = 64
 
+WHEEL_RESOLUTION = 0.001
+WHEEL_SLOT_BITS = 8
+WHEEL_LEVELS = 4
+
+# scheduling priority classes, most urgent first
+PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW, PRIORITY_IDLE = range(4)
+
+# relative share of each pass through the run queue that each class gets
+# while they are all busy, and the number of greenlets per unit of weight
+PRIORITY_WEIGHTS = (4, 2, 1)
+PRIORITY_BATCH = 32
+
+# the most finished greenlets to keep around for running later functions
+# passed to schedule(). 0 (the default) turns recycling off. a recycled
+# greenlet is the same greenlet object from one function to the next, so
+# greenlet-local data (like util.Local) carries over between them.
+RECYCLE_GREENLETS = 0
+
+# set GREENHOUSE_NO_STATS in the environment to leave out the counters
+STATS = not os.environ.get("GREENHOUSE_NO_STATS")
+
+# while there are greenlets that are runnable without any I/O (they called
+# pause() or were woken by another greenlet), the mainloop may skip the
+# non-blocking poll between passes through the run queue. the number of
+# passes it skips grows while polls keep coming back empty and drops back to
+# 0 as soon as one finds events, but it never goes more than POLL_SKIP_PASSES
+# passes or POLL_SKIP_INTERVAL seconds without polling. the default of 0
+# polls between every pass, so that I/O is never more than one pause() away.
+POLL_SKIP_PASSES = 0
+POLL_SKIP_INTERVAL = 0.0005
+
+# timeouts (schedule_at and schedule_in, and the timeouts on blocking calls)
+# may have their waketimes rounded up to the next multiple of a "slack", so
+# that the many timeouts of many connections land on the same few times and
+# fire together, in one trip through the poller. this is the slack used
+# wherever one isn't given explicitly. the default of 0 fires every timeout
+# at its own time.
+TIMER_SLACK = 0.0
+
+# handoff() puts the greenlet it switches away from at the front of the run
+# queue, so that a producer and consumer can keep trading places without the
+# mainloop polling in between. it does this at most HANDOFF_LIMIT times per
+# pass through the run queue, after which the greenlet waits for the next
+# pass like anything else that pause()s.
+HANDOFF_LIMIT = 64
+
+# upper bounds (in seconds) of the loop lag histogram buckets
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
 
 log = logging.getLogger("greenhouse.scheduler")
 
+# grab these before any monkey-patching can make them cooperative
+_allocate_lock = thread.allocate_lock
+_start_new_thread = thread.start_new_thread
+_sleep = time.sleep
+_time = time.time
+
+try:
+    from concurrent.futures import CancelledError, TimeoutError
+except ImportError:
+    class CancelledError(Exception):
+        "the call behind a :class:`Future` was cancelled"
+
+    class TimeoutError(Exception):
+        "a :class:`Future` wasn't done in time"
+
 state = type('GreenhouseState', (), {})()
 
 # from events that have triggered
@@ -35,9 +109,18 @@ state.paused = []
 # map of file numbers to the sockets/files on that descriptor
 state.descriptormap = {}
 
+# {fd: set of callbacks} from the edge-triggered registrations
+state.edge_callbacks = {}
+
 # lined up to run right away
 state.to_run = collections.deque()
 
+# greenlets that were given a priority other than normal, and the queues
+# that runnable greenlets wait in by priority once any of them exist
+state.priorities = weakref.WeakKeyDictionary()
+state.prioritized = False
+state.class_queues = tuple(collections.deque() for i in xrange(4))
+
 # exceptions queued up for scheduled coros
 state.to_raise = weakref.WeakKeyDictionary()
 
@@ -50,20 +133,418 @@ state.global_hooks = []
 state.local_to_hooks = weakref.WeakKeyDictionary()
 state.local_from_hooks = weakref.WeakKeyDictionary()
 
+# set whenever there may be hooks to run or exceptions to throw in, which
+# moves the mainloop off of its fast path until they are all gone again
+state.instrumented = False
+
+# calls handed in from other threads, and the pipe they use to wake the loop
+state.threadsafe_calls = collections.deque()
+state.wakeup_fds = None
+state.wakeup_pending = False
+
+# the OS thread the mainloop runs in
+state.loop_thread = thread.get_ident()
+
 # tracks interrupts
 state.interrupted = False
 state.ignore_interrupts = False
 
+# the loop clock, a monotonic time updated once per trip through the poller
+state.clock = compat.monotonic()
+
+# running totals for stats(), and the loop lag probe's findings
+state.counters = dict.fromkeys(("switches", "polls", "polls_skipped",
+        "poll_time", "spawned", "finished", "callbacks"), 0)
+state.lag_probe = None
+state.lag_histogram = [0] * (len(LAG_BUCKETS) + 1)
+state.lag_last = state.lag_max = 0.0
+
+# finished greenlets waiting for another function to run
+state.idle_workers = []
+
+# the innermost deadline() scope each greenlet is in
+state.deadlines = weakref.WeakKeyDictionary()
+
+# handoffs that have jumped the run queue this pass
+state.handoffs = 0
+
+# poll skipping: passes that may go by without a poll, passes that have so
+# far, and the time.time() by which the next poll is due regardless
+state.poll_skip = 0
+state.poll_skipped = 0
+state.poll_due = 0.0
+
+# the mainloop's heartbeat: the greenlet it last switched to (None while it is
+# in the poller) and a count of passes through the run queue
+state.running = None
+state.passes = 0
+
+# per-greenlet accounting: [cpu seconds, switches in, runnable seconds] rows,
+# which greenlets given the same tag share
+state.accounting = False
+state.account_rows = weakref.WeakKeyDictionary()
+state.tag_rows = {}
+
+
+# TimerHandle states
+_PENDING, _QUEUED, _DONE, _CANCELLED = range(4)
+
+
+class TimerHandle(object):
+    """a timer set up by :func:`schedule_at` or one of its relatives
+
+    these are returned from the timer-scheduling functions when they are
+    passed ``handle=True``. the ``waketime`` attribute is in terms of the
+    :func:`loop clock<now>`, not a unix timestamp.
+
+    a timer is :attr:`active` from when it is scheduled until its target is
+    actually switched to. :meth:`cancel` during that window is O(1); if the
+    timer had already fired but the target hadn't yet run, it is left in the
+    run queue as a tombstone and skipped over.
+    """
+    __slots__ = ["waketime", "target", "exception", "_state"]
+
+    def __init__(self, waketime, target, exception=None):
+        self.waketime = waketime
+        self.target = target
+        self.exception = exception
+        self._state = _PENDING
+
+    def __repr__(self):
+        return "<%s for %r at %r (%s)>" % (
+                type(self).__name__, self.target, self.waketime,
+                ("pending", "queued", "done", "cancelled")[self._state])
+
+    @property
+    def active(self):
+        "whether the timer has yet to wake its target (and wasn't cancelled)"
+        return self._state < _DONE
+
+    def cancel(self):
+        """prevent the timer from waking its target
+
+        :returns:
+            ``True`` if the timer was stopped, ``False`` if it had already
+            woken its target or had been cancelled before
+        """
+        if self._state == _PENDING:
+            self._state = _CANCELLED
+            state.timed_paused.cancel(self.waketime, self)
+            return True
+        if self._state == _QUEUED:
+            self._state = _CANCELLED
+            return True
+        return False
+
+    def _deliver(self):
+        # called by the mainloop when it pulls the timer off the run queue
+        if self._state != _QUEUED:
+            return None
+        self._state = _DONE
+        if self.exception is not None:
+            _raise_in(self.target, self.exception)
+        return self.target
+
+
+class CallbackHandle(TimerHandle):
+    """a callback set up by :func:`call_later` or :func:`call_soon`
+
+    this works like a :class:`TimerHandle`, except that when it comes up in
+    the run queue the mainloop calls ``target`` with ``args`` itself, without
+    a greenlet to switch to.
+    """
+    __slots__ = ["args"]
+
+    def __init__(self, waketime, func, args=()):
+        super(CallbackHandle, self).__init__(waketime, func)
+        self.args = args
+
+    def _deliver(self):
+        if self._state != _QUEUED:
+            return
+        self._state = _DONE
+        if STATS:
+            state.counters["callbacks"] += 1
+        try:
+            self.target(*self.args)
+        except Exception:
+            klass, exc, tb = sys.exc_info()
+            handle_exception(klass, exc, tb, coro=state.mainloop)
+            del klass, exc, tb
+
+
+class RecurringTimer(object):
+    """call a function in the mainloop at a regular interval
+
+    unlike :func:`schedule_recurring` this makes no greenlets at all: a single
+    :class:`CallbackHandle` is re-armed after each call, and ``func`` runs
+    inside the mainloop, so it must not block.
+
+    each call is scheduled an ``interval`` after the previous one was *due*,
+    not after it actually ran, so lateness doesn't accumulate into drift.
+
+    :param interval: seconds between calls
+    :type interval: int or float
+    :param func: the function to call
+    :type func: function
+    :param args: positional arguments for ``func``
+    :type args: tuple
+    :param maxtimes: stop after this many calls (0, the default, for no limit)
+    :type maxtimes: int
+    :param catch_up:
+        what to do about calls that came due while the loop was held up. if
+        ``True`` every one of them is still made, one per pass through the run
+        queue, until the timer is back on schedule. by default they are
+        dropped (and counted in :attr:`missed`) and the timer carries on from
+        the next interval boundary.
+    :type catch_up: bool
+
+    the :attr:`count` attribute holds the number of calls made so far.
+    """
+    def __init__(self, interval, func, args=(), maxtimes=0, catch_up=False):
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        self.interval = interval
+        self.func = func
+        self.args = args
+        self.maxtimes = maxtimes
+        self.catch_up = catch_up
+        self.count = 0
+        self.missed = 0
+        self._stopped = False
+        self._handle = CallbackHandle(_refresh_clock() + interval, self._fire)
+        state.timed_paused.insert(self._handle.waketime, self._handle)
+
+    @property
+    def active(self):
+        "whether the timer will make any more calls"
+        return not self._stopped
+
+    def cancel(self):
+        """stop the timer from making any more calls
+
+        :returns:
+            ``True`` if the timer was stopped, ``False`` if it had already
+            finished or been cancelled
+        """
+        if self._stopped:
+            return False
+        self._stopped = True
+        self._handle.cancel()
+        return True
+
+    def _fire(self):
+        self.count += 1
+        try:
+            self.func(*self.args)
+        except Exception:
+            klass, exc, tb = sys.exc_info()
+            handle_exception(klass, exc, tb, coro=state.mainloop)
+            del klass, exc, tb
+
+        # func may have cancelled the timer itself
+        if self._stopped:
+            return
+        if self.count == self.maxtimes:
+            self._stopped = True
+            return
+
+        due = self._handle.waketime + self.interval
+        if due <= state.clock and not self.catch_up:
+            skipped = int((state.clock - due) // self.interval) + 1
+            self.missed += skipped
+            due += skipped * self.interval
+
+        self._handle.waketime = due
+        self._handle._state = _PENDING
+        state.timed_paused.insert(due, self._handle)
+
+
+class Deadline(object):
+    """a limit on how long the blocking calls in a ``with`` block may take
+
+    these are created by :func:`deadline`, see there for the details.
+
+    the :attr:`when` attribute is the deadline in terms of the :func:`loop
+    clock<now>` (set on entering the block), and :attr:`expired` says
+    whether it has passed.
+    """
+    def __init__(self, secs):
+        self.secs = secs
+        self.when = None
+        self._glet = self._parent = self._timer = None
+        self._effective = self
+        self._expired = False
+
+        # the greenlet blocked under this deadline, and the handle waking it
+        # back up if the deadline passed first
+        self._waiting = self._wake = None
+
+    def __repr__(self):
+        return "<%s at %r%s>" % (type(self).__name__, self.when,
+                " (expired)" if self.expired else "")
+
+    @property
+    def expired(self):
+        "whether the deadline (or that of an enclosing scope) has passed"
+        return self._effective._expired
+
+    def __enter__(self):
+        glet = compat.getcurrent()
+        when = _refresh_clock() + self.secs
+        parent = state.deadlines.get(glet)
+        self._glet, self._parent = glet, parent
+
+        if parent is not None and parent._effective.when <= when:
+            # the enclosing deadline comes first, so this one has nothing
+            # to add and needn't have a timer of its own
+            self._effective = parent._effective
+            self.when = self._effective.when
+        else:
+            self.when = when
+            self._timer = CallbackHandle(when, self._expire)
+            state.timed_paused.insert(when, self._timer)
+
+        state.deadlines[glet] = self
+        return self
+
+    def __exit__(self, klass, exc, tb):
+        if self._timer is not None:
+            self._timer.cancel()
+        if self._parent is None:
+            state.deadlines.pop(self._glet, None)
+        else:
+            state.deadlines[self._glet] = self._parent
+
+    def _expire(self):
+        self._expired = True
+        if self._waiting is not None:
+            # wake it with a timer handle, so that _DeadlineWait.cancel can
+            # tell whether it was this or something else that woke it
+            wake = self._wake = TimerHandle(state.clock, self._waiting)
+            wake._state = _QUEUED
+            state.paused.append(wake)
+
+
+class _DeadlineWait(object):
+    # stands in for the TimerHandle of a blocking call that is bounded by a
+    # deadline() scope's timer instead of one of its own
+    __slots__ = ["scope"]
+
+    def __init__(self, scope):
+        self.scope = scope
+
+    def cancel(self):
+        # like TimerHandle.cancel, False means the deadline woke us up
+        scope = self.scope
+        scope._waiting = None
+        wake, scope._wake = scope._wake, None
+        return wake is None or wake.cancel()
+
+
+def _wait_timer(timeout, glet, slack=None):
+    # the timer that bounds a blocking call in glet: its own for the timeout
+    # if that comes first, otherwise that of the deadline() scope it is in.
+    # either way, cancel() returning False means the time ran out.
+    if state.deadlines.data:
+        scope = state.deadlines.get(glet)
+        if scope is not None:
+            scope = scope._effective
+            if timeout is None or _refresh_clock() + timeout >= scope.when:
+                if scope._expired:
+                    # out of time already, come straight back timed out
+                    return _add_timer(state.clock, glet)
+                scope._waiting = glet
+                return _DeadlineWait(scope)
+    if timeout is None:
+        return None
+    return schedule_in(timeout, glet, handle=True, slack=slack)
+
+
+class _Spawn(object):
+    # a function passed to schedule(), which sits in the run queue in place
+    # of its greenlet until the mainloop gets to it
+    __slots__ = ["func", "args", "kwargs"]
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def _deliver(self):
+        if state.idle_workers:
+            glet = state.idle_workers.pop()
+        elif RECYCLE_GREENLETS:
+            glet = compat.greenlet(_run_worker, state.mainloop)
+        else:
+            return compat.greenlet(
+                    _target(self.func, self.args, self.kwargs), state.mainloop)
+        glet.spawn = self
+        return glet
+
+
+def _run_worker():
+    current = compat.getcurrent()
+    while 1:
+        spawn, current.spawn = current.spawn, None
+        try:
+            spawn.func(*spawn.args, **(spawn.kwargs or {}))
+        except Exception:
+            klass, exc, tb = sys.exc_info()
+            handle_exception(klass, exc, tb, coro=current)
+            del klass, exc, tb
+        if STATS:
+            state.counters["finished"] += 1
+        del spawn
+
+        if len(state.idle_workers) >= RECYCLE_GREENLETS:
+            return
+
+        # start the next function with a clean slate. these are nearly always
+        # empty, and a WeakKeyDictionary's pop() costs more than a new greenlet
+        for table in (state.priorities, state.account_rows, state.to_raise,
+                state.local_exception_handlers, state.local_to_hooks,
+                state.local_from_hooks):
+            if table.data:
+                table.pop(current, None)
+
+        state.idle_workers.append(current)
+        while current.spawn is None:
+            state.mainloop.switch()
+
 
 class TimeoutManager(object):
+    # compaction is triggered when cancelled timers outnumber live ones
+    _tombstones = 0
+    TOMBSTONE_MINIMUM = 64
+
     def __nonzero__(self):
         return bool(self.data)
 
+    def __len__(self):
+        return len(self.data)
+
     def first(self):
         if self.data:
             return iter(self.data).next()
         return None
 
+    def cancel(self, unixtime, timer):
+        self._tombstones += 1
+        if (self._tombstones > self.TOMBSTONE_MINIMUM and
+                self._tombstones * 2 > len(self)):
+            self._compact()
+            self._tombstones = 0
+
+    def _wake(self, pairs):
+        to_run = state.to_run
+        for unixtime, timer in pairs:
+            if timer._state == _PENDING:
+                timer._state = _QUEUED
+                to_run.append(timer)
+            elif self._tombstones:
+                self._tombstones -= 1
+
     @classmethod
     def install(cls):
         state.timed_paused = cls(state.timed_paused.dump())
@@ -75,14 +556,16 @@ class BisectingTimeoutManager(TimeoutManager):
 
     def clear(self):
         del self.data[:]
+        self._tombstones = 0
 
     def insert(self, unixtime, glet):
         bisect.insort(self.data, (unixtime, glet))
 
     def check(self):
-        index = bisect.bisect(self.data, (time.time(), None))
-        state.to_run.extend(pair[1] for pair in self.data[:index])
-        self.data = self.data[index:]
+        index = bisect.bisect(self.data, (state.clock, None))
+        if index:
+            self._wake(self.data[:index])
+            self.data = self.data[index:]
 
     def remove(self, unixtime, glet):
         index = bisect.bisect(self.data, (unixtime, None))
@@ -93,8 +576,11 @@ class BisectingTimeoutManager(TimeoutManager):
             index += 1
         return False
 
+    def _compact(self):
+        self.data = self.dump()
+
     def dump(self):
-        return self.data
+        return [pair for pair in self.data if pair[1]._state == _PENDING]
 
 
 class BTreeTimeoutManager(TimeoutManager):
@@ -103,13 +589,14 @@ class BTreeTimeoutManager(TimeoutManager):
 
     def clear(self):
         self.data = btree.sorted_btree(self.data.order)
+        self._tombstones = 0
 
     def insert(self, unixtime, glet):
         self.data.insert((unixtime, glet))
 
     def check(self):
-        left, right = self.data.split((time.time(), None))
-        state.to_run.extend(pair[1] for pair in left)
+        left, right = self.data.split((state.clock, None))
+        self._wake(left)
         self.data = right
 
     def remove(self, unixtime, glet):
@@ -119,8 +606,214 @@ class BTreeTimeoutManager(TimeoutManager):
             return False
         return True
 
+    def _compact(self):
+        self.data = btree.sorted_btree.bulkload(self.dump(), self.data.order)
+
     def dump(self):
-        return list(self.data)
+        return [pair for pair in self.data if pair[1]._state == _PENDING]
+
+
+class TimingWheelTimeoutManager(TimeoutManager):
+    """hashed hierarchical timing wheel (Varghese & Lauck)
+
+    timeouts are grouped into ``resolution``-second ticks and hashed into
+    ``levels`` wheels of ``2 ** slot_bits`` slots each. every wheel covers
+    ``2 ** slot_bits`` times the span of the one below it, and an entry only
+    moves down a level when the clock reaches its slot (a "cascade"). anything
+    beyond the span of the top wheel waits in an overflow bucket.
+
+    insert and remove are O(1) (so cancelled timers are dropped right away
+    rather than left as tombstones), :meth:`check` is proportional to the
+    number of ticks elapsed and timeouts fired (runs of empty wheels are
+    skipped), and :meth:`first` is cached between changes.
+    """
+    def __init__(self, data=None, resolution=WHEEL_RESOLUTION,
+                 slot_bits=WHEEL_SLOT_BITS, levels=WHEEL_LEVELS):
+        self._resolution = resolution
+        self._bits = slot_bits
+        self._mask = (1 << slot_bits) - 1
+        self._levels = levels
+        self.clear()
+        for unixtime, glet in data or ():
+            self.insert(unixtime, glet)
+
+    def __nonzero__(self):
+        return bool(self._count)
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        size = self._mask + 1
+        self._wheels = [[{} for i in xrange(size)]
+                        for j in xrange(self._levels)]
+
+        # the overflow bucket is counted as one more level
+        self._level_counts = [0] * (self._levels + 1)
+        self._overflow = {}
+
+        # entries that were already expired when inserted
+        self._due = {}
+
+        # map of (unixtime, glet) to (slot, level), and repeat counts for
+        # the rare case of the identical pair inserted more than once
+        self._index = {}
+        self._dupes = {}
+
+        self._count = 0
+        self._first = None
+        self._current = int(state.clock / self._resolution)
+
+    def _place(self, pair, tick):
+        delta = tick - self._current
+        if delta <= 0:
+            level, slot = -1, self._due
+        else:
+            level = (delta.bit_length() - 1) // self._bits
+            if level >= self._levels:
+                level, slot = self._levels, self._overflow
+            else:
+                slot = self._wheels[level][
+                        (tick >> (self._bits * level)) & self._mask]
+            self._level_counts[level] += 1
+        slot[pair] = tick
+        self._index[pair] = (slot, level)
+
+    def insert(self, unixtime, glet):
+        pair = (unixtime, glet)
+        self._count += 1
+        if pair in self._index:
+            self._dupes[pair] = self._dupes.get(pair, 0) + 1
+            return
+        self._place(pair, int(unixtime / self._resolution))
+        if self._first is not None and pair < self._first:
+            self._first = pair
+
+    def remove(self, unixtime, glet):
+        pair = (unixtime, glet)
+        if pair not in self._index:
+            return False
+        self._count -= 1
+
+        if pair in self._dupes:
+            self._dupes[pair] -= 1
+            if not self._dupes[pair]:
+                del self._dupes[pair]
+            return True
+
+        slot, level = self._index.pop(pair)
+        del slot[pair]
+        if level >= 0:
+            self._level_counts[level] -= 1
+        if self._first == pair:
+            self._first = None
+        return True
+
+    def cancel(self, unixtime, timer):
+        self.remove(unixtime, timer)
+
+    def _pop_slot(self, slot, level):
+        if level >= 0:
+            self._level_counts[level] -= len(slot)
+        items = slot.items()
+        slot.clear()
+        return items
+
+    def _cascade(self, level):
+        # level 0 "cascades" straight into the due bucket
+        if level < self._levels:
+            slot = self._wheels[level][
+                    (self._current >> (self._bits * level)) & self._mask]
+        else:
+            slot = self._overflow
+        for pair, tick in self._pop_slot(slot, level):
+            self._place(pair, tick)
+
+    def _step(self):
+        self._current += 1
+        current, bits = self._current, self._bits
+
+        # when the low digits of the tick roll over to zero, the next slot up
+        # gets redistributed into the lower wheels
+        level = 1
+        while level <= self._levels and not (
+                current & ((1 << (bits * level)) - 1)):
+            self._cascade(level)
+            level += 1
+
+        self._cascade(0)
+
+    def check(self):
+        now = state.clock
+        target = int(now / self._resolution)
+        counts, bits = self._level_counts, self._bits
+
+        while self._current < target:
+            if not any(counts):
+                self._current = target
+                break
+
+            # skip straight over stretches where the lower wheels are empty
+            lowest = 0
+            while not counts[lowest]:
+                lowest += 1
+            if lowest:
+                boundary = (self._current | ((1 << (bits * lowest)) - 1)) + 1
+                if boundary > target:
+                    self._current = target
+                    break
+                self._current = boundary - 1
+
+            self._step()
+
+        # everything in the due bucket is in the current tick or earlier,
+        # only those actually past their time get to go
+        ready = [pair for pair in self._due if pair[0] <= now]
+        if ready:
+            fired = []
+            for pair in ready:
+                del self._due[pair]
+                del self._index[pair]
+                count = 1 + self._dupes.pop(pair, 0)
+                self._count -= count
+                fired.extend([pair] * count)
+            self._first = None
+            fired.sort()
+            self._wake(fired)
+
+    def first(self):
+        if self._first is not None or not self._count:
+            return self._first
+
+        candidates = []
+        if self._due:
+            candidates.append(min(self._due))
+
+        # the earliest entry in a wheel is in its first non-empty slot
+        # following the current position
+        for level in xrange(self._levels):
+            if not self._level_counts[level]:
+                continue
+            wheel = self._wheels[level]
+            start = (self._current >> (self._bits * level)) + 1
+            for i in xrange(self._mask + 1):
+                slot = wheel[(start + i) & self._mask]
+                if slot:
+                    candidates.append(min(slot))
+                    break
+
+        if self._overflow:
+            candidates.append(min(self._overflow))
+
+        self._first = min(candidates)
+        return self._first
+
+    def dump(self):
+        data = []
+        for pair in self._index:
+            data.extend([pair] * (1 + self._dupes.get(pair, 0)))
+        data.sort()
+        return data
 
 # cooperatively yielded for a set timeout
 try:
@@ -131,13 +824,17 @@ except ImportError:
 
 
 def _hit_poller(timeout):
+    if STATS:
+        started = compat.monotonic()
     try:
         events = state.poller.poll(timeout)
     except KeyboardInterrupt, exc:
+        state.clock = compat.monotonic()
+
         # on Ctrl-C, wake up the main without killing the mainloop
-        state.to_raise[compat.main_greenlet] = exc
+        _raise_in(compat.main_greenlet, exc)
         state.to_run.append(compat.main_greenlet)
-        return
+        return True
     except EnvironmentError, exc:
         if exc.args[0] != errno.EINTR:
             raise
@@ -150,6 +847,12 @@ def _hit_poller(timeout):
             events = [(fd, state.poller.ERRMASK)
                       for fd in state.poller._registry.iterkeys()]
 
+    state.clock = compat.monotonic()
+    state.poll_skipped = 0
+    if STATS:
+        state.counters["polls"] += 1
+        state.counters["poll_time"] += state.clock - started
+
     for fd, eventmap in events:
         readables, writables = state.descriptormap.get(fd, ([], []))
 
@@ -161,6 +864,11 @@ def _hit_poller(timeout):
             for writable in writables:
                 writable()
 
+    _gather_runnable()
+    return bool(events)
+
+
+def _gather_runnable():
     state.to_run.extend(state.awoken_from_events)
     state.awoken_from_events.clear()
 
@@ -170,15 +878,29 @@ def _hit_poller(timeout):
     state.paused = []
 
 
-def _register_fd(fd, readable, writable):
+def _register_fd(fd, readable, writable, edge_triggered=False):
     poller = state.poller
     mask = poller.ERRMASK
+    if edge_triggered:
+        mask |= poller.EDGEMASK
+    downgrades = not edge_triggered and fd in state.edge_callbacks and \
+            poller.edge_triggered(fd)
     if readable:
         mask |= poller.INMASK
     if writable:
         mask |= poller.OUTMASK
     reg = state.poller.register(fd, mask)
 
+    if edge_triggered:
+        state.edge_callbacks.setdefault(fd, set()).update(
+                cb for cb in (readable, writable) if cb)
+    elif downgrades:
+        # the edge-triggered registrations stop listening for readiness
+        # while this one is in place, so anything already waiting on them
+        # has to look again (and wait with a registration of its own)
+        for callback in list(state.edge_callbacks[fd]):
+            callback()
+
     if fd not in state.descriptormap:
         state.descriptormap[fd] = (set(), set())
     readables, writables = state.descriptormap[fd]
@@ -202,9 +924,179 @@ def _unregister_fd(fd, readable, writable, reg):
     if not (readables or writables):
         state.descriptormap.pop(fd)
 
+    edge = state.edge_callbacks.get(fd)
+    if edge is not None:
+        edge.discard(readable)
+        edge.discard(writable)
+        if not edge:
+            del state.edge_callbacks[fd]
+
     state.poller.unregister(fd, reg)
 
 
+def now():
+    """the scheduler's loop clock
+
+    this is a monotonic time in seconds (from an arbitrary starting point), so
+    it won't jump around with changes to the system clock. it is only read
+    once per trip through the poller, so it is very cheap to call but won't
+    advance while a greenlet runs without blocking.
+
+    all of the scheduler's timers, along with timeouts in the rest of
+    greenhouse, are measured against this clock. relative timeouts (like
+    :func:`pause_for` and :func:`schedule_in`) bring it up to date first, so
+    they are never cut short by a stale reading.
+
+    :returns: the loop time as a float
+    """
+    return state.clock
+
+
+def stats():
+    """a snapshot of the scheduler's counters and gauges
+
+    the counters are cheap enough to always leave on, but setting
+    ``GREENHOUSE_NO_STATS`` in the environment before greenhouse is imported
+    leaves them out of the scheduler altogether (and they all stay at 0).
+
+    :returns: a dict with keys:
+
+        - ``switches``: greenlets switched to by the mainloop
+        - ``polls``: calls into the poller
+        - ``polls_skipped``: passes through the run queue that went without
+          a call into the poller (see ``POLL_SKIP_PASSES``)
+        - ``poll_time``: seconds spent inside the poller
+        - ``spawned``: greenlets created by :func:`greenlet` (which includes
+          functions passed to :func:`schedule` and its relatives)
+        - ``finished``: how many of those have since completed
+        - ``callbacks``: functions run by the mainloop itself, from
+          :func:`call_soon`, :func:`call_later` and :class:`RecurringTimer`
+        - ``run_queue``: greenlets currently waiting to run
+        - ``timers``: pending timers
+        - ``fds``: file descriptors registered with the poller
+        - ``loop_lag``: a dict of what :func:`start_lag_probe` has seen, with
+          the ``last`` and ``max`` lag in seconds and a ``histogram`` of
+          ``(upper bound, count)`` pairs (the last bound is ``None``)
+    """
+    result = dict(state.counters)
+    result["run_queue"] = len(state.to_run) + len(state.paused) + sum(
+            len(queue) for queue in state.class_queues)
+    result["timers"] = len(state.timed_paused) - state.timed_paused._tombstones
+    result["fds"] = len(state.descriptormap)
+    result["loop_lag"] = {
+        "last": state.lag_last,
+        "max": state.lag_max,
+        "histogram": zip(LAG_BUCKETS + (None,), state.lag_histogram),
+    }
+    return result
+
+
+def start_lag_probe(interval=0.5):
+    """start measuring how far behind the event loop is running
+
+    the probe is a greenlet that repeatedly sleeps for ``interval`` seconds
+    and records how late it wakes up, which is the time other greenlets and
+    the poller held the loop past its timer. results show up under
+    ``loop_lag`` in :func:`stats`.
+
+    :param interval: seconds between measurements
+    :type interval: int or float
+    """
+    stop_lag_probe()
+    state.lag_probe = greenlet(_probe_lag, args=(interval,))
+    schedule(state.lag_probe)
+
+
+def stop_lag_probe():
+    """stop the loop lag probe started by :func:`start_lag_probe`
+
+    the measurements already taken are left in place.
+    """
+    probe, state.lag_probe = state.lag_probe, None
+    if probe is not None and not probe.dead:
+        end(probe)
+
+
+def _probe_lag(interval):
+    current = compat.getcurrent()
+    while state.lag_probe is current:
+        due = _refresh_clock() + interval
+        pause_for(interval)
+        lag = max(compat.monotonic() - due, 0.0)
+
+        state.lag_last = lag
+        state.lag_max = max(state.lag_max, lag)
+        state.lag_histogram[bisect.bisect_left(LAG_BUCKETS, lag)] += 1
+
+
+def start_accounting():
+    """start tracking CPU and scheduling time for each greenlet
+
+    while it is on, the mainloop records for every greenlet (or for every
+    ``tag`` given to :func:`schedule`) the CPU time it used, how many times
+    it was switched to, and how long it sat runnable waiting for its turn.
+    this moves the mainloop off of its fast path, and costs a couple of
+    clock readings per switch. any earlier numbers are reset.
+    """
+    for row in state.account_rows.values() + state.tag_rows.values():
+        row[:] = [0.0, 0, 0.0]
+    state.accounting = state.instrumented = True
+
+
+def stop_accounting():
+    """stop the accounting started by :func:`start_accounting`
+
+    the numbers gathered so far remain available through :func:`top`.
+    """
+    state.accounting = False
+
+
+def top(limit=None, sort_by="cpu"):
+    """the greenlets (and tags) that have used the most time
+
+    :param limit: the most rows to return (the default is all of them)
+    :type limit: int or None
+    :param sort_by:
+        which column to sort by, one of ``"cpu"``, ``"switches"`` or
+        ``"runnable"``
+    :type sort_by: str
+
+    :returns:
+        a list of ``(name, cpu, switches, runnable)`` tuples, largest first.
+        ``name`` is the tag, or the greenlet itself if it had no tag, and
+        ``cpu`` and ``runnable`` are in seconds.
+    """
+    column = ("cpu", "switches", "runnable").index(sort_by) + 1
+    tagged = set(id(row) for row in state.tag_rows.itervalues())
+
+    rows = [(tag,) + tuple(row) for tag, row in state.tag_rows.iteritems()]
+    rows.extend((glet,) + tuple(row)
+            for glet, row in state.account_rows.items()
+            if id(row) not in tagged)
+    rows.sort(key=lambda row: row[column], reverse=True)
+    return rows[:limit]
+
+
+def _refresh_clock():
+    # relative timeouts start from a fresh reading so that they can't fire
+    # early when the greenlet setting them has been running for a while
+    state.clock = compat.monotonic()
+    return state.clock
+
+
+def _slacken(waketime, slack):
+    if slack is None:
+        slack = TIMER_SLACK
+    if not slack:
+        return waketime
+    return math.ceil(waketime / slack) * slack
+
+
+def _from_unixtime(unixtime):
+    # convert a wall-clock timestamp to the loop clock
+    return unixtime - time.time() + compat.monotonic()
+
+
 def greenlet(func, args=(), kwargs=None):
     """create a new greenlet from a function and arguments
 
@@ -220,12 +1112,24 @@ def greenlet(func, args=(), kwargs=None):
     greenhouse main loop greenlet, which is a requirement for greenlets that
     will wind up in the greenhouse scheduler.
     """
-    if args or kwargs:
+    if STATS:
+        state.counters["spawned"] += 1
+    return compat.greenlet(_target(func, args, kwargs), state.mainloop)
+
+
+def _target(func, args, kwargs):
+    if STATS:
+        def target():
+            try:
+                return func(*args, **(kwargs or {}))
+            finally:
+                state.counters["finished"] += 1
+    elif args or kwargs:
         def target():
             return func(*args, **(kwargs or {}))
     else:
         target = func
-    return compat.greenlet(target, state.mainloop)
+    return target
 
 
 def pause():
@@ -245,7 +1149,7 @@ def pause_until(unixtime):
     :param unixtime: the unix timestamp of when to bring this greenlet back
     :type unixtime: int or float
     """
-    schedule_at(unixtime, compat.getcurrent())
+    _add_timer(_from_unixtime(unixtime), compat.getcurrent())
     state.mainloop.switch()
 
 
@@ -257,10 +1161,11 @@ def pause_for(secs):
     :param secs: number of seconds to pause
     :type secs: int or float
     """
-    pause_until(time.time() + secs)
+    _add_timer(_refresh_clock() + secs, compat.getcurrent())
+    state.mainloop.switch()
 
 
-def schedule(target=None, args=(), kwargs=None):
+def schedule(target=None, args=(), kwargs=None, priority=None, tag=None):
     """insert a greenlet into the scheduler
 
     If provided a function, it is wrapped in a new greenlet
@@ -274,6 +1179,21 @@ def schedule(target=None, args=(), kwargs=None):
         keyword arguments for the function (only used if ``target`` is a
         function)
     :type kwargs: dict or None
+    :param priority:
+        the greenlet's priority class, one of :data:`PRIORITY_HIGH`,
+        :data:`PRIORITY_NORMAL`, :data:`PRIORITY_LOW` or
+        :data:`PRIORITY_IDLE`. it sticks with the greenlet every time it is
+        woken up after this. the default leaves it as it was (so normal for
+        a new greenlet).
+
+        while they are all busy, each pass through the run queue takes
+        greenlets from the high, normal and low classes in a 4:2:1 ratio.
+        idle greenlets only run when there would otherwise be nothing to do.
+    :type priority: int or None
+    :param tag:
+        a name to file the greenlet's time under in :func:`top`, which it
+        shares with every other greenlet scheduled with the same tag
+    :type tag: str or None
 
     :returns: the ``target`` argument
 
@@ -290,17 +1210,100 @@ def schedule(target=None, args=(), kwargs=None):
     """
     if target is None:
         def decorator(target):
-            return schedule(target, args=args, kwargs=kwargs)
+            return schedule(target, args=args, kwargs=kwargs,
+                    priority=priority, tag=tag)
         return decorator
     if isinstance(target, compat.greenlet) or target is compat.main_greenlet:
         glet = target
+    elif priority is None and tag is None:
+        # the greenlet isn't made until the function's turn comes up
+        if STATS:
+            state.counters["spawned"] += 1
+        state.paused.append(_Spawn(target, args, kwargs))
+        return target
     else:
         glet = greenlet(target, args, kwargs)
+    if priority is not None:
+        _set_priority(glet, priority)
+    if tag is not None:
+        state.account_rows[glet] = state.tag_rows.setdefault(
+                tag, [0.0, 0, 0.0])
     state.paused.append(glet)
     return target
 
 
-def schedule_at(unixtime, target=None, args=(), kwargs=None):
+def schedule_idle(target=None, args=(), kwargs=None):
+    """insert a greenlet into the scheduler's idle class
+
+    idle greenlets only get to run when the scheduler has nothing else to do
+    and would otherwise block waiting for I/O or timers, which makes this a
+    good fit for background work like warming caches or flushing logs.
+
+    this is the same as :func:`schedule` with ``priority=PRIORITY_IDLE``, and
+    can be used as a decorator in all the same ways.
+    """
+    return schedule(target, args, kwargs, PRIORITY_IDLE)
+
+
+def handoff(target):
+    """switch straight to a greenlet that is being woken up
+
+    the target runs right away, and the current greenlet gets to carry on
+    as soon as it blocks, without a trip through the poller in between
+    (but see ``HANDOFF_LIMIT``). this is meant for waking one greenlet blocked on a
+    lock or queue, and the :mod:`greenhouse.util` primitives do it when
+    created with ``handoff=True``.
+
+    it only switches when that can't upset the scheduler: not from the
+    mainloop itself, not while there are hooks, exceptions to throw in or
+    accounting (which all need the mainloop to do the switch), and not if
+    either greenlet has a priority class other than normal. otherwise
+    nothing is done, and waking ``target`` is left to the caller.
+
+    .. note:: this method blocks the current greenlet for a short time
+
+    :param target: a greenlet that is blocked waiting to be woken
+    :type target: greenlet
+
+    :returns: bool, whether it switched to ``target``
+    """
+    current = compat.getcurrent()
+    if current is state.mainloop or state.instrumented:
+        return False
+    if state.prioritized and (
+            target in state.priorities or current in state.priorities):
+        return False
+
+    if state.handoffs < HANDOFF_LIMIT:
+        state.handoffs += 1
+        state.to_run.appendleft(current)
+        if STATS:
+            # the mainloop counts switches as a pass starts, and this one
+            # joined it late
+            state.counters["switches"] += 1
+    else:
+        state.paused.append(current)
+
+    state.running = target
+    if STATS:
+        state.counters["switches"] += 1
+    target.switch()
+    return True
+
+
+def _set_priority(glet, priority):
+    if priority not in (
+            PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW, PRIORITY_IDLE):
+        raise ValueError("unknown priority class: %r" % (priority,))
+    if priority == PRIORITY_NORMAL:
+        state.priorities.pop(glet, None)
+    else:
+        state.priorities[glet] = priority
+        state.prioritized = True
+
+
+def schedule_at(unixtime, target=None, args=(), kwargs=None, handle=False,
+                slack=None):
     """insert a greenlet into the scheduler to be run at a set time
 
     If provided a function, it is wrapped in a new greenlet
@@ -317,8 +1320,17 @@ def schedule_at(unixtime, target=None, args=(), kwargs=None):
         keyword arguments for the function (only used if ``target`` is a
         function)
     :type kwargs: dict or None
-
-    :returns: the ``target`` argument
+    :param handle:
+        return a :class:`TimerHandle` instead of the ``target``, which can be
+        used to cancel the timer (default ``False``)
+    :type handle: bool
+    :param slack:
+        how late the timer may fire, in seconds. its time is rounded up to
+        the next multiple of this, so that timers from around the same time
+        all fire at once. ``None`` (the default) uses ``TIMER_SLACK``.
+    :type slack: int, float or None
+
+    :returns: the ``target`` argument, or a :class:`TimerHandle`
 
     This function can also be used as a decorator:
 
@@ -332,19 +1344,31 @@ def schedule_at(unixtime, target=None, args=(), kwargs=None):
     >>> def f(name):
     ...     print 'hello %s' % name
     """
+    return _schedule_timer(_slacken(_from_unixtime(unixtime), slack),
+            target, args, kwargs, handle)
+
+
+def _schedule_timer(waketime, target, args, kwargs, handle):
     if target is None:
         def decorator(target):
-            return schedule_at(unixtime, target, args=args, kwargs=kwargs)
+            return _schedule_timer(waketime, target, args, kwargs, handle)
         return decorator
     if isinstance(target, compat.greenlet) or target is compat.main_greenlet:
         glet = target
     else:
         glet = greenlet(target, args, kwargs)
-    state.timed_paused.insert(unixtime, glet)
-    return target
+    timer = _add_timer(waketime, glet)
+    return timer if handle else target
+
 
+def _add_timer(waketime, glet, exception=None):
+    timer = TimerHandle(waketime, glet, exception)
+    state.timed_paused.insert(waketime, timer)
+    return timer
 
-def schedule_in(secs, target=None, args=(), kwargs=None):
+
+def schedule_in(secs, target=None, args=(), kwargs=None, handle=False,
+                slack=None):
     """insert a greenlet into the scheduler to run after a set time
 
     If provided a function, it is wrapped in a new greenlet
@@ -360,8 +1384,16 @@ def schedule_in(secs, target=None, args=(), kwargs=None):
         keyword arguments for the function (only used if ``target`` is a
         function)
     :type kwargs: dict or None
+    :param handle:
+        return a :class:`TimerHandle` instead of the ``target``, which can be
+        used to cancel the timer (default ``False``)
+    :type handle: bool
+    :param slack:
+        as for :func:`schedule_at`, how far past ``secs`` the timer may be
+        pushed to fire along with others (default ``TIMER_SLACK``)
+    :type slack: int, float or None
 
-    :returns: the ``target`` argument
+    :returns: the ``target`` argument, or a :class:`TimerHandle`
 
     This function can also be used as a decorator:
 
@@ -375,14 +1407,17 @@ def schedule_in(secs, target=None, args=(), kwargs=None):
     >>> def f(name):
     ...     print 'hello %s' % name
     """
-    return schedule_at(time.time() + secs, target, args, kwargs)
+    return _schedule_timer(_slacken(_refresh_clock() + secs, slack),
+            target, args, kwargs, handle)
 
 
 def schedule_recurring(interval, target=None, maxtimes=0, starting_at=0,
                        args=(), kwargs=None):
     """insert a greenlet into the scheduler to run regularly at an interval
 
-    If provided a function, it is wrapped in a new greenlet
+    If provided a function, it is wrapped in a new greenlet (a new one each
+    time, see :class:`RecurringTimer` for a cheaper way to run functions
+    that don't block)
 
     :param interval: the number of seconds between invocations
     :type interval: int or float
@@ -429,19 +1464,95 @@ def schedule_recurring(interval, target=None, maxtimes=0, starting_at=0,
 
     def run_and_schedule_one(tstamp, count):
         # pass in the time scheduled instead of just checking
-        # time.time() so that delays don't add up
+        # the clock so that delays don't add up
         if not maxtimes or count < maxtimes:
             tstamp += interval
             func(*args, **(kwargs or {}))
-            schedule_at(tstamp, run_and_schedule_one,
-                        args=(tstamp, count + 1))
+            _add_timer(tstamp, greenlet(run_and_schedule_one,
+                                        args=(tstamp, count + 1)))
 
-    firstrun = starting_at + interval
-    schedule_at(firstrun, run_and_schedule_one, args=(firstrun, 0))
+    firstrun = _from_unixtime(starting_at) + interval
+    _add_timer(firstrun, greenlet(run_and_schedule_one, args=(firstrun, 0)))
 
     return target
 
 
+def call_soon(func, *args):
+    """call a function from the mainloop on its next pass through the run queue
+
+    no greenlet is created for this, ``func`` is called directly by the
+    mainloop. that makes it much cheaper than :func:`schedule`, but it also
+    means that ``func`` must never block (on I/O, a lock, :func:`pause`, or
+    anything else that would switch away). exceptions it raises go to the
+    exception handlers.
+
+    :param func: the function to call
+    :type func: function
+
+    any further positional arguments are passed along to ``func``.
+
+    :returns:
+        a :class:`CallbackHandle`, whose :meth:`cancel<TimerHandle.cancel>`
+        stops the call if it hasn't happened yet
+    """
+    handle = CallbackHandle(state.clock, func, args)
+    handle._state = _QUEUED
+    state.paused.append(handle)
+    return handle
+
+
+def call_later(delay, func, *args):
+    """call a function from the mainloop after a number of seconds
+
+    like :func:`call_soon`, ``func`` runs in the mainloop without a greenlet
+    of its own and so it must not block.
+
+    :param delay: the seconds to wait before calling ``func``
+    :type delay: int or float
+    :param func: the function to call
+    :type func: function
+
+    any further positional arguments are passed along to ``func``.
+
+    :returns:
+        a :class:`CallbackHandle`, which can be used to cancel the call
+    """
+    handle = CallbackHandle(_refresh_clock() + delay, func, args)
+    state.timed_paused.insert(handle.waketime, handle)
+    return handle
+
+
+def deadline(secs):
+    """bound all the blocking calls in a ``with`` block by a single deadline
+
+    >>> with deadline(2.5):
+    ...     request = sock.recv(4096)
+    ...     response = pool.get()
+    ...     sock.sendall(response)
+
+    every blocking call in the block (and in anything it calls) that would
+    accept a timeout acts as though its timeout ran out when the deadline
+    passes, however many calls there are or however long each one has taken:
+    greenhouse sockets raise ``socket.timeout``, :meth:`Event.wait
+    <greenhouse.util.Event.wait>` returns ``True``, :meth:`Queue.get
+    <greenhouse.util.Queue.get>` (and so :meth:`Pool.get
+    <greenhouse.pool.Pool.get>`) raises ``Queue.Empty``, and so on. a call
+    with its own timeout that comes sooner keeps it. calls that don't take a
+    timeout at all, like :meth:`Lock.acquire<greenhouse.util.Lock.acquire>`,
+    aren't affected.
+
+    the scope sets a single timer on entry rather than one for every
+    blocking call, and only in the greenlet that entered it. nested scopes
+    go by whichever deadline is earliest.
+
+    :param secs: seconds from now until the deadline
+    :type secs: int or float
+
+    :returns: a :class:`Deadline` to be used as a context manager
+    """
+    return Deadline(secs)
+
+
 def schedule_exception(exception, target):
     """schedule a greenlet to have an exception raised in it immediately
 
@@ -455,10 +1566,10 @@ def schedule_exception(exception, target):
     if target.dead:
         raise ValueError("can't send exceptions to a dead greenlet")
     schedule(target)
-    state.to_raise[target] = exception
+    _raise_in(target, exception)
 
 
-def schedule_exception_at(unixtime, exception, target):
+def schedule_exception_at(unixtime, exception, target, handle=False):
     """schedule a greenlet to have an exception raised at a unix timestamp
 
     :param unixtime: when to raise the exception in the target
@@ -467,16 +1578,19 @@ def schedule_exception_at(unixtime, exception, target):
     :type exception: Exception
     :param target: the greenlet that should receive the exception
     :type target: greenlet
+    :param handle:
+        return a :class:`TimerHandle` which can be used to call the exception
+        off (default ``False``)
+    :type handle: bool
+
+    :returns: a :class:`TimerHandle` if ``handle`` was true, otherwise None
     """
-    if not isinstance(target, compat.greenlet):
-        raise TypeError("can only schedule exceptions for greenlets")
-    if target.dead:
-        raise ValueError("can't send exceptions to a dead greenlet")
-    schedule_at(unixtime, target)
-    state.to_raise[target] = exception
+    timer = _exception_timer(_from_unixtime(unixtime), exception, target)
+    if handle:
+        return timer
 
 
-def schedule_exception_in(secs, exception, target):
+def schedule_exception_in(secs, exception, target, handle=False):
     """schedule a greenlet receive an exception after a number of seconds
 
     :param secs: the number of seconds to wait before raising
@@ -485,8 +1599,24 @@ def schedule_exception_in(secs, exception, target):
     :type exception: Exception
     :param target: the greenlet that should receive the exception
     :type target: greenlet
+    :param handle:
+        return a :class:`TimerHandle` which can be used to call the exception
+        off (default ``False``)
+    :type handle: bool
+
+    :returns: a :class:`TimerHandle` if ``handle`` was true, otherwise None
     """
-    schedule_exception_at(time.time() + secs, exception, target)
+    timer = _exception_timer(_refresh_clock() + secs, exception, target)
+    if handle:
+        return timer
+
+
+def _exception_timer(waketime, exception, target):
+    if not isinstance(target, compat.greenlet):
+        raise TypeError("can only schedule exceptions for greenlets")
+    if target.dead:
+        raise ValueError("can't send exceptions to a dead greenlet")
+    return _add_timer(waketime, target, exception)
 
 
 def end(target):
@@ -499,108 +1629,265 @@ def end(target):
         raise TypeError("argument must be a greenlet")
     if not target.dead:
         schedule(target)
-        state.to_raise[target] = compat.GreenletExit()
+        _raise_in(target, compat.GreenletExit())
 
 
-def _remove_timer(waketime, glet):
-    if state.timed_paused.remove(waketime, glet):
-        return True
+def _raise_in(target, exception):
+    state.to_raise[target] = exception
+    state.instrumented = True
 
-    try:
-        state.to_run.remove(glet)
-    except ValueError:
-        return False
-    return True
 
+def _is_instrumented():
+    return bool(state.accounting or state.global_hooks or state.to_raise or
+            state.local_to_hooks or state.local_from_hooks)
 
-@compat.greenlet
-def mainloop():
+
+def _run_mainloop():
     target = None
     while 1:
-        # python shutdown
-        if not (sys and state):
-            break
-
-        state.interrupted = False
-
-        if not state.to_run:
-            _hit_poller(0)
-            while not state.to_run:
-                # if there are timed-paused greenlets, we can
-                # just wait until the first of them wakes up
-                if state.timed_paused:
-                    until = state.timed_paused.first()[0] + 0.001
-                    _hit_poller(until - time.time())
-                else:
-                    _hit_poller(None)
-
-        prev = target
-        target = state.to_run.popleft()
-
-        # global trace hooks
-        if state.global_hooks:
-            _run_global_hooks(prev, target)
-
-        # local trace incoming hooks
-        if target in state.local_to_hooks:
-            _run_local_hooks(
-                target, state.local_to_hooks[target], True)
-
-        try:
-            # pick up any exception we are supposed to throw in
-            if target in state.to_raise:
-                target.throw(state.to_raise.pop(target))
-            else:
+        # the fast path, for when there are no hooks to run and no
+        # exceptions to throw in: just switch to whatever is next
+        while not state.instrumented:
+            # python shutdown
+            if not (sys and state):
+                return
+
+            state.interrupted = False
+
+            if not state.to_run:
+                _wait_for_runnable()
+
+            glet = state.to_run.popleft()
+
+            if type(glet) is _Spawn:
+                glet = glet._deliver()
+
+            elif type(glet) is CallbackHandle:
+                # the handle stands in for a greenlet, so that the watchdog
+                # can tell who it was if the callback blocks
+                state.running = glet
+                glet._deliver()
+                state.running = None
+                if STATS:
+                    state.counters["switches"] -= 1
+                continue
+
+            # fired timers sit in the run queue as their handles
+            elif type(glet) is TimerHandle:
+                glet = glet._deliver()
+                if glet is None:
+                    # cancelled
+                    if STATS:
+                        state.counters["switches"] -= 1
+                    continue
+
+                if state.instrumented:
+                    # it brought an exception, which is the other loop's job
+                    state.to_run.appendleft(glet)
+                    if STATS:
+                        state.counters["switches"] -= 1
+                    continue
+
+            target = state.running = glet
+            try:
                 target.switch()
-        except Exception:
+            except Exception:
+                # python shutdown
+                if not (sys and state):
+                    return
+                # state.running, as a handoff() may have moved on from target
+                klass, exc, tb = sys.exc_info()
+                handle_exception(klass, exc, tb, coro=state.running)
+                del klass, exc, tb
+
+        # the instrumented path, until the hooks and exceptions are gone
+        while state.instrumented:
             # python shutdown
             if not (sys and state):
-                break
-            klass, exc, tb = sys.exc_info()
-            handle_exception(klass, exc, tb, coro=target)
-            del klass, exc, tb
+                return
+
+            state.interrupted = False
+
+            if not state.to_run:
+                # once per pass through the run queue, see whether there is
+                # still anything to be instrumented for
+                state.instrumented = _is_instrumented()
+                if not state.instrumented:
+                    break
+                _wait_for_runnable()
+
+            glet = state.to_run.popleft()
+
+            if type(glet) is _Spawn:
+                glet = glet._deliver()
+            elif type(glet) is CallbackHandle:
+                state.running = glet
+                glet._deliver()
+                state.running = None
+                if STATS:
+                    state.counters["switches"] -= 1
+                continue
+            elif type(glet) is TimerHandle:
+                glet = glet._deliver()
+                if glet is None:
+                    if STATS:
+                        state.counters["switches"] -= 1
+                    continue
+
+            prev, target = target, glet
+            state.running = target
+
+            # global trace hooks
+            if state.global_hooks:
+                _run_global_hooks(prev, target)
+
+            # local trace incoming hooks
+            if target in state.local_to_hooks:
+                _run_local_hooks(
+                    target, state.local_to_hooks[target], True)
+
+            # it has been runnable since the poller queued it up
+            if state.accounting:
+                row = state.account_rows.get(target)
+                if row is None:
+                    row = state.account_rows[target] = [0.0, 0, 0.0]
+                row[1] += 1
+                row[2] += compat.monotonic() - state.clock
+                cpu = compat.cpu_time()
+            else:
+                row = None
 
-        # local trace outgoing hooks
-        if target in state.local_from_hooks:
-            _run_local_hooks(
-                target, state.local_from_hooks[target], False)
+            try:
+                # pick up any exception we are supposed to throw in
+                if target in state.to_raise:
+                    target.throw(state.to_raise.pop(target))
+                else:
+                    target.switch()
+            except Exception:
+                # python shutdown
+                if not (sys and state):
+                    return
+                klass, exc, tb = sys.exc_info()
+                handle_exception(klass, exc, tb, coro=target)
+                del klass, exc, tb
+
+            if row is not None:
+                row[0] += compat.cpu_time() - cpu
+
+            # local trace outgoing hooks
+            if target in state.local_from_hooks:
+                _run_local_hooks(
+                    target, state.local_from_hooks[target], False)
+
+
+def _wait_for_runnable():
+    state.running = None
+    if not (state.paused or state.awoken_from_events):
+        _hit_poller(0)
+    elif state.poll_skipped < state.poll_skip and _time() < state.poll_due:
+        # a pass without the poll. the loop clock isn't refreshed either
+        # (through ctypes that costs more than the poll), so timers that
+        # come due now wait for the next poll, within the same bounds as I/O
+        state.poll_skipped += 1
+        if STATS:
+            state.counters["polls_skipped"] += 1
+        _gather_runnable()
+    else:
+        if _hit_poller(0):
+            # there is I/O going on, keep up with it
+            state.poll_skip = 0
+        else:
+            state.poll_skip = min(state.poll_skip * 2 or 1, POLL_SKIP_PASSES)
+        if state.poll_skip:
+            state.poll_due = _time() + POLL_SKIP_INTERVAL
+    if state.prioritized:
+        _next_pass()
+    while not state.to_run:
+        # if there are timed-paused greenlets, we can
+        # just wait until the first of them wakes up
+        if state.timed_paused:
+            until = state.timed_paused.first()[0] + 0.001
+            _hit_poller(until - state.clock)
+        else:
+            _hit_poller(None)
+        if state.prioritized:
+            _next_pass()
+
+    # nothing joins the run queue in the middle of a pass, so everything in
+    # it now is about to be switched to
+    if STATS:
+        state.counters["switches"] += len(state.to_run)
+    state.passes += 1
+    state.handoffs = 0
+
+
+def _next_pass():
+    # sort everything runnable into its priority class's queue
+    queues = state.class_queues
+    priorities = state.priorities
+    for glet in state.to_run:
+        if type(glet) is _Spawn or type(glet) is CallbackHandle:
+            # no greenlet (yet), so no priority but the default
+            queues[PRIORITY_NORMAL].append(glet)
+            continue
+        target = glet.target if type(glet) is TimerHandle else glet
+        queues[priorities.get(target, PRIORITY_NORMAL)].append(glet)
+    state.to_run.clear()
+
+    # then line up the next pass, giving each class its weighted share
+    for queue, weight in zip(queues, PRIORITY_WEIGHTS):
+        for i in xrange(min(len(queue), weight * PRIORITY_BATCH)):
+            state.to_run.append(queue.popleft())
 
-state.mainloop = mainloop
+    # the idle class only gets a turn when the loop would otherwise block,
+    # and then only one at a time so that real work can cut back in
+    if not state.to_run and queues[PRIORITY_IDLE]:
+        state.to_run.append(queues[PRIORITY_IDLE].popleft())
+
+state.mainloop = compat.greenlet(_run_mainloop)
 
 
 def _run_local_hooks(target, hooks, incoming):
-    replacement_hooks = []
     direction = 1 if incoming else 2
-    for weak in hooks:
+    replacement_hooks = None
+    for i, weak in enumerate(hooks):
         func = weak()
-        if func is None:
-            continue
+        if func is not None:
+            try:
+                func(direction, target)
+            except Exception:
+                func = None
 
-        try:
-            func(direction, target)
-        except Exception:
-            continue
-
-        replacement_hooks.append(weak)
+        # only start building a new list once something has to come out
+        if func is None:
+            if replacement_hooks is None:
+                replacement_hooks = hooks[:i]
+        elif replacement_hooks is not None:
+            replacement_hooks.append(weak)
 
-    hooks[:] = replacement_hooks
+    if replacement_hooks is not None:
+        hooks[:] = replacement_hooks
 
 
 def _run_global_hooks(coming_from, going_to):
-    replacement_hooks = []
-    for weak in state.global_hooks:
+    hooks = state.global_hooks
+    replacement_hooks = None
+    for i, weak in enumerate(hooks):
         func = weak()
-        if func is None:
-            continue
+        if func is not None:
+            try:
+                func(coming_from, going_to)
+            except Exception:
+                func = None
 
-        try:
-            func(coming_from, going_to)
-        except Exception:
-            continue
-
-        replacement_hooks.append(weak)
+        if func is None:
+            if replacement_hooks is None:
+                replacement_hooks = hooks[:i]
+        elif replacement_hooks is not None:
+            replacement_hooks.append(weak)
 
-    state.global_hooks[:] = replacement_hooks
+    if replacement_hooks is not None:
+        hooks[:] = replacement_hooks
 
 
 def handle_exception(klass, exc, tb, coro=None):
@@ -772,6 +2059,7 @@ def global_hook(handler):
 
     log.info("setting a new global hook callback")
     state.global_hooks.append(weakref.ref(handler))
+    state.instrumented = True
 
     return handler
 
@@ -826,6 +2114,7 @@ def local_incoming_hook(handler=None, coro=None):
 
     state.local_to_hooks.setdefault(coro, []).append(
         weakref.ref(handler))
+    state.instrumented = True
 
     return handler
 
@@ -882,6 +2171,7 @@ def local_outgoing_hook(handler=None, coro=None):
 
     state.local_from_hooks.setdefault(coro, []).append(
         weakref.ref(handler))
+    state.instrumented = True
 
     return handler
 
@@ -927,7 +2217,316 @@ def set_ignore_interrupts(flag=True):
 def reset_poller(poll=None):
     """replace the scheduler's poller, throwing away any pre-existing state
 
-    this is only really a good idea in the new child process after a fork(2).
+    this is only really a good idea in the new child process after a fork(2),
+    or at startup to pick a poller other than the default, like
+    ``reset_poller(poller.IoUringPoller())``.
+
+    :param poll:
+        the poller to use from now on (defaults to the platform's best, as
+        chosen by ``poller.best()``)
     """
     state.poller = poll or poller.best()
     log.info("resetting fd poller, using %s" % type(state.poller).__name__)
+
+    # a fresh wakeup pipe too, so a forked child doesn't share its parent's
+    if state.wakeup_fds is not None:
+        for fd in state.wakeup_fds:
+            os.close(fd)
+        state.descriptormap.pop(state.wakeup_fds[0], None)
+    state.wakeup_fds = os.pipe()
+    for fd in state.wakeup_fds:
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    _register_fd(state.wakeup_fds[0], _run_threadsafe_calls, None)
+
+    state.wakeup_pending = False
+    if state.threadsafe_calls:
+        _wake_loop()
+
+
+def _reset_after_fork():
+    # drop everything a forked child inherited from its parent's scheduler:
+    # none of those greenlets, waits, deadlines or cross-thread calls are
+    # the child's to run, and its poller and wakeup pipe have to be its own
+    state.to_run.clear()
+    state.paused = []
+    state.awoken_from_events.clear()
+    state.timed_paused.clear()
+    state.descriptormap.clear()
+    state.edge_callbacks.clear()
+    for queue in state.class_queues:
+        queue.clear()
+    state.to_raise.clear()
+    state.deadlines.clear()
+    state.threadsafe_calls.clear()
+    del state.idle_workers[:]
+    reset_poller()
+
+
+def call_threadsafe(func, *args, **kwargs):
+    """run a function in a new greenlet in the scheduler, from any thread
+
+    this is the only way to safely get anything into the scheduler from
+    outside the OS thread that runs it. it wakes the loop up if it is
+    blocked in the poller, so the function starts right away.
+
+    :param func: the function to run
+    :type func: function
+
+    all other positional and keyword arguments are passed along to ``func``
+    """
+    state.threadsafe_calls.append((func, args, kwargs))
+
+    # only the first call since the loop last looked needs to wake it
+    if not state.wakeup_pending:
+        _wake_loop()
+
+
+def submit_threadsafe(func, *args, **kwargs):
+    """run a function in the scheduler and get a future for its result
+
+    like :func:`call_threadsafe`, this can be called from any thread.
+
+    :param func: the function to run
+    :type func: function
+
+    all other positional and keyword arguments are passed along to ``func``
+
+    :returns:
+        a :class:`Future` which will have ``func``'s return value or
+        exception once it completes
+    """
+    future = Future()
+    call_threadsafe(future._run, func, args, kwargs)
+    return future
+
+
+def _wake_loop():
+    state.wakeup_pending = True
+    try:
+        os.write(state.wakeup_fds[1], "x")
+    except EnvironmentError, exc:
+        # a full pipe will wake it up all the same
+        if exc.args[0] != errno.EAGAIN:
+            raise
+
+
+def _run_threadsafe_calls():
+    state.wakeup_pending = False
+    try:
+        while os.read(state.wakeup_fds[0], 4096):
+            pass
+    except EnvironmentError, exc:
+        if exc.args[0] != errno.EAGAIN:
+            raise
+
+    calls = state.threadsafe_calls
+    while calls:
+        func, args, kwargs = calls.popleft()
+        schedule(func, args, kwargs)
+
+
+def start_loop_thread():
+    """move the scheduler into a new background thread and start it running
+
+    from then on, the calling thread (and any others) should only hand work
+    to the scheduler through :func:`call_threadsafe` and
+    :func:`submit_threadsafe`. this has to happen before anything is
+    scheduled (or passed to :func:`call_threadsafe`), since greenlets can't
+    move between threads.
+
+    :returns: the new thread's id
+    """
+    if state.to_run or state.paused or state.timed_paused or any(
+            state.class_queues) or state.threadsafe_calls:
+        raise RuntimeError("the scheduler already has work in this thread")
+
+    started = _allocate_lock()
+    started.acquire()
+    previous = state.mainloop, state.loop_thread, state.idle_workers
+
+    def run():
+        state.mainloop = compat.greenlet(_run_mainloop)
+        state.loop_thread = thread.get_ident()
+
+        # greenlets can't be switched to from another thread
+        state.idle_workers = []
+        state.loop_exited = _allocate_lock()
+        state.loop_exited.acquire()
+        started.release()
+        try:
+            # the loop only comes back here when stop_loop_thread asks it to
+            state.mainloop.switch()
+        finally:
+            # whatever is left belongs to this thread's greenlets, which the
+            # scheduler can't switch to once it's back in the old thread
+            state.to_run.clear()
+            state.paused = []
+            state.awoken_from_events.clear()
+            state.timed_paused.clear()
+            for queue in state.class_queues:
+                queue.clear()
+            state.mainloop, state.loop_thread, state.idle_workers = previous
+            state.loop_exited.release()
+
+    _start_new_thread(run, ())
+    started.acquire()
+    return state.loop_thread
+
+
+def stop_loop_thread(timeout=None):
+    """stop the background thread started by :func:`start_loop_thread`
+
+    the scheduler goes back to the thread that started it, though anything
+    left scheduled in the background thread is dropped.
+
+    :param timeout: maximum time in seconds to wait for it to exit
+    :type timeout: int, float or None
+
+    :returns: bool, whether the timeout expired before the thread exited
+    """
+    call_threadsafe(_leave_loop_thread)
+    return not _acquire(state.loop_exited, timeout)
+
+
+def _leave_loop_thread():
+    # the thread's root greenlet is sitting in start_loop_thread's run()
+    state.mainloop.parent.switch()
+
+
+def _acquire(lock, timeout):
+    # lock.acquire() with a timeout, the way python 2's threading does it
+    if timeout is None:
+        lock.acquire()
+        return True
+
+    deadline = compat.monotonic() + timeout
+    delay = 0.0005
+    while not lock.acquire(0):
+        remaining = deadline - compat.monotonic()
+        if remaining <= 0:
+            return False
+        _sleep(min(delay, remaining, 0.05))
+        delay *= 2
+    return True
+
+
+class Future(object):
+    """the eventual result of a :func:`submit_threadsafe` call
+
+    this follows the api of python 3's ``concurrent.futures.Future``, and is
+    safe to use from any thread. the blocking methods block the whole OS
+    thread though, so they aren't for use from inside the scheduler.
+    """
+    def __init__(self):
+        self._lock = _allocate_lock()
+        self._state = "pending"
+        self._result = self._exception = None
+        self._waiters = []
+        self._callbacks = []
+
+    def cancel(self):
+        """cancel the call if it hasn't started yet
+
+        :returns: bool, whether the call is now cancelled
+        """
+        with self._lock:
+            if self._state == "pending":
+                self._state = "cancelled"
+            elif self._state != "cancelled":
+                return False
+        self._finish()
+        return True
+
+    def cancelled(self):
+        "whether the call was cancelled"
+        return self._state == "cancelled"
+
+    def running(self):
+        "whether the call is currently running"
+        return self._state == "running"
+
+    def done(self):
+        "whether the call has finished or been cancelled"
+        return self._state in ("finished", "cancelled")
+
+    def result(self, timeout=None):
+        """wait for and return the call's return value
+
+        :param timeout: maximum time in seconds to wait
+        :type timeout: int, float or None
+
+        :raises:
+            ``TimeoutError`` if the timeout expires first, ``CancelledError``
+            if the call was cancelled, or whatever exception the call raised
+        """
+        exc = self.exception(timeout)
+        if exc is not None:
+            raise exc
+        return self._result
+
+    def exception(self, timeout=None):
+        """wait for the call and return the exception it raised, if any
+
+        :param timeout: maximum time in seconds to wait
+        :type timeout: int, float or None
+
+        :raises:
+            ``TimeoutError`` if the timeout expires first, or
+            ``CancelledError`` if the call was cancelled
+        """
+        if not self.done():
+            waiter = _allocate_lock()
+            waiter.acquire()
+            with self._lock:
+                if not self.done():
+                    self._waiters.append(waiter)
+                else:
+                    waiter.release()
+            if not _acquire(waiter, timeout):
+                with self._lock:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+                if not self.done():
+                    raise TimeoutError()
+
+        if self._state == "cancelled":
+            raise CancelledError()
+        return self._exception
+
+    def add_done_callback(self, func):
+        """arrange for a function to be called with the future once it's done
+
+        it is called right away if the future is already done, otherwise in
+        the scheduler's thread.
+        """
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    def _run(self, func, args, kwargs):
+        with self._lock:
+            if self._state != "pending":
+                return
+            self._state = "running"
+        try:
+            self._result = func(*args, **kwargs)
+        except Exception, exc:
+            self._exception = exc
+        with self._lock:
+            self._state = "finished"
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            waiters, self._waiters = self._waiters, []
+            callbacks, self._callbacks = self._callbacks, []
+        for waiter in waiters:
+            waiter.release()
+        for func in callbacks:
+            try:
+                func(self)
+            except Exception:
+                log.exception("exception in a future's done callback")
@@ -0,0 +1,213 @@
+"""
+offload blocking calls to a pool of real OS threads
+
+some things block the whole process no matter how much is monkey-patched:
+C extensions, disk reads, ``os.stat``, libc's ``getaddrinfo``, compression.
+:func:`run_in_thread` hands a call like that to a worker thread and blocks
+only the calling greenlet, which the scheduler wakes back up (through its
+poller) once the result is in. the rest of the greenlets keep running the
+whole time.
+"""
+from __future__ import absolute_import, with_statement
+
+import collections
+import os
+import sys
+import thread
+
+from . import compat, scheduler, util
+
+
+__all__ = ["ThreadPool", "run_in_thread"]
+
+# grab these before any monkey-patching can make them cooperative
+_allocate_lock = thread.allocate_lock
+_start_new_thread = thread.start_new_thread
+
+_STOP = object()
+
+
+class ThreadPool(object):
+    """a bounded pool of OS threads for running blocking functions
+
+    threads are started as they're needed, up to ``size`` of them, and then
+    stay around waiting for more work.
+
+    :param size: the most threads to run at once
+    :type size: int
+    :param max_queue:
+        the most calls that may wait for a free thread. once it is reached,
+        further :meth:`run` calls block their greenlets until there is room.
+        0 (the default) means no limit.
+    :type max_queue: int
+    """
+    def __init__(self, size=10, max_queue=0):
+        self.size = size
+        self.max_queue = max_queue
+        self._reset()
+        self._closing = False
+        self._room = util.Semaphore(size + max_queue) if max_queue else None
+
+        self._counters = dict.fromkeys(("submitted", "completed", "failed",
+                "queue_time", "run_time"), 0)
+
+    def run(self, func, *args, **kwargs):
+        """run a function in one of the pool's threads and return its result
+
+        .. note:: this method will block the current greenlet (only)
+
+        :param func: the function to run
+
+        all other positional and keyword arguments are passed along to
+        ``func``. if ``func`` raises an exception, it is re-raised here.
+        """
+        if self._closing:
+            raise RuntimeError("the thread pool has been closed")
+        if self._pid != os.getpid():
+            self._reset()
+
+        if self._room is not None:
+            self._room.acquire()
+            if self._closing:
+                # closed while we waited for room, no thread is left for us
+                self._room.release()
+                raise RuntimeError("the thread pool has been closed")
+        job = [func, args, kwargs, compat.getcurrent(), compat.monotonic(),
+                None, False]
+        try:
+            self._submit(job)
+            while job[5] is None:
+                scheduler.state.mainloop.switch()
+        finally:
+            # if something else woke us (an exception thrown in, say), the
+            # result mustn't wake us again from whatever we block on next
+            job[6] = True
+            if self._room is not None:
+                self._room.release()
+
+        result, success = job[5]
+        if not success:
+            raise result[0], result[1], result[2]
+        return result
+
+    def close(self):
+        """stop the pool's threads once they have finished their queued work
+        """
+        self._closing = True
+        with self._mutex:
+            for i in xrange(self._threads):
+                self._jobs.append(_STOP)
+            idle, self._idle = self._idle, []
+        for waiter in idle:
+            waiter.release()
+
+    def stats(self):
+        """a snapshot of the pool's metrics
+
+        :returns: a dict with keys:
+
+            - ``size``, ``max_queue``: the pool's limits
+            - ``threads``: threads currently started
+            - ``busy``: threads currently running a call
+            - ``queued``: calls waiting for a thread
+            - ``submitted``, ``completed``, ``failed``: calls so far, and how
+              many of them have returned or raised
+            - ``queue_time``, ``run_time``: total seconds that completed
+              calls spent waiting for a thread and running in one
+        """
+        with self._mutex:
+            result = dict(self._counters)
+            result.update(size=self.size, max_queue=self.max_queue,
+                    threads=self._threads,
+                    busy=self._busy,
+                    queued=len(self._jobs))
+        return result
+
+    def _reset(self):
+        # a forked child gets none of the parent's threads, only their
+        # bookkeeping (and maybe a mutex one of them was holding)
+        self._pid = os.getpid()
+        self._mutex = _allocate_lock()
+        self._jobs = collections.deque()
+        self._idle = []
+        self._threads = 0
+        self._busy = 0
+
+    def _submit(self, job):
+        with self._mutex:
+            self._counters["submitted"] += 1
+            self._jobs.append(job)
+            if self._idle:
+                self._idle.pop().release()
+            elif self._threads < self.size:
+                self._threads += 1
+                _start_new_thread(self._work, ())
+
+    def _work(self):
+        waiter = _allocate_lock()
+        waiter.acquire()
+        while 1:
+            with self._mutex:
+                if not self._jobs:
+                    self._idle.append(waiter)
+                    job = None
+                else:
+                    job = self._jobs.popleft()
+                    if job is _STOP:
+                        self._threads -= 1
+                        return
+                    self._busy += 1
+
+            if job is None:
+                # sleep until _submit or close hands us the lock
+                waiter.acquire()
+                continue
+
+            func, args, kwargs, glet, queued = job[:5]
+            started = compat.monotonic()
+            try:
+                job[5] = (func(*args, **kwargs), True)
+            except:
+                job[5] = (sys.exc_info(), False)
+            finished = compat.monotonic()
+
+            # done with the call by the time its caller can see the stats
+            with self._mutex:
+                self._busy -= 1
+                self._counters["completed" if job[5][1] else "failed"] += 1
+                self._counters["queue_time"] += started - queued
+                self._counters["run_time"] += finished - started
+
+            scheduler.call_threadsafe(self._resume, job)
+            del job, func, args, kwargs, glet
+
+    @staticmethod
+    def _resume(job):
+        # this runs in the scheduler's thread, so unlike the worker it can
+        # tell whether run() is still waiting for the job
+        if not job[6] and not scheduler.handoff(job[3]):
+            scheduler.schedule(job[3])
+
+
+# the pool that run_in_thread uses, created on first use if it is still None
+default_pool = None
+
+
+def run_in_thread(func, *args, **kwargs):
+    """run a blocking function in the default :class:`ThreadPool`
+
+    .. note:: this method will block the current greenlet (only)
+
+    the default pool is created with the default size the first time it is
+    needed, or a differently configured one can be put in place first by
+    assigning it to ``threadpool.default_pool``.
+
+    :param func: the function to run
+
+    all other positional and keyword arguments are passed along to ``func``,
+    and its return value is returned (or its exception re-raised).
+    """
+    global default_pool
+    if default_pool is None:
+        default_pool = ThreadPool()
+    return default_pool.run(func, *args, **kwargs)
@@ -1,7 +1,6 @@
 import collections
 import heapq
 from Queue import Empty, Full
-import time
 import weakref
 
 from greenhouse import compat, scheduler
@@ -12,14 +11,26 @@ __all__ = ["Event", "Lock", "RLock", "Condition", "Semaphore",
            "LifoQueue", "PriorityQueue", "Counter"]
 
 
+def _wake(waiter, handoff):
+    # wake a greenlet blocked on one of these, switching to it if asked to
+    if not (handoff and scheduler.handoff(waiter)):
+        scheduler.state.awoken_from_events.add(waiter)
+
+
 class Event(object):
     """an event for which greenlets can wait
 
     mirrors the standard library `threading.Event` API
+
+    :param handoff:
+        have :meth:`set` switch straight to the first greenlet waiting,
+        rescheduling the setter (see :func:`greenhouse.scheduler.handoff`)
+    :type handoff: bool
     """
-    def __init__(self):
+    def __init__(self, handoff=False):
         self._is_set = False
         self._waiters = []
+        self._handoff = handoff
 
     def is_set(self):
         """indicates whether waiting on the event will block right now
@@ -40,8 +51,15 @@ class Event(object):
         :meth:`clear` has been called
         """
         self._is_set = True
-        scheduler.state.awoken_from_events.update(self._waiters)
-        del self._waiters[:]
+        waiters = self._waiters
+        if self._handoff and waiters:
+            first = waiters[0]
+            scheduler.state.awoken_from_events.update(waiters[1:])
+            del waiters[:]
+            _wake(first, True)
+        else:
+            scheduler.state.awoken_from_events.update(waiters)
+            del waiters[:]
 
     def clear(self):
         """clear the event from being triggered
@@ -51,7 +69,7 @@ class Event(object):
         """
         self._is_set = False
 
-    def wait(self, timeout=None):
+    def wait(self, timeout=None, slack=None):
         """pause the current coroutine until this event is set
 
         .. note::
@@ -63,24 +81,29 @@ class Event(object):
             the maximum amount of time to block in seconds. the default of
             ``None`` allows indefinite blocking.
         :type timeout: number or None
+        :param slack:
+            how much later than ``timeout`` the wait may end, so that the
+            timeout can fire together with others (see
+            :func:`schedule_at<greenhouse.scheduler.schedule_at>`)
+        :type slack: number or None
 
         :returns:
-            ``True`` if a timeout was provided and was hit, otherwise ``False``
+            ``True`` if a timeout was provided and was hit (or a
+            :func:`deadline<greenhouse.scheduler.deadline>` passed),
+            otherwise ``False``
         """
         if self._is_set:
             return False
 
         current = compat.getcurrent()  # the waiting greenlet
 
-        waketime = None if timeout is None else time.time() + timeout
-        if timeout is not None:
-            scheduler.schedule_at(waketime, current)
+        timer = scheduler._wait_timer(timeout, current, slack)
 
         self._waiters.append(current)
         scheduler.state.mainloop.switch()
 
-        if timeout is not None:
-            if not scheduler._remove_timer(waketime, current):
+        if timer is not None:
+            if not timer.cancel():
                 scheduler.state.awoken_from_events.discard(current)
                 if current in self._waiters:
                     self._waiters.remove(current)
@@ -93,11 +116,18 @@ class Lock(object):
     """an object that can only be 'owned' by one greenlet at a time
 
     mirrors the standard library `threading.Lock` API
+
+    :param handoff:
+        have :meth:`release` hand the lock over by switching straight to
+        the next waiter, rescheduling the releasing greenlet (see
+        :func:`greenhouse.scheduler.handoff`)
+    :type handoff: bool
     """
-    def __init__(self):
+    def __init__(self, handoff=False):
         self._locked = False
         self._owner = None
         self._waiters = collections.deque()
+        self._handoff = handoff
 
     def _is_owned(self):
         return self._owner is compat.getcurrent()
@@ -160,7 +190,7 @@ class Lock(object):
             waiter = self._waiters.popleft()
             self._locked = True
             self._owner = waiter
-            scheduler.state.awoken_from_events.add(waiter)
+            _wake(waiter, self._handoff)
         else:
             self._locked = False
             self._owner = None
@@ -178,9 +208,14 @@ class RLock(Lock):
     """a lock which may be acquired more than once by the same greenlet
 
     mirrors the standard library `threading.RLock` API
+
+    :param handoff:
+        as for :class:`Lock`, have the final :meth:`release` switch
+        straight to the next waiter
+    :type handoff: bool
     """
-    def __init__(self):
-        super(RLock, self).__init__()
+    def __init__(self, handoff=False):
+        super(RLock, self).__init__(handoff)
         self._count = 0
 
     def acquire(self, blocking=True):
@@ -239,7 +274,7 @@ class RLock(Lock):
                 waiter = self._waiters.popleft()
                 self._locked = True
                 self._owner = waiter
-                scheduler.state.awoken_from_events.add(waiter)
+                _wake(waiter, self._handoff)
             else:
                 self._locked = False
                 self._owner = None
@@ -288,22 +323,19 @@ class Condition(object):
 
         current = compat.getcurrent()
 
-        waketime = None if timeout is None else time.time() + timeout
-        if timeout is not None:
-            scheduler.schedule_at(waketime, current)
-        self._waiters.append((current, waketime))
+        timer = scheduler._wait_timer(timeout, current)
+        self._waiters.append((current, timer))
 
         self._lock.release()
         scheduler.state.mainloop.switch()
-        self._lock.acquire()
 
-        if timeout is not None:
-            timedout = not scheduler._remove_timer(waketime, current)
-            if timedout:
-                self._waiters.remove((current, waketime))
-            return timedout
+        # settle the timer before possibly blocking again on the lock
+        timedout = timer is not None and not timer.cancel()
+        if timedout:
+            self._waiters.remove((current, timer))
 
-        return False
+        self._lock.acquire()
+        return timedout
 
     def notify(self, num=1):
         """wake one or more waiting greenlets
@@ -342,11 +374,17 @@ class Semaphore(object):
     :param value:
         the starting value of the counter
     :type value: int
+    :param handoff:
+        have :meth:`release` switch straight to a waiting greenlet, if
+        there is one, rescheduling the caller (see
+        :func:`greenhouse.scheduler.handoff`)
+    :type handoff: bool
     """
-    def __init__(self, value=1):
+    def __init__(self, value=1, handoff=False):
         assert value >= 0, "semaphore value cannot be negative"
         self._value = value
         self._waiters = collections.deque()
+        self._handoff = handoff
 
     def acquire(self, blocking=True):
         """decrement the counter, waiting if it is already at 0
@@ -378,7 +416,7 @@ class Semaphore(object):
     def release(self):
         "increment the counter, waking up a waiter if there was any"
         if self._waiters:
-            scheduler.state.awoken_from_events.add(self._waiters.popleft())
+            _wake(self._waiters.popleft(), self._handoff)
         else:
             self._value += 1
 
@@ -397,9 +435,12 @@ class BoundedSemaphore(Semaphore):
     :param value:
         the starting and maximum value of the counter
     :type value: int
+    :param handoff:
+        as for :class:`Semaphore`
+    :type handoff: bool
     """
-    def __init__(self, value=1):
-        super(BoundedSemaphore, self).__init__(value)
+    def __init__(self, value=1, handoff=False):
+        super(BoundedSemaphore, self).__init__(value, handoff)
         self._initial_value = value
 
     def release(self):
@@ -708,13 +749,20 @@ class Queue(object):
         can block. the default of 0 turns off the limit, so :meth:`put` will
         never block
     :type maxsize: int
+    :param handoff:
+        when a :meth:`put` or :meth:`get` unblocks a waiting greenlet,
+        reschedule the caller and switch straight to the waiter (see
+        :func:`greenhouse.scheduler.handoff`). this saves a trip through
+        the mainloop for every item passed along a pipeline.
+    :type handoff: bool
 
     mirrors the standard library `Queue.Queue` API
     """
     _data_type = collections.deque
 
-    def __init__(self, maxsize=0):
+    def __init__(self, maxsize=0, handoff=False):
         self._maxsize = maxsize
+        self._handoff = handoff
         self._waiters = collections.deque()
         self._data = self._data_type()
         self._open_tasks = 0
@@ -761,7 +809,8 @@ class Queue(object):
 
         :raises:
             :class:`Empty` if there is no data in the queue and block is
-            ``False``, or `timeout` expires
+            ``False``, or `timeout` expires (or a :func:`deadline
+            <greenhouse.scheduler.deadline>` passes)
 
         :returns: something that was previously :meth:`put` in the queue
         """
@@ -771,20 +820,20 @@ class Queue(object):
 
             current = compat.getcurrent()
 
-            waketime = None if timeout is None else time.time() + timeout
-            if timeout is not None:
-                scheduler.schedule_at(waketime, current)
-            self._waiters.append((current, waketime))
+            timer = scheduler._wait_timer(timeout, current)
+            self._waiters.append((current, timer))
 
             scheduler.state.mainloop.switch()
 
-            if timeout is not None:
-                if not scheduler._remove_timer(waketime, current):
-                    self._waiters.remove((current, waketime))
-                    raise Empty()
+            if timer is not None and not timer.cancel():
+                self._waiters.remove((current, timer))
+                raise Empty()
 
         if self.full() and self._waiters:
-            scheduler.schedule(self._waiters.popleft()[0])
+            waiter = self._waiters.popleft()[0]
+            item = self._get()
+            self._wake(waiter)
+            return item
 
         return self._get()
 
@@ -822,7 +871,8 @@ class Queue(object):
 
         :raises:
             :class:`Full` if the queue is :meth:`full` and `block` is
-            ``False``, or if `timeout` expires.
+            ``False``, or if `timeout` expires (or a :func:`deadline
+            <greenhouse.scheduler.deadline>` passes).
         """
         if self.full():
             if not block:
@@ -830,20 +880,18 @@ class Queue(object):
 
             current = compat.getcurrent()
 
-            waketime = None if timeout is None else time.time() + timeout
-            if timeout is not None:
-                scheduler.schedule_at(waketime, current)
-            self._waiters.append((current, waketime))
+            timer = scheduler._wait_timer(timeout, current)
+            self._waiters.append((current, timer))
 
             scheduler.state.mainloop.switch()
 
-            if timeout is not None:
-                if not scheduler._remove_timer(waketime, current):
-                    self._waiters.remove((current, waketime))
-                    raise Full()
+            if timer is not None and not timer.cancel():
+                self._waiters.remove((current, timer))
+                raise Full()
 
+        waiter = None
         if self._waiters and not self.full():
-            scheduler.schedule(self._waiters.popleft()[0])
+            waiter = self._waiters.popleft()[0]
 
         if not self._open_tasks:
             self._jobs_done.clear()
@@ -851,6 +899,13 @@ class Queue(object):
 
         self._put(item)
 
+        if waiter is not None:
+            self._wake(waiter)
+
+    def _wake(self, waiter):
+        if not (self._handoff and scheduler.handoff(waiter)):
+            scheduler.schedule(waiter)
+
     def put_nowait(self, item):
         """put an item into the queue without any chance of blocking
 
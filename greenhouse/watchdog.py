@@ -0,0 +1,115 @@
+"""
+a watchdog that notices when a greenlet is hogging the event loop
+
+a single greenlet that does a long stretch of CPU work, or makes a truly
+blocking call, without ever yielding stalls every other greenlet in the
+process. the watchdog is an OS thread that keeps an eye on the mainloop's
+heartbeat, and if the loop hasn't switched greenlets in too long it grabs
+the stack of whatever is running and reports it.
+
+while the loop is healthy the only cost is the watchdog thread waking up a
+few times per threshold to look at the heartbeat.
+"""
+from __future__ import absolute_import
+
+import logging
+import sys
+import thread
+import time
+import traceback
+
+from . import compat, scheduler
+
+
+__all__ = ["start_watchdog", "stop_watchdog"]
+
+
+log = logging.getLogger("greenhouse.watchdog")
+
+# grab these before any monkey-patching can make them cooperative
+_start_new_thread = thread.start_new_thread
+_sleep = time.sleep
+
+# checks of the heartbeat per threshold period
+CHECKS_PER_THRESHOLD = 4
+
+_watching = [None]
+
+
+def start_watchdog(threshold=1.0, callback=None):
+    """start watching for greenlets that block the event loop
+
+    calling it again replaces the running watchdog.
+
+    :param threshold:
+        how long (in seconds) the loop may go without switching greenlets
+        before it is considered blocked
+    :type threshold: int or float
+    :param callback:
+        called from the watchdog thread once per stall with 3 arguments:
+
+        - the greenlet that is running, or the
+          :class:`CallbackHandle<greenhouse.scheduler.CallbackHandle>` of a
+          callback that the mainloop is running itself
+        - how long (in seconds) the loop has been blocked so far
+        - the greenlet's current stack, formatted as a string
+
+        the default logs a warning to the ``greenhouse.watchdog`` logger.
+    :type callback: function
+    """
+    stop_watchdog()
+    token = object()
+    _watching[0] = token
+    _start_new_thread(_watch, (token, threshold, callback or _log_block))
+
+
+def stop_watchdog():
+    """stop the watchdog started by :func:`start_watchdog`
+
+    :returns: bool, whether there had been a watchdog running
+    """
+    running = _watching[0] is not None
+    _watching[0] = None
+    return running
+
+
+def _log_block(glet, elapsed, stack):
+    log.warning("event loop blocked for %.3fs by %r:\n%s" %
+            (elapsed, glet, stack))
+
+
+def _watch(token, threshold, callback):
+    state = scheduler.state
+    sleep, monotonic = _sleep, compat.monotonic
+    last = None
+    since = monotonic()
+    reported = False
+
+    while 1:
+        sleep(float(threshold) / CHECKS_PER_THRESHOLD)
+
+        # stopped, or python shutdown
+        if not (sys and _watching) or _watching[0] is not token:
+            break
+        now = monotonic()
+
+        beat = (state.passes, id(state.running))
+        if beat != last or state.running is None:
+            # the loop has moved on, or is just waiting in the poller
+            last, since, reported = beat, now, False
+            continue
+
+        if reported or now - since < threshold:
+            continue
+        reported = True
+
+        frame = sys._current_frames().get(state.loop_thread)
+        if frame is None:
+            continue
+        stack = "".join(traceback.format_stack(frame))
+        del frame
+
+        try:
+            callback(state.running, now - since, stack)
+        except Exception:
+            log.exception("watchdog callback failed")
@@ -30,7 +30,11 @@ class StateClearingTestCase(unittest.TestCase):
         state.timed_paused.clear()
         state.paused[:] = []
         state.descriptormap.clear()
+        state.edge_callbacks.clear()
         state.to_run.clear()
+        for queue in state.class_queues:
+            queue.clear()
+        state.threadsafe_calls.clear()
         del state.global_exception_handlers[:]
         state.local_exception_handlers.clear()
         del state.global_hooks[:]
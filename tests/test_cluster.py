@@ -0,0 +1,89 @@
+import os
+import random
+import signal
+import socket
+import unittest
+
+from greenhouse import cluster, io, scheduler
+
+from test_base import TESTING_TIMEOUT, StateClearingTestCase
+
+
+def echo(client, address):
+    while 1:
+        data = client.recv(8192)
+        if not data:
+            break
+        client.sendall(data)
+    client.close()
+
+
+class ClusterTests(StateClearingTestCase):
+    def setUp(self):
+        super(ClusterTests, self).setUp()
+        self.port = random.randrange(20000, 60000)
+        self.cluster = cluster.Cluster(echo, ("127.0.0.1", self.port),
+                workers=2, drain_timeout=TESTING_TIMEOUT * 4,
+                restart_delay=0, health_interval=TESTING_TIMEOUT)
+        self.cluster.start()
+
+    def tearDown(self):
+        self.cluster.stop()
+        self.cluster.join(TESTING_TIMEOUT * 20)
+        super(ClusterTests, self).tearDown()
+
+    def echo(self, data):
+        sock = io.Socket()
+        sock.connect(("127.0.0.1", self.port))
+        sock.sendall(data)
+        try:
+            return sock.recv(8192)
+        finally:
+            sock.close()
+
+    def test_workers_serve(self):
+        for i in xrange(10):
+            self.assertEqual(self.echo("hello %d" % i), "hello %d" % i)
+
+    def test_health(self):
+        for i in xrange(4):
+            self.echo("hi")
+        scheduler.pause_for(TESTING_TIMEOUT * 3)
+
+        health = self.cluster.health()
+        self.assertEqual(len(health), 2)
+        self.assertEqual(sum(report['accepted']
+                for report in health.itervalues()), 4)
+        for report in health.itervalues():
+            self.assertEqual(report['active'], 0)
+
+    def test_restarts_dead_worker(self):
+        pids = set(self.cluster.health())
+        os.kill(pids.pop(), signal.SIGKILL)
+        scheduler.pause_for(TESTING_TIMEOUT * 6)
+
+        after = set(self.cluster.health())
+        self.assertEqual(len(after), 2)
+        assert pids < after
+        self.assertEqual(self.echo("still here"), "still here")
+
+    def test_stop_drains(self):
+        sock = io.Socket()
+        sock.connect(("127.0.0.1", self.port))
+        sock.sendall("first")
+        self.assertEqual(sock.recv(8192), "first")
+
+        self.cluster.stop()
+        scheduler.pause_for(TESTING_TIMEOUT)
+
+        # the open connection is still served
+        sock.sendall("last one")
+        self.assertEqual(sock.recv(8192), "last one")
+        sock.close()
+
+        assert not self.cluster.join(TESTING_TIMEOUT * 20)
+        self.assertEqual(self.cluster.health(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -86,6 +86,165 @@ class SocketPollerMixin(object):
             handler.sendall("hello, world")
             assert client.recv(12) == "hello, world"
 
+    def _read_all(self, sock, length):
+        received = []
+
+        @greenhouse.schedule
+        def reader():
+            while length > sum(map(len, received)):
+                received.append(sock.recv(65536))
+
+        return received
+
+    def test_sendall_large(self):
+        data = "".join(chr(i % 251) for i in xrange(256)) * 8192
+        with self.socketpair() as (client, handler):
+            received = self._read_all(handler, len(data))
+            client.sendall(data)
+            while sum(map(len, received)) < len(data):
+                greenhouse.pause()
+            self.assertEqual("".join(received), data)
+
+    def test_send_flags(self):
+        with self.socketpair() as (client, handler):
+            client.send("x", socket.MSG_OOB)
+            self.assertEqual(handler.recv(1, socket.MSG_OOB), "x")
+
+    def test_sendall_many(self):
+        with self.socketpair() as (client, handler):
+            client.sendall_many(["head", "", bytearray("er\r\n"),
+                    memoryview("body"), buffer("!")])
+            self.assertEqual(handler.recv(32), "header\r\nbody!")
+
+    def test_sendall_many_large(self):
+        chunks = ["%06d" % i * 100 for i in xrange(5000)]
+        data = "".join(chunks)
+        kinds = (str, bytearray, memoryview, buffer)
+        with self.socketpair() as (client, handler):
+            received = self._read_all(handler, len(data))
+            client.sendall_many(kinds[i % 4](chunk)
+                    for i, chunk in enumerate(chunks))
+            while sum(map(len, received)) < len(data):
+                greenhouse.pause()
+            self.assertEqual("".join(received), data)
+
+    def _sendfile_data(self):
+        data = "".join(chr(i % 251) for i in xrange(256)) * 4096
+        fd, path = tempfile.mkstemp()
+        os.write(fd, data)
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+        return data, path
+
+    def test_sendfile(self):
+        data, path = self._sendfile_data()
+        with self.socketpair() as (client, handler):
+            received = self._read_all(handler, len(data))
+            with open(path, 'rb') as fp:
+                self.assertEqual(client.sendfile(fp), len(data))
+                self.assertEqual(fp.tell(), len(data))
+            while sum(map(len, received)) < len(data):
+                greenhouse.pause()
+            self.assertEqual("".join(received), data)
+
+    def test_sendfile_offset_count(self):
+        data, path = self._sendfile_data()
+        with self.socketpair() as (client, handler):
+            received = self._read_all(handler, 300000)
+            fp = greenhouse.File(path)
+            self.assertEqual(client.sendfile(fp, 1000, 300000), 300000)
+            self.assertEqual(fp.tell(), 301000)
+            self.assertEqual(client.sendfile(fp, len(data)), 0)
+            fp.close()
+            while sum(map(len, received)) < 300000:
+                greenhouse.pause()
+            self.assertEqual("".join(received), data[1000:301000])
+
+    def test_sendfile_pipe(self):
+        data = "".join(chr(i % 251) for i in xrange(256)) * 64
+        rfd, wfd = os.pipe()
+        os.write(wfd, data)
+        os.close(wfd)
+        with self.socketpair() as (client, handler):
+            received = self._read_all(handler, len(data) - 100)
+            with os.fdopen(rfd, 'rb') as fp:
+                self.assertEqual(client.sendfile(fp, count=len(data) - 100),
+                        len(data) - 100)
+                self.assertEqual(fp.read(), data[-100:])
+            while sum(map(len, received)) < len(data) - 100:
+                greenhouse.pause()
+            self.assertEqual("".join(received), data[:-100])
+
+    def test_queue_writes(self):
+        with self.socketpair() as (client, handler):
+            client.queue_writes()
+
+            def sender(name):
+                for i in xrange(5):
+                    client.sendall("%s%d;" % (name, i))
+                    greenhouse.pause()
+
+            for name in "abc":
+                greenhouse.schedule(sender, args=(name,))
+            client.sendall_many(["x", "y;"])
+            self.assertEqual(client.send("z;"), 2)
+
+            received = self._read_all(handler, 5 + 3 * 5 * 3)
+            client.flush()
+            while sum(map(len, received)) < 5 + 3 * 5 * 3:
+                greenhouse.pause()
+            messages = "".join(received).split(";")[:-1]
+            self.assertEqual(messages[:2], ["xy", "z"])
+            for name in "abc":
+                self.assertEqual([m for m in messages if m[0] == name],
+                        ["%s%d" % (name, i) for i in xrange(5)])
+
+    def test_queue_writes_backpressure(self):
+        chunk = "".join(chr(i % 251) for i in xrange(1000))
+        queued = []
+        with self.socketpair() as (client, handler):
+            client.queue_writes(limit=4096)
+            received = self._read_all(handler, 1000 * len(chunk))
+            for i in xrange(1000):
+                client.sendall(chunk)
+                queued.append(client._wqueued)
+            client.flush()
+            while sum(map(len, received)) < 1000 * len(chunk):
+                greenhouse.pause()
+            self.assertEqual("".join(received), chunk * 1000)
+            self.assertTrue(max(queued) <= 4096, max(queued))
+
+    def test_queue_writes_error(self):
+        with self.socketpair() as (client, handler):
+            client.queue_writes()
+            handler.close()
+            greenhouse.pause_for(TESTING_TIMEOUT)
+
+            def send_until_error():
+                for i in xrange(100):
+                    client.sendall("x" * 65536)
+                    greenhouse.pause()
+            self.assertRaises(socket.error, send_until_error)
+            self.assertRaises(socket.error, client.flush)
+
+    def test_queue_writes_close(self):
+        with self.socketpair() as (client, handler):
+            client.queue_writes()
+            client.sendall("goodbye")
+            client.close()
+            self.assertEqual(handler.recv(7), "goodbye")
+
+    def test_queue_writes_cork(self):
+        if not hasattr(socket, "TCP_CORK"):
+            return
+        with self.socketpair() as (client, handler):
+            client.queue_writes(cork=True)
+            client.sendall("corked")
+            client.flush()
+            self.assertEqual(handler.recv(6), "corked")
+            self.assertEqual(client.getsockopt(
+                    socket.IPPROTO_TCP, socket.TCP_CORK), 0)
+
     def test_sendto(self):
         with self.socketpair() as (client, handler):
             client.sendto("howdy", ("", port()))
@@ -156,6 +315,111 @@ class SocketPollerMixin(object):
             greenhouse.pause()
             assert results and results[0] == "this is a test", results
 
+    def test_socketfile_readuntil(self):
+        with self.socketpair() as (client, handler):
+            reader = handler.makefile()
+            results = []
+
+            @greenhouse.schedule
+            def f():
+                results.append(reader.readuntil("\r\n\r\n"))
+                results.append(reader.readexactly(4))
+
+            # the delimiter arrives split across sends
+            for piece in ("GET / HTTP/1.1\r\nHost: x\r", "\n\r", "\nbo"):
+                client.send(piece)
+                greenhouse.pause()
+            self.assertEqual(results, ["GET / HTTP/1.1\r\nHost: x\r\n\r\n"])
+
+            client.send("dy")
+            greenhouse.pause()
+            self.assertEqual(results[1:], ["body"])
+
+    def test_socketfile_incomplete_read(self):
+        with self.socketpair() as (client, handler):
+            reader = handler.makefile()
+            client.send("partial")
+            client.close()
+            gc.collect()
+
+            try:
+                reader.readexactly(10)
+            except greenhouse.IncompleteRead, exc:
+                self.assertEqual(exc.partial, "partial")
+                self.assertEqual(exc.expected, 10)
+            else:
+                self.fail("readexactly() didn't raise IncompleteRead")
+
+    def test_socketfile_read_after_timeout(self):
+        with self.socketpair() as (client, handler):
+            handler.settimeout(TESTING_TIMEOUT)
+            reader = handler.makefile()
+            client.sendall("start of a ")
+            try:
+                reader.readline()
+            except socket.timeout:
+                # leave the traceback in sys.exc_info() for the retry
+                pass
+            else:
+                self.fail("readline() didn't time out")
+
+            # the retry has to grow the read buffer
+            line = "long line" + "x" * (reader.CHUNKSIZE * 4) + "\n"
+            client.sendall(line)
+            self.assertEqual(reader.readline(), "start of a " + line)
+
+    def test_socketfile_write_buffering(self):
+        with self.socketpair() as (client, handler):
+            writer = client.makefile('w', 4096)
+            for i in xrange(10):
+                writer.write("line %d\n" % i)
+            handler.setblocking(0)
+            self.assertRaises(socket.error, handler.recv, 4096)
+
+            greenhouse.pause()
+            self.assertEqual(handler.recv(4096),
+                    "".join("line %d\n" % i for i in xrange(10)))
+
+    def test_socketfile_line_buffered(self):
+        with self.socketpair() as (client, handler):
+            writer = client.makefile('w', 1)
+            writer.AUTO_FLUSH = False
+            writer.write("no newline, ")
+            handler.setblocking(0)
+            self.assertRaises(socket.error, handler.recv, 4096)
+
+            writer.write("now one\n")
+            self.assertEqual(handler.recv(4096), "no newline, now one\n")
+
+            # a 1 has nothing to do with how big the reads are
+            reader = handler.makefile('r', 1)
+            reads = []
+            real_read = reader._readinto_chunk
+
+            def counting_read(view):
+                reads.append(len(view))
+                return real_read(view)
+
+            reader._readinto_chunk = counting_read
+            handler.setblocking(1)
+            client.sendall("x" * 999 + "\n")
+            self.assertEqual(reader.readline(), "x" * 999 + "\n")
+            self.assertEqual(len(reads), 1)
+            del reader._readinto_chunk
+
+    def test_socketfile_auto_flush_blocks(self):
+        # more buffered than the socket takes at once, so the end-of-pass
+        # flush has to hand the rest off to a greenlet
+        chunk = "".join(chr(i % 251) for i in xrange(1000))
+        with self.socketpair() as (client, handler):
+            writer = client.makefile('w', 1 << 20)
+            for i in xrange(800):
+                writer.write(chunk)
+            received = self._read_all(handler, 800 * len(chunk))
+            while sum(map(len, received)) < 800 * len(chunk):
+                greenhouse.pause()
+            self.assertEqual("".join(received), chunk * 800)
+
     def test_socket_timeout(self):
         with self.socketpair() as (client, handler):
             client.settimeout(TESTING_TIMEOUT)
@@ -175,6 +439,22 @@ class SocketPollerMixin(object):
 
             greenhouse.pause()
 
+    def test_socket_timeout_slack(self):
+        with self.socketpair() as (client, handler):
+            client.settimeout(TESTING_TIMEOUT, TESTING_TIMEOUT)
+            start = time.time()
+            self.assertRaises(socket.timeout, client.recv, 10)
+            elapsed = time.time() - start
+            assert TESTING_TIMEOUT * 0.95 <= elapsed < TESTING_TIMEOUT * 3
+
+    def test_socket_deadline(self):
+        with self.socketpair() as (client, handler):
+            assert client.gettimeout() is None
+            with greenhouse.deadline(TESTING_TIMEOUT * 2):
+                handler.sendall("hi")
+                self.assertEqual(client.recv(10), "hi")
+                self.assertRaises(socket.timeout, client.recv, 10)
+
     def test_fromfd_from_gsock(self):
         with self.socketpair() as (client, handler):
             client = greenhouse.Socket(fromsock=client)
@@ -247,7 +527,7 @@ class SocketPollerMixin(object):
                 assert 0
 
     def test_fd_poller_cleanup_with_exception(self):
-        sock = greenhouse.Socket()
+        sock = greenhouse.Socket(edge_triggered=False)
         self.assertRaises(
                 (socket.error, OverflowError, ValueError),
                 sock.connect, ("", 893748))
@@ -272,11 +552,148 @@ if greenhouse.poller.KQueue._POLLER:
             StateClearingTestCase.setUp(self)
             greenhouse.scheduler.reset_poller(greenhouse.poller.KQueue())
 
+if greenhouse.poller.IoUringPoller._POLLER:
+    class IoUringSocketTestCase(SocketPollerMixin, StateClearingTestCase):
+        def setUp(self):
+            StateClearingTestCase.setUp(self)
+            greenhouse.scheduler.reset_poller(
+                    greenhouse.poller.IoUringPoller())
+
 class SelectSocketTestCase(SocketPollerMixin, StateClearingTestCase):
     def setUp(self):
         StateClearingTestCase.setUp(self)
         greenhouse.scheduler.reset_poller(greenhouse.poller.Select())
 
+if greenhouse.poller.Epoll._POLLER:
+    class EdgeTriggeredSocketTestCase(SocketPollerMixin, StateClearingTestCase):
+        def setUp(self):
+            StateClearingTestCase.setUp(self)
+            greenhouse.scheduler.reset_poller(greenhouse.poller.Epoll())
+            self._edge_default = greenhouse.io.sockets.EDGE_TRIGGERED
+            greenhouse.io.sockets.EDGE_TRIGGERED = True
+
+        def tearDown(self):
+            greenhouse.io.sockets.EDGE_TRIGGERED = self._edge_default
+            super(EdgeTriggeredSocketTestCase, self).tearDown()
+
+        def registered(self, sock):
+            return sock.fileno() in greenhouse.scheduler.state.poller._registry
+
+        def test_registered_for_lifetime(self):
+            with self.socketpair() as (client, handler):
+                assert self.registered(client)
+                assert self.registered(handler)
+                poller = greenhouse.scheduler.state.poller
+                for mask in poller._registry[client.fileno()]:
+                    assert mask & poller.EDGEMASK
+
+                client.send("howdy")
+                assert handler.recv(5) == "howdy"
+                assert self.registered(handler)
+
+                fd = client.fileno()
+                client.close()
+                assert fd not in poller._registry
+                assert fd not in greenhouse.scheduler.state.descriptormap
+
+        def test_dropped_socket_unregisters(self):
+            sock = greenhouse.Socket()
+            fd = sock.fileno()
+            assert self.registered(sock)
+            del sock
+            gc.collect()
+            assert fd not in greenhouse.scheduler.state.poller._registry
+
+        def test_latch_skips_known_eagain(self):
+            with self.socketpair() as (client, handler):
+                client.settimeout(TESTING_TIMEOUT)
+                self.assertRaises(socket.timeout, client.recv, 10)
+                assert not client._can_read
+
+                # the latch alone decides; nothing goes to the kernel
+                raw = client._sock
+                calls = []
+
+                class Recorder(object):
+                    def recv(self, *args):
+                        calls.append(args)
+                        return raw.recv(*args)
+                client._sock = Recorder()
+
+                self.assertRaises(socket.timeout, client.recv, 10)
+                assert not calls
+
+                handler.send("howdy")
+                assert client.recv(10) == "howdy"
+                assert len(calls) == 1
+                client._sock = raw
+
+        def test_fd_poller_cleanup_with_exception(self):
+            # the registration outlives a failed call, until close()
+            sock = greenhouse.Socket()
+            self.assertRaises(
+                    (socket.error, OverflowError, ValueError),
+                    sock.connect, ("", 893748))
+            assert self.registered(sock)
+            fd = sock.fileno()
+            sock.close()
+            assert fd not in greenhouse.scheduler.state.poller._registry
+
+        def test_explicit_level_triggered(self):
+            sock = greenhouse.Socket(edge_triggered=False)
+            assert not self.registered(sock)
+            sock.close()
+
+        def test_reregisters_with_new_poller(self):
+            with self.socketpair() as (client, handler):
+                greenhouse.scheduler.reset_poller(greenhouse.poller.Epoll())
+                assert not self.registered(client)
+
+                handler.send("howdy")
+                assert client.recv(5) == "howdy"
+                assert self.registered(client)
+
+        def test_makefile_stays_edge_triggered(self):
+            with self.socketpair() as (client, handler):
+                greenhouse.io.sockets.EDGE_TRIGGERED = False
+                client.settimeout(TESTING_TIMEOUT * 4)
+                reader = client.makefile('r')
+                assert reader._sock._edge
+
+                # an idle read mustn't leave the poller spinning on writability
+                polls = greenhouse.scheduler.stats()["polls"]
+                self.assertRaises(socket.timeout, reader.readline)
+                assert greenhouse.scheduler.stats()["polls"] - polls < 20
+                reader.close()
+
+        def test_downgraded_registration_drops_writability(self):
+            with self.socketpair() as (client, handler):
+                level = greenhouse.Socket(
+                        fromsock=client._sock, edge_triggered=False)
+                level.settimeout(TESTING_TIMEOUT * 4)
+                l = []
+
+                @greenhouse.schedule
+                def f():
+                    l.append(client.recv(10))
+
+                greenhouse.pause()
+                polls = greenhouse.scheduler.stats()["polls"]
+                self.assertRaises(socket.timeout, level.recv, 10)
+                assert greenhouse.scheduler.stats()["polls"] - polls < 20
+
+                # the edge-triggered reader still hears about data
+                handler.send("howdy")
+                greenhouse.pause_for(TESTING_TIMEOUT)
+                self.assertEqual(l, ["howdy"])
+
+        def test_level_triggered_pollers_ignore_it(self):
+            greenhouse.scheduler.reset_poller(greenhouse.poller.Select())
+            sock = greenhouse.Socket()
+            assert not sock._edge
+            assert not self.registered(sock)
+            sock.close()
+
 class FilePollerMixin(object):
     def setUp(self):
         super(FilePollerMixin, self).setUp()
@@ -451,6 +868,173 @@ test""")
         with open(self.fname) as fp:
             assert fp.read() == "".join(lines)
 
+    def test_write_buffer_flush(self):
+        fp = greenhouse.File(self.fname, 'w', 1024)
+        fp.AUTO_FLUSH = False
+        try:
+            fp.write("buffered")
+            with open(self.fname) as stdfp:
+                self.assertEqual(stdfp.read(), "")
+            fp.flush()
+            with open(self.fname) as stdfp:
+                self.assertEqual(stdfp.read(), "buffered")
+        finally:
+            fp.close()
+
+    def test_write_buffer_fills(self):
+        fp = greenhouse.File(self.fname, 'w', 16)
+        fp.AUTO_FLUSH = False
+        try:
+            fp.write("0123456789")
+            fp.write("0123456789")
+            with open(self.fname) as stdfp:
+                self.assertEqual(stdfp.read(), "01234567890123456789")
+        finally:
+            fp.close()
+
+    def test_close_flushes(self):
+        fp = greenhouse.File(self.fname, 'w', 1024)
+        fp.AUTO_FLUSH = False
+        fp.write("closing")
+        fp.close()
+        with open(self.fname) as stdfp:
+            self.assertEqual(stdfp.read(), "closing")
+
+    def test_dropped_file_writes_its_buffer(self):
+        fp = greenhouse.File(self.fname, 'w', 1024)
+        fd = fp.fileno()
+        fp.write("dropped ")
+        del fp
+
+        fp = greenhouse.File.fromfd(fd, 'w', 1024)
+        fp.write("twice")
+        del fp
+        gc.collect()
+        os.close(fd)
+
+        self.assertEqual(gc.garbage, [])
+        with open(self.fname) as stdfp:
+            self.assertEqual(stdfp.read(), "dropped twice")
+
+    def test_failed_close_drops_its_buffer(self):
+        rfd, wfd = os.pipe()
+        os.close(rfd)
+        fp = greenhouse.File.fromfd(wfd, 'w', 1024)
+        fp.AUTO_FLUSH = False
+        fp.write("secret leftover")
+        self.assertRaises(EnvironmentError, fp.close)
+
+        # something else gets the descriptor number
+        fd = os.open(self.fname, os.O_WRONLY | os.O_CREAT)
+        try:
+            os.dup2(fd, wfd)
+            del fp
+            gc.collect()
+        finally:
+            os.close(fd)
+            os.close(wfd)
+
+        with open(self.fname) as stdfp:
+            self.assertEqual(stdfp.read(), "")
+
+    def test_auto_flush_coalesces(self):
+        writes = []
+        real_write = greenhouse.io.files._write
+
+        def counting_write(fd, data):
+            writes.append(len(data))
+            return real_write(fd, data)
+
+        greenhouse.io.files._write = counting_write
+        try:
+            fp = greenhouse.File(self.fname, 'w', 1024)
+            for i in xrange(20):
+                fp.write("write %d\n" % i)
+            self.assertEqual(writes, [])
+
+            greenhouse.pause()
+            self.assertEqual(len(writes), 1)
+            with open(self.fname) as stdfp:
+                self.assertEqual(stdfp.read(),
+                        "".join("write %d\n" % i for i in xrange(20)))
+            fp.close()
+        finally:
+            greenhouse.io.files._write = real_write
+
+    def test_long_line(self):
+        line = "x" * 100000 + "\n"
+        with open(self.fname, 'w') as fp:
+            fp.write(line + "short\n")
+
+        with greenhouse.File(self.fname) as fp:
+            self.assertEqual(fp.readline(), line)
+            self.assertEqual(fp.readline(), "short\n")
+            self.assertEqual(fp.readline(), "")
+
+    def test_readline_limit_past_newline(self):
+        with open(self.fname, 'w') as fp:
+            fp.write("a\nbcdef\n")
+
+        with greenhouse.File(self.fname) as fp:
+            self.assertEqual(fp.readline(5), "a\n")
+            self.assertEqual(fp.readline(5), "bcdef")
+
+    def test_readuntil(self):
+        with open(self.fname, 'w') as fp:
+            fp.write("one;;two;;three")
+
+        with greenhouse.File(self.fname) as fp:
+            self.assertEqual(fp.readuntil(";;"), "one;;")
+            self.assertEqual(fp.readuntil(";;"), "two;;")
+            try:
+                fp.readuntil(";;")
+            except greenhouse.IncompleteRead, exc:
+                self.assertEqual(exc.partial, "three")
+                self.assertEqual(exc.expected, None)
+            else:
+                self.fail("readuntil() didn't raise IncompleteRead")
+
+    def test_readexactly(self):
+        with open(self.fname, 'w') as fp:
+            fp.write("this is a test")
+
+        with greenhouse.File(self.fname) as fp:
+            self.assertEqual(fp.readexactly(4), "this")
+            self.assertRaises(greenhouse.IncompleteRead, fp.readexactly, 20)
+
+    def test_peek(self):
+        with open(self.fname, 'w') as fp:
+            fp.write("this is a test")
+
+        with greenhouse.File(self.fname) as fp:
+            self.assertEqual(fp.peek(4), "this")
+            self.assertEqual(fp.read(7), "this is")
+            self.assertEqual(fp.peek(100), " a test")
+            self.assertEqual(fp.read(), " a test")
+
+    def test_readinto(self):
+        data = "".join(chr(i % 251) for i in xrange(50000))
+        with open(self.fname, 'w') as fp:
+            fp.write(data)
+
+        with greenhouse.File(self.fname) as fp:
+            self.assertEqual(fp.read(10), data[:10])
+            buf = bytearray(30000)
+            self.assertEqual(fp.readinto(buf), 30000)
+            self.assertEqual(str(buf), data[10:30010])
+            self.assertEqual(fp.readinto(buf), 19990)
+            self.assertEqual(str(buf[:19990]), data[30010:])
+
+    def test_tell_after_buffered_read(self):
+        with open(self.fname, 'w') as fp:
+            fp.write("this\nis\na\ntest\n")
+
+        with greenhouse.File(self.fname) as fp:
+            fp.readline()
+            self.assertEqual(fp.tell(), 5)
+            fp.seek(3, os.SEEK_CUR)
+            self.assertEqual(fp.readline(), "a\n")
+
 if greenhouse.poller.Epoll._POLLER:
     class FileWithEpollTestCase(FilePollerMixin, StateClearingTestCase):
         POLLER = greenhouse.poller.Epoll
@@ -463,6 +1047,10 @@ if greenhouse.poller.KQueue._POLLER:
     class FileWithKQueueTestCase(FilePollerMixin, StateClearingTestCase):
         POLLER = greenhouse.poller.KQueue
 
+if greenhouse.poller.IoUringPoller._POLLER:
+    class FileWithIoUringTestCase(FilePollerMixin, StateClearingTestCase):
+        POLLER = greenhouse.poller.IoUringPoller
+
 class FileWithSelectTestCase(FilePollerMixin, StateClearingTestCase):
     POLLER = greenhouse.poller.Select
 
@@ -511,6 +1099,10 @@ if greenhouse.poller.KQueue._POLLER:
     class PipeWithKQueueTestCase(PipePollerMixin, StateClearingTestCase):
         POLLER = greenhouse.poller.KQueue
 
+if greenhouse.poller.IoUringPoller._POLLER:
+    class PipeWithIoUringTestCase(PipePollerMixin, StateClearingTestCase):
+        POLLER = greenhouse.poller.IoUringPoller
+
 class PipeWithSelectTestCase(PipePollerMixin, StateClearingTestCase):
     POLLER = greenhouse.poller.Select
 
@@ -552,6 +1144,15 @@ class WaitFDsMixin(object):
                     timeout=TESTING_TIMEOUT)
             self.assertEqual(evs, [(server.fileno(), 1)])
 
+    def test_deadline(self):
+        reader, writer = greenhouse.pipe()
+        with greenhouse.deadline(TESTING_TIMEOUT):
+            self.assertEqual(
+                    greenhouse.wait_fds([(reader.fileno(), 1)]), [])
+            writer.write("x")
+            self.assertEqual(greenhouse.wait_fds([(reader.fileno(), 1)]),
+                    [(reader.fileno(), 1)])
+
 
 if greenhouse.poller.Epoll._POLLER:
     class WaitFDsWithEpoll(WaitFDsMixin, StateClearingTestCase):
@@ -565,6 +1166,10 @@ if greenhouse.poller.KQueue._POLLER:
     class WaitFDsWithKQueue(WaitFDsMixin, StateClearingTestCase):
         POLLER = greenhouse.poller.KQueue
 
+if greenhouse.poller.IoUringPoller._POLLER:
+    class WaitFDsWithIoUring(WaitFDsMixin, StateClearingTestCase):
+        POLLER = greenhouse.poller.IoUringPoller
+
 class WaitFDsWithSelect(WaitFDsMixin, StateClearingTestCase):
     POLLER = greenhouse.poller.Select
 
@@ -1,5 +1,6 @@
 from __future__ import with_statement
 
+import os
 import select
 import unittest
 
@@ -66,6 +67,34 @@ class PollerMixin(object):
 
         self.assertEquals(poller._registry.items(), items)
 
+    def test_refcounted_masks(self):
+        fd, wfd = os.pipe()
+        poller = greenhouse.scheduler.state.poller
+
+        reader1 = poller.register(fd, poller.INMASK)
+        reader2 = poller.register(fd, poller.INMASK)
+        writer = poller.register(fd, poller.OUTMASK)
+        self.assertEqual(poller._registry[fd],
+                {poller.INMASK: 2, poller.OUTMASK: 1})
+
+        poller.unregister(fd, reader1)
+        self.assertEqual(poller._registry[fd],
+                {poller.INMASK: 1, poller.OUTMASK: 1})
+
+        poller.unregister(fd, writer)
+        self.assertEqual(poller._registry[fd], {poller.INMASK: 1})
+
+        # unknown counters, repeats and mismatched fds are all noops
+        poller.unregister(fd, writer)
+        poller.unregister(fd + 1, reader2)
+        poller.unregister(fd, -1)
+        self.assertEqual(poller._registry[fd], {poller.INMASK: 1})
+
+        poller.unregister(fd, reader2)
+        assert fd not in poller._registry
+        os.close(fd)
+        os.close(wfd)
+
     def test_poller_registration_rollback(self):
         with self.socketpair() as (client, handler):
             r = [False]
@@ -90,6 +119,30 @@ if greenhouse.poller.Epoll._POLLER:
     class EpollerTestCase(PollerMixin, StateClearingTestCase):
         POLLER = greenhouse.poller.Epoll
 
+        def test_edge_triggered_only_when_all_are(self):
+            fd, wfd = os.pipe()
+            try:
+                poller = greenhouse.scheduler.state.poller
+                edge = poller.register(fd, poller.INMASK | poller.EDGEMASK)
+
+                os.write(wfd, "howdy")
+                assert poller.poll(TESTING_TIMEOUT) == [(fd, poller.INMASK)]
+                assert not poller.poll(0)
+
+                # a level-triggered registration sees the unread data again
+                level = poller.register(fd, poller.INMASK)
+                assert poller.poll(0) == [(fd, poller.INMASK)]
+                assert poller.poll(0) == [(fd, poller.INMASK)]
+
+                poller.unregister(fd, level)
+                poller.poll(0)
+                assert not poller.poll(0)
+                poller.unregister(fd, edge)
+                assert fd not in poller._registry
+            finally:
+                os.close(fd)
+                os.close(wfd)
+
 if greenhouse.poller.Poll._POLLER:
     class PollerTestCase(PollerMixin, StateClearingTestCase):
         POLLER = greenhouse.poller.Poll
@@ -98,6 +151,48 @@ if greenhouse.poller.KQueue._POLLER:
     class KQueueTestCase(PollerMixin, StateClearingTestCase):
         POLLER = greenhouse.poller.KQueue
 
+if greenhouse.poller.IoUringPoller._POLLER:
+    class IoUringTestCase(PollerMixin, StateClearingTestCase):
+        POLLER = greenhouse.poller.IoUringPoller
+
+        def test_registration_changes_are_batched(self):
+            fd, wfd = os.pipe()
+            try:
+                poller = greenhouse.scheduler.state.poller
+                queued = poller._unsubmitted
+                reader = poller.register(fd, poller.INMASK)
+                writer = poller.register(wfd, poller.OUTMASK)
+                assert poller._unsubmitted == queued + 2
+
+                # both go in with the one poll, and fire from then on
+                self.assertEqual(poller.poll(TESTING_TIMEOUT),
+                        [(wfd, poller.OUTMASK)])
+                assert not poller._unsubmitted
+                self.assertEqual(poller.poll(0), [])
+
+                poller.unregister(wfd, writer)
+                os.write(wfd, "howdy")
+                self.assertEqual(poller.poll(TESTING_TIMEOUT),
+                        [(fd, poller.INMASK)])
+                poller.unregister(fd, reader)
+                assert fd not in poller._tokens
+            finally:
+                os.close(fd)
+                os.close(wfd)
+
+        def test_closed_descriptors_are_released(self):
+            poller = greenhouse.scheduler.state.poller
+            with self.socketpair() as (client, handler):
+                for i in xrange(5):
+                    counter = poller.register(client, poller.OUTMASK)
+                    poller.poll(TESTING_TIMEOUT)
+                    poller.unregister(client, counter)
+                client.close()
+
+                # the poll requests mustn't keep the socket open
+                handler.settimeout(TESTING_TIMEOUT)
+                self.assertEqual(handler.recv(10), "")
+
 class SelectTestCase(PollerMixin, StateClearingTestCase):
     POLLER = greenhouse.poller.Select
 
@@ -315,5 +315,28 @@ class OrderedPoolTestCase(PoolTestCase):
         pool.close()
 
 
+class HandoffPool(greenhouse.Pool):
+    def __init__(self, func, size=10):
+        super(HandoffPool, self).__init__(func, size, handoff=True)
+
+
+class HandoffPoolTestCase(PoolTestCase):
+    POOL = HandoffPool
+
+    def test_queues_hand_off(self):
+        pool = self.POOL(lambda x: x)
+        assert pool.inq._handoff and pool.outq._handoff
+
+    def test_put_switches_to_an_idle_worker(self):
+        l = []
+        pool = self.POOL(l.append, 1)
+        pool.start()
+        greenhouse.pause()
+
+        pool.put(1)
+        self.assertEqual(l, [1])
+        pool.close()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -3,6 +3,7 @@ from __future__ import with_statement
 import gc
 import os
 import socket
+import thread
 import time
 import unittest
 
@@ -529,6 +530,57 @@ class ScheduleMixin(object):
         self.assertEqual(m[0], 1)
         self.assertEqual(l[0], 5)
 
+    def test_back_to_fast_path_without_hooks(self):
+        @greenhouse.global_hook
+        def hook(coming_from, going_to):
+            pass
+
+        assert greenhouse.scheduler.state.instrumented
+        greenhouse.pause()
+        assert greenhouse.scheduler.state.instrumented
+
+        greenhouse.remove_global_hook(hook)
+        greenhouse.pause()
+        assert not greenhouse.scheduler.state.instrumented
+
+    def test_failing_hook_removed_others_kept(self):
+        l = []
+
+        @greenhouse.global_hook
+        def hook1(coming_from, going_to):
+            l.append(1)
+
+        @greenhouse.global_hook
+        def hook2(coming_from, going_to):
+            raise Exception("bad hook")
+
+        @greenhouse.global_hook
+        def hook3(coming_from, going_to):
+            l.append(3)
+
+        greenhouse.pause()
+        self.assertEqual(len(greenhouse.scheduler.state.global_hooks), 2)
+        self.assertEqual(l, [1, 3])
+
+    def test_timed_exception_from_fast_path(self):
+        l = []
+
+        @greenhouse.schedule
+        @greenhouse.greenlet
+        def g():
+            try:
+                greenhouse.pause_for(TESTING_TIMEOUT * 2)
+            except self.CustomError:
+                l.append(1)
+
+        greenhouse.pause()
+        assert not greenhouse.scheduler.state.instrumented
+        greenhouse.schedule_exception_in(TESTING_TIMEOUT, self.CustomError(), g)
+
+        greenhouse.pause_for(TESTING_TIMEOUT * 3)
+        self.assertEqual(l, [1])
+        assert not greenhouse.scheduler.state.instrumented
+
 
 class ScheduleTestsWithSelect(ScheduleMixin, StateClearingTestCase):
     POLLER = greenhouse.poller.Select
@@ -595,5 +647,1072 @@ else:
             POLLER = greenhouse.poller.KQueue
 
 
+class TimingWheelScheduleTest(StateClearingTestCase):
+    def setUp(self):
+        super(TimingWheelScheduleTest, self).setUp()
+        self._old_mgr = greenhouse.scheduler.state.timed_paused
+        greenhouse.scheduler.TimingWheelTimeoutManager.install()
+
+    def tearDown(self):
+        type(self._old_mgr).install()
+        super(TimingWheelScheduleTest, self).tearDown()
+
+class TimingWheelScheduleTestsWithSelect(ScheduleMixin, TimingWheelScheduleTest):
+    POLLER = greenhouse.poller.Select
+
+if greenhouse.poller.Poll._POLLER:
+    class TimingWheelScheduleTestsWithPoll(
+            ScheduleMixin, TimingWheelScheduleTest):
+        POLLER = greenhouse.poller.Poll
+
+if greenhouse.poller.Epoll._POLLER:
+    class TimingWheelScheduleTestsWithEpoll(
+            ScheduleMixin, TimingWheelScheduleTest):
+        POLLER = greenhouse.poller.Epoll
+
+if greenhouse.poller.KQueue._POLLER:
+    class TimingWheelScheduleTestsWithKQueue(
+            ScheduleMixin, TimingWheelScheduleTest):
+        POLLER = greenhouse.poller.KQueue
+
+
+class TimingWheelTestCase(StateClearingTestCase):
+    def manager(self):
+        # tiny wheels so that cascades and overflow get exercised
+        return greenhouse.scheduler.TimingWheelTimeoutManager(
+                resolution=0.001, slot_bits=2, levels=2)
+
+    def insert(self, mgr, at, name):
+        timer = greenhouse.scheduler.TimerHandle(at, name)
+        mgr.insert(at, timer)
+        return timer
+
+    def check(self, mgr):
+        # the loop clock only moves in the poller, so move it by hand
+        greenhouse.scheduler.state.clock = greenhouse.compat.monotonic()
+        mgr.check()
+
+    def fired(self):
+        fired = [t.target for t in greenhouse.scheduler.state.to_run]
+        greenhouse.scheduler.state.to_run.clear()
+        return fired
+
+    def test_fires_in_order_across_levels(self):
+        mgr = self.manager()
+        now = greenhouse.scheduler.now()
+        offsets = [0.3, 0.002, 0.05, -1, 0.012, 0.0005]
+        timers = [self.insert(mgr, now + offset, i)
+                  for i, offset in enumerate(offsets)]
+        self.assertEqual(len(mgr), len(offsets))
+        self.assertEqual(mgr.first(), (now - 1, timers[3]))
+
+        mgr.check()
+        self.assertEqual(self.fired(), [3])
+
+        time.sleep(0.02)
+        self.check(mgr)
+        self.assertEqual(self.fired(), [5, 1, 4])
+        self.assertEqual(mgr.first(), (now + 0.05, timers[2]))
+
+        time.sleep(0.3)
+        self.check(mgr)
+        self.assertEqual(self.fired(), [2, 0])
+        assert not mgr
+        self.assertEqual(mgr.first(), None)
+
+    def test_never_fires_early(self):
+        mgr = self.manager()
+        at = greenhouse.scheduler.now() + 0.0155
+        self.insert(mgr, at, 1)
+        while not greenhouse.scheduler.state.to_run:
+            self.check(mgr)
+        assert greenhouse.scheduler.now() >= at
+        self.assertEqual(self.fired(), [1])
+
+    def test_remove(self):
+        mgr = self.manager()
+        now = greenhouse.scheduler.now()
+        first = self.insert(mgr, now + 0.001, 1)
+        second = self.insert(mgr, now + 0.1, 2)
+        self.assertEqual(mgr.first(), (now + 0.001, first))
+
+        assert mgr.remove(now + 0.001, first)
+        assert not mgr.remove(now + 0.001, first)
+        self.assertEqual(mgr.first(), (now + 0.1, second))
+        self.assertEqual(len(mgr), 1)
+        self.assertEqual(mgr.dump(), [(now + 0.1, second)])
+
+        time.sleep(0.11)
+        self.check(mgr)
+        self.assertEqual(self.fired(), [2])
+
+    def test_install_keeps_pending_timers(self):
+        old = greenhouse.scheduler.state.timed_paused
+        try:
+            timer = greenhouse.schedule_in(
+                    TESTING_TIMEOUT, lambda: None, handle=True)
+            greenhouse.scheduler.TimingWheelTimeoutManager.install()
+            mgr = greenhouse.scheduler.state.timed_paused
+            self.assertEqual(len(mgr), 1)
+            self.assertEqual(mgr.first(), (timer.waketime, timer))
+        finally:
+            type(old).install()
+
+
+class TimerHandleTestCase(StateClearingTestCase):
+    def test_returns_target_by_default(self):
+        def f():
+            pass
+        self.assertEqual(greenhouse.schedule_in(TESTING_TIMEOUT, f), f)
+
+    def test_cancel_pending(self):
+        l = []
+        timer = greenhouse.schedule_in(
+                TESTING_TIMEOUT, l.append, args=(1,), handle=True)
+        assert timer.active
+
+        assert timer.cancel()
+        assert not timer.active
+        assert not timer.cancel()
+
+        greenhouse.pause_for(TESTING_TIMEOUT * 2)
+        self.assertEqual(l, [])
+
+    def test_cancel_after_firing_before_running(self):
+        l = []
+        timer = greenhouse.schedule_in(-1, l.append, args=(1,), handle=True)
+
+        # fire the timer, but leave it in the run queue
+        greenhouse.scheduler.state.timed_paused.check()
+        self.assertEqual(list(greenhouse.scheduler.state.to_run), [timer])
+        assert timer.active
+
+        assert timer.cancel()
+        greenhouse.pause()
+        self.assertEqual(l, [])
+
+    def test_inactive_once_run(self):
+        l = []
+        timer = greenhouse.schedule_in(0, l.append, args=(1,), handle=True)
+        greenhouse.pause()
+        greenhouse.pause()
+        self.assertEqual(l, [1])
+        assert not timer.active
+        assert not timer.cancel()
+
+    def test_cancelled_exception(self):
+        l = []
+
+        @greenhouse.schedule
+        @greenhouse.greenlet
+        def glet():
+            try:
+                greenhouse.pause_for(TESTING_TIMEOUT * 2)
+            except Exception, exc:
+                l.append(exc)
+
+        greenhouse.pause()
+        timer = greenhouse.schedule_exception_in(
+                TESTING_TIMEOUT, Exception(), glet, handle=True)
+        assert timer.cancel()
+
+        greenhouse.pause_for(TESTING_TIMEOUT * 3)
+        self.assertEqual(l, [])
+        assert glet.dead
+
+    def test_cancel_never_scans_the_run_queue(self):
+        current = greenhouse.compat.getcurrent()
+        timer = greenhouse.schedule_in(-1, current, handle=True)
+        greenhouse.scheduler.state.timed_paused.check()
+        greenhouse.scheduler.state.to_run.extend([current] * 1000)
+
+        timer.cancel()
+        self.assertEqual(len(greenhouse.scheduler.state.to_run), 1001)
+        greenhouse.scheduler.state.to_run.clear()
+
+    def test_tombstones_get_compacted(self):
+        mgr = greenhouse.scheduler.BisectingTimeoutManager()
+        old = greenhouse.scheduler.state.timed_paused
+        greenhouse.scheduler.state.timed_paused = mgr
+        try:
+            timers = [greenhouse.schedule_in(60, lambda: None, handle=True)
+                      for i in xrange(200)]
+            for timer in timers[:150]:
+                timer.cancel()
+            self.assertEqual(len(mgr), 50 + mgr._tombstones)
+            assert mgr._tombstones <= 50
+        finally:
+            greenhouse.scheduler.state.timed_paused = old
+
+
+class TimerSlackTestCase(StateClearingTestCase):
+    def setUp(self):
+        super(TimerSlackTestCase, self).setUp()
+        self.slack = greenhouse.scheduler.TIMER_SLACK
+
+    def tearDown(self):
+        greenhouse.scheduler.TIMER_SLACK = self.slack
+        super(TimerSlackTestCase, self).tearDown()
+
+    def test_rounds_up_to_the_slack(self):
+        slack = TESTING_TIMEOUT
+        before = greenhouse.scheduler._refresh_clock()
+        timers = [greenhouse.schedule_in(TESTING_TIMEOUT + i * slack / 10,
+                lambda: None, handle=True, slack=slack) for i in xrange(5)]
+        after = greenhouse.scheduler._refresh_clock()
+
+        waketimes = set(timer.waketime for timer in timers)
+        assert len(waketimes) <= 2, waketimes
+        for timer, i in zip(timers, xrange(5)):
+            assert timer.waketime >= before + TESTING_TIMEOUT + i * slack / 10
+            assert timer.waketime < after + TESTING_TIMEOUT + i * slack / 10 \
+                    + slack
+
+        for timer in timers:
+            timer.cancel()
+
+    def test_never_fires_early(self):
+        l = []
+        start = time.time()
+        greenhouse.schedule_in(TESTING_TIMEOUT, lambda: l.append(time.time()),
+                slack=TESTING_TIMEOUT)
+        greenhouse.pause_for(TESTING_TIMEOUT * 3)
+        assert l and l[0] - start >= TESTING_TIMEOUT * 0.95
+
+    def test_global_default(self):
+        greenhouse.scheduler.TIMER_SLACK = 0.5
+        timer = greenhouse.schedule_in(0.1, lambda: None, handle=True)
+        self.assertEqual(timer.waketime % 0.5, 0)
+
+        # an explicit slack of 0 switches it off
+        exact = greenhouse.schedule_in(0.1, lambda: None, handle=True, slack=0)
+        assert exact.waketime < timer.waketime
+
+        timer.cancel()
+        exact.cancel()
+
+    def test_event_wait(self):
+        ev = greenhouse.Event()
+        start = time.time()
+        assert ev.wait(TESTING_TIMEOUT, slack=TESTING_TIMEOUT)
+        elapsed = time.time() - start
+        assert TESTING_TIMEOUT * 0.95 <= elapsed < TESTING_TIMEOUT * 3
+
+
+class CallbackTestCase(StateClearingTestCase):
+    def test_call_soon_runs_in_the_mainloop(self):
+        l = []
+        before = greenhouse.stats()
+        greenhouse.call_soon(lambda x: l.append((x, greenhouse.getcurrent())),
+                1)
+        assert not l
+
+        greenhouse.pause()
+        self.assertEqual(l, [(1, greenhouse.scheduler.state.mainloop)])
+
+        after = greenhouse.stats()
+        self.assertEqual(after["spawned"], before["spawned"])
+        self.assertEqual(after["callbacks"] - before["callbacks"], 1)
+
+    def test_call_soon_cancel(self):
+        l = []
+        handle = greenhouse.call_soon(l.append, 1)
+        assert handle.active
+        assert handle.cancel()
+        assert not handle.active
+
+        greenhouse.pause()
+        self.assertEqual(l, [])
+
+    def test_call_later(self):
+        l = []
+        greenhouse.call_later(TESTING_TIMEOUT, l.append, 1)
+        greenhouse.pause()
+        self.assertEqual(l, [])
+
+        greenhouse.pause_for(TESTING_TIMEOUT * 2)
+        self.assertEqual(l, [1])
+
+    def test_call_later_cancel(self):
+        l = []
+        handle = greenhouse.call_later(TESTING_TIMEOUT, l.append, 1)
+        assert handle.cancel()
+        assert not handle.cancel()
+
+        greenhouse.pause_for(TESTING_TIMEOUT * 2)
+        self.assertEqual(l, [])
+
+    def test_exceptions_go_to_handlers(self):
+        l = []
+        handler = lambda klass, exc, tb: l.append(klass)
+        greenhouse.global_exception_handler(handler)
+        try:
+            greenhouse.call_soon(dict.__getitem__, {}, "x")
+            greenhouse.call_soon(l.append, 1)
+            greenhouse.pause()
+        finally:
+            greenhouse.remove_global_exception_handler(handler)
+
+        self.assertEqual(l, [KeyError, 1])
+
+
+class RecurringTimerTestCase(StateClearingTestCase):
+    def test_runs_until_maxtimes(self):
+        l = []
+        timer = greenhouse.RecurringTimer(TESTING_TIMEOUT / 5, l.append,
+                args=(1,), maxtimes=3)
+        assert timer.active
+
+        greenhouse.pause_for(TESTING_TIMEOUT * 2)
+        self.assertEqual(l, [1, 1, 1])
+        self.assertEqual(timer.count, 3)
+        assert not timer.active
+        assert not timer.cancel()
+
+    def test_cancel(self):
+        l = []
+        timer = greenhouse.RecurringTimer(TESTING_TIMEOUT / 5, l.append,
+                args=(1,))
+        greenhouse.pause_for(TESTING_TIMEOUT / 2)
+        assert timer.cancel()
+        count = len(l)
+        assert count
+
+        greenhouse.pause_for(TESTING_TIMEOUT)
+        self.assertEqual(len(l), count)
+
+    def test_cancel_from_the_callback(self):
+        timer = greenhouse.RecurringTimer(TESTING_TIMEOUT / 5,
+                lambda: timer.cancel())
+        greenhouse.pause_for(TESTING_TIMEOUT)
+        self.assertEqual(timer.count, 1)
+        assert not timer.active
+
+    def test_no_drift(self):
+        interval = TESTING_TIMEOUT / 5
+        timer = greenhouse.RecurringTimer(interval, lambda: None, maxtimes=4)
+        start = timer._handle.waketime
+        greenhouse.pause_for(TESTING_TIMEOUT * 2)
+
+        # due times stay on the original schedule however late calls were
+        self.assertEqual(timer.count, 4)
+        self.assertAlmostEqual(timer._handle.waketime, start + 3 * interval)
+
+    def test_skips_missed_calls(self):
+        interval = TESTING_TIMEOUT / 5
+        timer = greenhouse.RecurringTimer(interval, lambda: None)
+        greenhouse.pause_for(interval * 1.5)
+        self.assertEqual(timer.count, 1)
+
+        # hold up the whole loop for several intervals
+        greenhouse.scheduler._sleep(interval * 5)
+        greenhouse.pause()
+        greenhouse.pause()
+        self.assertEqual(timer.count, 2)
+        assert timer.missed >= 3
+        timer.cancel()
+
+    def test_catch_up(self):
+        interval = TESTING_TIMEOUT / 5
+        timer = greenhouse.RecurringTimer(interval, lambda: None,
+                catch_up=True)
+        greenhouse.pause_for(interval * 1.5)
+        self.assertEqual(timer.count, 1)
+
+        greenhouse.scheduler._sleep(interval * 5)
+        for i in xrange(10):
+            greenhouse.pause()
+        assert timer.count >= 5
+        self.assertEqual(timer.missed, 0)
+        timer.cancel()
+
+    def test_exceptions_dont_stop_it(self):
+        timer = greenhouse.RecurringTimer(TESTING_TIMEOUT / 5,
+                dict.__getitem__, args=({}, "x"), maxtimes=2)
+        greenhouse.pause_for(TESTING_TIMEOUT)
+        self.assertEqual(timer.count, 2)
+
+
+class DeadlineTestCase(StateClearingTestCase):
+    def test_bounds_event_wait(self):
+        ev = greenhouse.Event()
+        start = time.time()
+        with greenhouse.deadline(TESTING_TIMEOUT) as scope:
+            assert not scope.expired
+            assert ev.wait()
+            assert scope.expired
+        assert TESTING_TIMEOUT * 0.9 <= time.time() - start < TESTING_TIMEOUT * 3
+
+    def test_bounds_queue_get(self):
+        q = greenhouse.Queue()
+        with greenhouse.deadline(TESTING_TIMEOUT):
+            self.assertRaises(greenhouse.util.Empty, q.get)
+
+    def test_spans_many_calls(self):
+        ev = greenhouse.Event()
+        start = time.time()
+        with greenhouse.deadline(TESTING_TIMEOUT * 2):
+            greenhouse.pause_for(TESTING_TIMEOUT * 1.5)
+            assert ev.wait()
+        assert time.time() - start < TESTING_TIMEOUT * 3
+
+    def test_one_timer_for_the_scope(self):
+        ev = greenhouse.Event()
+        timers = greenhouse.stats()["timers"]
+
+        @greenhouse.schedule
+        def setter():
+            for i in xrange(3):
+                greenhouse.pause()
+                ev.set()
+                ev.clear()
+
+        with greenhouse.deadline(TESTING_TIMEOUT * 10):
+            self.assertEqual(greenhouse.stats()["timers"], timers + 1)
+            for i in xrange(3):
+                assert not ev.wait()
+                self.assertEqual(greenhouse.stats()["timers"], timers + 1)
+        self.assertEqual(greenhouse.stats()["timers"], timers)
+        assert not greenhouse.scheduler.state.deadlines
+
+    def test_expired_fails_without_blocking(self):
+        ev = greenhouse.Event()
+        with greenhouse.deadline(TESTING_TIMEOUT) as scope:
+            assert ev.wait()
+            start = time.time()
+            assert ev.wait()
+            assert ev.wait(TESTING_TIMEOUT * 10)
+        assert time.time() - start < TESTING_TIMEOUT / 2
+
+    def test_sooner_timeout_still_applies(self):
+        ev = greenhouse.Event()
+        with greenhouse.deadline(TESTING_TIMEOUT * 10) as scope:
+            assert ev.wait(TESTING_TIMEOUT)
+            assert not scope.expired
+
+    def test_deadline_after_running_without_yielding(self):
+        ev = greenhouse.Event()
+        with greenhouse.deadline(TESTING_TIMEOUT * 3) as scope:
+            # the loop clock stands still while this runs
+            time.sleep(TESTING_TIMEOUT * 2)
+            start = time.time()
+            assert ev.wait(TESTING_TIMEOUT * 2.5)
+            assert scope.expired
+        assert time.time() - start < TESTING_TIMEOUT * 2
+
+    def test_nested_takes_the_earliest(self):
+        ev = greenhouse.Event()
+        timers = greenhouse.stats()["timers"]
+        with greenhouse.deadline(TESTING_TIMEOUT) as outer:
+            with greenhouse.deadline(TESTING_TIMEOUT * 10) as inner:
+                # nothing to add to the outer one's timer
+                self.assertEqual(greenhouse.stats()["timers"], timers + 1)
+                self.assertEqual(inner.when, outer.when)
+                assert ev.wait()
+                assert inner.expired
+
+        with greenhouse.deadline(TESTING_TIMEOUT * 10) as outer:
+            with greenhouse.deadline(TESTING_TIMEOUT) as inner:
+                assert ev.wait()
+            assert not outer.expired
+            assert ev.wait(TESTING_TIMEOUT / 5)
+            assert not outer.expired
+
+    def test_only_the_greenlet_in_the_scope(self):
+        ev = greenhouse.Event()
+        l = []
+
+        @greenhouse.schedule
+        def f():
+            l.append(ev.wait())
+
+        with greenhouse.deadline(TESTING_TIMEOUT):
+            assert ev.wait()
+        assert not l
+        ev.set()
+        greenhouse.pause()
+        self.assertEqual(l, [False])
+
+    def test_woken_and_expired_in_the_same_pass(self):
+        ev = greenhouse.Event()
+        with greenhouse.deadline(TESTING_TIMEOUT) as scope:
+            @greenhouse.schedule
+            def f():
+                # run right after the deadline's timer in the same pass
+                greenhouse.scheduler._sleep(TESTING_TIMEOUT * 2)
+                greenhouse.pause()
+                ev.set()
+
+            # woken by both, but the set() came first so the wait succeeded
+            assert not ev.wait()
+            assert scope.expired
+        greenhouse.pause()
+        greenhouse.pause()
+
+
+class PriorityTestCase(StateClearingTestCase):
+    def test_high_runs_first(self):
+        l = []
+
+        @greenhouse.schedule
+        def f1():
+            l.append(1)
+
+        @greenhouse.schedule(priority=greenhouse.PRIORITY_HIGH)
+        def f2():
+            l.append(2)
+
+        greenhouse.pause()
+        self.assertEqual(l, [2, 1])
+
+    def test_priority_sticks(self):
+        l = []
+
+        @greenhouse.schedule
+        def f1():
+            for i in xrange(3):
+                l.append(1)
+                greenhouse.pause()
+
+        @greenhouse.schedule(priority=greenhouse.PRIORITY_HIGH)
+        def f2():
+            for i in xrange(3):
+                greenhouse.pause()
+                l.append(2)
+
+        for i in xrange(4):
+            greenhouse.pause()
+        self.assertEqual(l, [1, 2, 1, 2, 1, 2])
+
+    def test_weighted_shares(self):
+        l = []
+        weights = greenhouse.scheduler.PRIORITY_WEIGHTS
+        batch = greenhouse.scheduler.PRIORITY_BATCH
+
+        for priority in (greenhouse.PRIORITY_LOW, greenhouse.PRIORITY_HIGH):
+            for i in xrange(weights[0] * batch * 2):
+                greenhouse.schedule(l.append, args=(priority,),
+                        priority=priority)
+
+        greenhouse.pause_for(TESTING_TIMEOUT)
+        first_pass = l[:(weights[0] + weights[2]) * batch]
+        self.assertEqual(first_pass.count(greenhouse.PRIORITY_HIGH),
+                weights[0] * batch)
+        self.assertEqual(first_pass.count(greenhouse.PRIORITY_LOW),
+                weights[2] * batch)
+
+    def test_idle_waits_for_nothing_else(self):
+        l = []
+
+        @greenhouse.schedule_idle
+        def f():
+            l.append("idle")
+
+        @greenhouse.schedule
+        def g():
+            for i in xrange(3):
+                l.append(i)
+                greenhouse.pause()
+
+        greenhouse.pause_for(TESTING_TIMEOUT)
+        self.assertEqual(l, [0, 1, 2, "idle"])
+
+    def test_bad_priority(self):
+        self.assertRaises(ValueError, greenhouse.schedule, lambda: None,
+                priority=17)
+
+
+class StatsTestCase(StateClearingTestCase):
+    def tearDown(self):
+        greenhouse.stop_lag_probe()
+        greenhouse.pause()
+        super(StatsTestCase, self).tearDown()
+
+    @unittest.skipUnless(greenhouse.scheduler.STATS, "stats are left out")
+    def test_switches_and_greenlets(self):
+        before = greenhouse.stats()
+
+        @greenhouse.schedule
+        def f():
+            greenhouse.pause()
+
+        greenhouse.pause()
+        greenhouse.pause()
+        greenhouse.pause()
+
+        after = greenhouse.stats()
+        self.assertEqual(after["spawned"] - before["spawned"], 1)
+        self.assertEqual(after["finished"] - before["finished"], 1)
+        assert after["switches"] - before["switches"] >= 5
+        assert after["polls"] - before["polls"] >= 3
+        assert after["poll_time"] >= before["poll_time"]
+
+    def test_gauges(self):
+        greenhouse.schedule(lambda: None)
+        timer = greenhouse.schedule_in(60, lambda: None, handle=True)
+        with self.socketpair() as (client, handler):
+            event = greenhouse.Event()
+
+            @greenhouse.schedule
+            def f():
+                client.recv(10)
+
+            greenhouse.pause()
+            result = greenhouse.stats()
+            assert result["fds"] >= 1
+            self.assertEqual(result["timers"], 1)
+
+            handler.sendall("hello")
+            greenhouse.pause()
+
+        timer.cancel()
+        self.assertEqual(greenhouse.stats()["timers"], 0)
+        self.assertEqual(greenhouse.stats()["run_queue"], 0)
+
+    def test_lag_probe(self):
+        before = sum(count for bound, count in
+                greenhouse.stats()["loop_lag"]["histogram"])
+
+        greenhouse.start_lag_probe(TESTING_TIMEOUT / 5)
+        greenhouse.pause_for(TESTING_TIMEOUT / 10)
+
+        # hold up the loop
+        time.sleep(TESTING_TIMEOUT)
+        greenhouse.pause_for(TESTING_TIMEOUT)
+        greenhouse.stop_lag_probe()
+
+        lag = greenhouse.stats()["loop_lag"]
+        after = sum(count for bound, count in lag["histogram"])
+        assert after > before
+        assert lag["max"] >= TESTING_TIMEOUT / 2
+
+
+class AccountingTestCase(StateClearingTestCase):
+    def setUp(self):
+        super(AccountingTestCase, self).setUp()
+        greenhouse.scheduler.state.tag_rows.clear()
+        greenhouse.start_accounting()
+
+    def tearDown(self):
+        greenhouse.stop_accounting()
+        super(AccountingTestCase, self).tearDown()
+
+    def test_cpu_by_tag(self):
+        def spin():
+            deadline = time.time() + TESTING_TIMEOUT
+            while time.time() < deadline:
+                pass
+
+        def rest():
+            greenhouse.pause_for(TESTING_TIMEOUT)
+
+        greenhouse.schedule(spin, tag="spinner")
+        greenhouse.schedule(rest, tag="rester")
+        greenhouse.schedule(rest, tag="rester")
+        greenhouse.pause_for(TESTING_TIMEOUT * 3)
+
+        rows = dict((row[0], row[1:]) for row in greenhouse.top())
+        assert rows["spinner"][0] >= TESTING_TIMEOUT / 2
+        assert rows["rester"][0] < TESTING_TIMEOUT / 2
+        self.assertEqual(rows["spinner"][1], 1)
+        self.assertEqual(rows["rester"][1], 4)
+
+        self.assertEqual(greenhouse.top(1)[0][0], "spinner")
+        self.assertEqual(greenhouse.top(1, "switches")[0][0], "rester")
+
+    def test_cpu_of_other_threads(self):
+        started = thread.allocate_lock()
+        started.acquire()
+
+        def spin():
+            started.release()
+            deadline = time.time() + TESTING_TIMEOUT * 2
+            while time.time() < deadline:
+                pass
+
+        def sleep():
+            # blocks the whole loop thread, while the other one runs
+            started.acquire()
+            time.sleep(TESTING_TIMEOUT)
+
+        thread.start_new_thread(spin, ())
+        greenhouse.schedule(sleep, tag="sleeper")
+        greenhouse.pause_for(TESTING_TIMEOUT * 3)
+
+        rows = dict((row[0], row[1:]) for row in greenhouse.top())
+        assert rows["sleeper"][0] < TESTING_TIMEOUT / 2, rows["sleeper"]
+
+    def test_untagged_greenlets(self):
+        @greenhouse.schedule
+        @greenhouse.greenlet
+        def glet():
+            for i in xrange(3):
+                greenhouse.pause()
+
+        for i in xrange(4):
+            greenhouse.pause()
+
+        rows = dict((row[0], row[1:]) for row in greenhouse.top())
+        self.assertEqual(rows[glet][1], 4)
+
+    def test_runnable_time(self):
+        @greenhouse.schedule(tag="waiter")
+        def f():
+            pass
+
+        @greenhouse.schedule(tag="hog")
+        def g():
+            time.sleep(TESTING_TIMEOUT)
+
+        # the waiter goes second, behind the hog
+        greenhouse.scheduler.state.paused.reverse()
+        greenhouse.pause()
+
+        rows = dict((row[0], row[1:]) for row in greenhouse.top())
+        assert rows["waiter"][2] >= TESTING_TIMEOUT
+
+
+class PollSkippingTestCase(StateClearingTestCase):
+    def setUp(self):
+        StateClearingTestCase.setUp(self)
+        scheduler = greenhouse.scheduler
+        self._settings = (scheduler.POLL_SKIP_PASSES,
+                scheduler.POLL_SKIP_INTERVAL)
+        scheduler.POLL_SKIP_PASSES = 8
+        scheduler.POLL_SKIP_INTERVAL = 60
+        scheduler.state.poll_skip = scheduler.state.poll_skipped = 0
+
+    def tearDown(self):
+        scheduler = greenhouse.scheduler
+        scheduler.POLL_SKIP_PASSES, scheduler.POLL_SKIP_INTERVAL = \
+                self._settings
+        scheduler.state.poll_skip = scheduler.state.poll_skipped = 0
+        StateClearingTestCase.tearDown(self)
+
+    def test_skips_grow_while_polls_are_empty(self):
+        before = greenhouse.stats()
+        for i in xrange(100):
+            greenhouse.pause()
+        after = greenhouse.stats()
+
+        self.assertEqual(greenhouse.scheduler.state.poll_skip, 8)
+        polls = after["polls"] - before["polls"]
+        skipped = after["polls_skipped"] - before["polls_skipped"]
+        self.assertEqual(polls + skipped, 100)
+        assert skipped > 80
+
+    def test_io_is_seen_within_the_bound(self):
+        with self.socketpair() as (client, handler):
+            got = []
+
+            @greenhouse.schedule
+            def f():
+                got.append(client.recv(10))
+
+            for i in xrange(50):
+                greenhouse.pause()
+            handler.sendall("hi")
+
+            passes = 0
+            while not got:
+                greenhouse.pause()
+                passes += 1
+            assert passes <= 9
+
+            # and having found some, it goes back to polling every pass
+            self.assertEqual(greenhouse.scheduler.state.poll_skip, 0)
+
+    def test_interval_bound(self):
+        greenhouse.scheduler.POLL_SKIP_PASSES = 1000
+        greenhouse.scheduler.POLL_SKIP_INTERVAL = TESTING_TIMEOUT / 5
+
+        with self.socketpair() as (client, handler):
+            got = []
+
+            @greenhouse.schedule
+            def f():
+                got.append(client.recv(10))
+
+            for i in xrange(50):
+                greenhouse.pause()
+            handler.sendall("hi")
+
+            start = time.time()
+            while not got:
+                greenhouse.pause()
+            assert time.time() - start < TESTING_TIMEOUT
+
+    def test_off_by_default(self):
+        greenhouse.scheduler.POLL_SKIP_PASSES = self._settings[0]
+        before = greenhouse.stats()
+        for i in xrange(20):
+            greenhouse.pause()
+        after = greenhouse.stats()
+        self.assertEqual(after["polls_skipped"], before["polls_skipped"])
+
+    def test_pauses_and_timers_still_run(self):
+        l = []
+
+        @greenhouse.schedule
+        def f():
+            for i in xrange(20):
+                l.append(i)
+                greenhouse.pause()
+
+        greenhouse.schedule_in(TESTING_TIMEOUT / 5, l.append, args=("t",))
+        while len(l) < 21:
+            greenhouse.pause()
+        assert "t" in l
+
+
+class HandoffTestCase(StateClearingTestCase):
+    def test_switches_and_reschedules(self):
+        l = []
+
+        @greenhouse.greenlet
+        def f():
+            greenhouse.scheduler.state.mainloop.switch()
+            l.append(1)
+
+        # get f blocked as though waiting on something
+        greenhouse.schedule(f)
+        greenhouse.pause()
+
+        # f runs first, and this greenlet once the mainloop gets back to it
+        assert greenhouse.handoff(f)
+        l.append(2)
+        self.assertEqual(l, [1, 2])
+
+    def test_declines_when_instrumented(self):
+        l = []
+
+        @greenhouse.greenlet
+        def f():
+            greenhouse.scheduler.state.mainloop.switch()
+            l.append(1)
+
+        greenhouse.schedule(f)
+        greenhouse.pause()
+
+        hook = lambda *args: None
+        greenhouse.global_hook(hook)
+        try:
+            assert not greenhouse.handoff(f)
+        finally:
+            greenhouse.remove_global_hook(hook)
+        assert not l
+
+        greenhouse.schedule(f)
+        greenhouse.pause()
+        self.assertEqual(l, [1])
+
+    def test_declines_for_other_priority_classes(self):
+        @greenhouse.greenlet
+        def f():
+            greenhouse.scheduler.state.mainloop.switch()
+
+        greenhouse.schedule(f, priority=greenhouse.PRIORITY_HIGH)
+        greenhouse.pause()
+        assert not greenhouse.handoff(f)
+
+        greenhouse.schedule(f, priority=greenhouse.PRIORITY_NORMAL)
+        greenhouse.pause()
+        assert f.dead
+
+
+class SpawnTestCase(StateClearingTestCase):
+    def setUp(self):
+        super(SpawnTestCase, self).setUp()
+        self.recycle = greenhouse.scheduler.RECYCLE_GREENLETS
+        del greenhouse.scheduler.state.idle_workers[:]
+
+    def tearDown(self):
+        greenhouse.scheduler.RECYCLE_GREENLETS = self.recycle
+        del greenhouse.scheduler.state.idle_workers[:]
+        super(SpawnTestCase, self).tearDown()
+
+    def test_greenlet_made_when_run(self):
+        l = []
+        greenhouse.schedule(l.append, args=(1,))
+
+        spawn, = greenhouse.scheduler.state.paused
+        assert not isinstance(spawn, greenhouse.compat.greenlet)
+        assert not l
+
+        greenhouse.pause()
+        self.assertEqual(l, [1])
+
+    def test_counts_spawned_and_finished(self):
+        before = greenhouse.stats()
+        for i in xrange(5):
+            greenhouse.schedule(lambda: None)
+        greenhouse.pause()
+        after = greenhouse.stats()
+
+        self.assertEqual(after["spawned"] - before["spawned"], 5)
+        self.assertEqual(after["finished"] - before["finished"], 5)
+
+    def test_recycles_greenlets(self):
+        greenhouse.scheduler.RECYCLE_GREENLETS = 4
+        glets = []
+        for i in xrange(3):
+            greenhouse.schedule(
+                    lambda: glets.append(greenhouse.compat.getcurrent()))
+            greenhouse.pause()
+
+        self.assertEqual(len(set(glets)), 1)
+        self.assertEqual(greenhouse.scheduler.state.idle_workers, glets[:1])
+
+    def test_recycled_greenlet_starts_clean(self):
+        greenhouse.scheduler.RECYCLE_GREENLETS = 4
+        l = []
+        handler = lambda *args: l.append(1)
+
+        def first():
+            greenhouse.local_exception_handler(handler)
+            raise ValueError()
+
+        greenhouse.schedule(first)
+        greenhouse.pause()
+        self.assertEqual(l, [1])
+
+        # the handler went with the first function
+        greenhouse.schedule(lambda: l.append(2))
+        greenhouse.pause()
+        self.assertEqual(l, [1, 2])
+        assert not greenhouse.scheduler.state.local_exception_handlers
+
+    def test_idle_pool_is_capped(self):
+        greenhouse.scheduler.RECYCLE_GREENLETS = 2
+        ev = greenhouse.Event()
+        for i in xrange(5):
+            greenhouse.schedule(ev.wait)
+        greenhouse.pause()
+        ev.set()
+        greenhouse.pause()
+
+        self.assertEqual(len(greenhouse.scheduler.state.idle_workers), 2)
+
+
+class ThreadsafeTestCase(StateClearingTestCase):
+    def in_thread(self, func, *args):
+        thread.start_new_thread(func, args)
+
+    def test_call_wakes_the_loop(self):
+        event = greenhouse.Event()
+
+        def other():
+            time.sleep(TESTING_TIMEOUT)
+            greenhouse.call_threadsafe(event.set)
+
+        start = time.time()
+        self.in_thread(other)
+        assert not event.wait(TESTING_TIMEOUT * 20)
+        assert time.time() - start < TESTING_TIMEOUT * 10
+
+    def test_submit_result(self):
+        results = []
+        done = greenhouse.Event()
+
+        def other():
+            future = greenhouse.submit_threadsafe(lambda x: x * 2, 21)
+            results.append(future.result(TESTING_TIMEOUT * 20))
+            greenhouse.call_threadsafe(done.set)
+
+        self.in_thread(other)
+        assert not done.wait(TESTING_TIMEOUT * 20)
+        self.assertEqual(results, [42])
+
+    def test_submit_exception(self):
+        future = greenhouse.submit_threadsafe(dict.__getitem__, {}, "x")
+        greenhouse.pause()
+        greenhouse.pause()
+        assert future.done()
+        assert isinstance(future.exception(), KeyError)
+        self.assertRaises(KeyError, future.result)
+
+    def test_cancel_and_timeout(self):
+        future = greenhouse.submit_threadsafe(lambda: 1)
+        assert future.cancel()
+        self.assertRaises(greenhouse.scheduler.CancelledError, future.result)
+
+        future = greenhouse.scheduler.Future()
+        self.assertRaises(greenhouse.scheduler.TimeoutError, future.result,
+                TESTING_TIMEOUT)
+
+    def test_done_callback(self):
+        l = []
+        future = greenhouse.submit_threadsafe(lambda: 3)
+        future.add_done_callback(lambda f: l.append(f.result()))
+        greenhouse.pause()
+        greenhouse.pause()
+        self.assertEqual(l, [3])
+
+        future.add_done_callback(lambda f: l.append(f.result()))
+        self.assertEqual(l, [3, 3])
+
+    def test_loop_thread(self):
+        greenhouse.start_loop_thread()
+        try:
+            future = greenhouse.submit_threadsafe(thread.get_ident)
+            self.assertNotEqual(future.result(TESTING_TIMEOUT * 20),
+                    thread.get_ident())
+        finally:
+            assert not greenhouse.stop_loop_thread(TESTING_TIMEOUT * 20)
+
+        self.assertEqual(greenhouse.scheduler.state.loop_thread,
+                thread.get_ident())
+        l = []
+        greenhouse.schedule(l.append, args=(1,))
+        greenhouse.pause()
+        self.assertEqual(l, [1])
+
+    def test_loop_thread_leaves_nothing_behind(self):
+        greenhouse.call_threadsafe(lambda: None)
+        self.assertRaises(RuntimeError, greenhouse.start_loop_thread)
+        greenhouse.pause_for(TESTING_TIMEOUT)
+
+        greenhouse.start_loop_thread()
+        try:
+            def park():
+                greenhouse.schedule(greenhouse.pause_for, args=(10,))
+                greenhouse.schedule(greenhouse.Event().wait)
+                greenhouse.schedule(lambda: None)
+            greenhouse.submit_threadsafe(park).result(TESTING_TIMEOUT * 20)
+        finally:
+            assert not greenhouse.stop_loop_thread(TESTING_TIMEOUT * 20)
+
+        # none of the background thread's greenlets can be run from here
+        state = greenhouse.scheduler.state
+        assert not (state.to_run or state.paused or state.timed_paused or
+                any(state.class_queues))
+        greenhouse.pause()
+
+    def test_reset_after_fork(self):
+        l = []
+
+        @greenhouse.schedule
+        @greenhouse.greenlet
+        def f():
+            with greenhouse.deadline(TESTING_TIMEOUT):
+                greenhouse.pause_for(TESTING_TIMEOUT * 2)
+            l.append(4)
+        greenhouse.pause()
+
+        greenhouse.call_threadsafe(l.append, 1)
+        greenhouse.schedule(l.append, args=(2,))
+        greenhouse.schedule_in(0, l.append, args=(3,))
+        greenhouse.schedule_exception(ValueError(), f)
+
+        # none of it is the child's to run
+        greenhouse.scheduler._reset_after_fork()
+        state = greenhouse.scheduler.state
+        assert not state.threadsafe_calls
+        assert not state.to_raise
+        assert not state.deadlines
+        greenhouse.pause_for(TESTING_TIMEOUT * 3)
+        self.assertEqual(l, [])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,150 @@
+import os
+import signal
+import thread
+import time
+import unittest
+
+import greenhouse
+from greenhouse import threadpool
+
+from test_base import TESTING_TIMEOUT, StateClearingTestCase
+
+
+class ThreadPoolTests(StateClearingTestCase):
+    def setUp(self):
+        super(ThreadPoolTests, self).setUp()
+        self.pool = threadpool.ThreadPool(2)
+
+    def tearDown(self):
+        self.pool.close()
+        super(ThreadPoolTests, self).tearDown()
+
+    def test_result(self):
+        self.assertEqual(self.pool.run(lambda x, y=0: x + y, 1, y=2), 3)
+        self.assertNotEqual(self.pool.run(thread.get_ident),
+                thread.get_ident())
+
+    def test_exception(self):
+        self.assertRaises(KeyError, self.pool.run, {}.__getitem__, "x")
+        self.assertEqual(self.pool.stats()['failed'], 1)
+
+    def test_loop_keeps_running(self):
+        l = []
+
+        @greenhouse.schedule
+        def f():
+            for i in xrange(5):
+                l.append(i)
+                greenhouse.pause()
+
+        self.pool.run(time.sleep, TESTING_TIMEOUT)
+        self.assertEqual(l, range(5))
+
+    def test_size_limit(self):
+        results = []
+        done = greenhouse.Event()
+
+        def sleeper():
+            results.append(self.pool.run(time.sleep, TESTING_TIMEOUT))
+            if len(results) == 4:
+                done.set()
+
+        start = time.time()
+        for i in xrange(4):
+            greenhouse.schedule(sleeper)
+        done.wait()
+
+        # 4 calls, 2 at a time
+        elapsed = time.time() - start
+        assert TESTING_TIMEOUT * 2 <= elapsed < TESTING_TIMEOUT * 3
+
+        stats = self.pool.stats()
+        self.assertEqual(stats['threads'], 2)
+        self.assertEqual(stats['completed'], 4)
+        self.assertEqual(stats['busy'], 0)
+        assert stats['queue_time'] >= TESTING_TIMEOUT * 2
+
+    def test_queue_limit(self):
+        pool = threadpool.ThreadPool(1, max_queue=1)
+        l = []
+
+        def sleeper(i):
+            pool.run(time.sleep, TESTING_TIMEOUT)
+            l.append(i)
+
+        for i in xrange(3):
+            greenhouse.schedule(sleeper, args=(i,))
+        greenhouse.pause()
+
+        # the third is held back in its greenlet, not queued for a thread
+        self.assertEqual(pool.stats()['submitted'], 2)
+
+        greenhouse.pause_for(TESTING_TIMEOUT * 4)
+        self.assertEqual(l, [0, 1, 2])
+        pool.close()
+
+    def test_interrupted_run_isnt_woken_later(self):
+        ev = greenhouse.Event()
+        l = []
+
+        @greenhouse.schedule
+        def f():
+            l.append(greenhouse.compat.getcurrent())
+            try:
+                self.pool.run(time.sleep, TESTING_TIMEOUT)
+            except ValueError:
+                l.append("interrupted")
+            l.append(ev.wait())
+
+        greenhouse.pause()
+        greenhouse.schedule_exception(ValueError(), l.pop())
+        greenhouse.pause_for(TESTING_TIMEOUT * 3)
+
+        # the job finishing must not have woken the event wait
+        self.assertEqual(l, ["interrupted"])
+        ev.set()
+        greenhouse.pause()
+        self.assertEqual(l, ["interrupted", False])
+
+    def test_closed_while_waiting_for_room(self):
+        pool = threadpool.ThreadPool(1, max_queue=1)
+        l = []
+
+        def sleeper(i):
+            try:
+                pool.run(time.sleep, TESTING_TIMEOUT)
+            except RuntimeError:
+                l.append(i)
+
+        for i in xrange(3):
+            greenhouse.schedule(sleeper, args=(i,))
+        greenhouse.pause()
+        pool.close()
+
+        # the one held back fails rather than queueing for no thread
+        greenhouse.pause_for(TESTING_TIMEOUT * 4)
+        self.assertEqual(l, [2])
+
+    def test_forked_child(self):
+        self.pool.run(abs, -1)
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if not pid:
+            # a hung child is killed rather than hanging the test run
+            signal.alarm(2)
+            try:
+                greenhouse.reset_poller()
+                os.write(wfd, str(self.pool.run(abs, -4)))
+            finally:
+                os._exit(0)
+        os.close(wfd)
+        os.waitpid(pid, 0)
+        self.assertEqual(os.read(rfd, 10), "4")
+        os.close(rfd)
+
+    def test_run_in_thread(self):
+        self.assertEqual(greenhouse.run_in_thread(abs, -4), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
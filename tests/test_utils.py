@@ -1,5 +1,6 @@
 from __future__ import with_statement
 
+import functools
 import sys
 import time
 import unittest
@@ -105,6 +106,45 @@ class EventsTestCase(StateClearingTestCase):
 
         self.assertEqual(ev._waiters, [])
 
+class HandoffEventTestCase(StateClearingTestCase):
+    def test_set_switches_to_the_first_waiter(self):
+        ev = greenhouse.Event(handoff=True)
+        l = []
+
+        @greenhouse.schedule
+        def f():
+            ev.wait()
+            l.append(1)
+
+        @greenhouse.schedule
+        def g():
+            ev.wait()
+            l.append(2)
+
+        greenhouse.pause()
+        ev.set()
+        self.assertEqual(l[:1], [1])
+
+        greenhouse.pause()
+        self.assertEqual(l, [1, 2])
+
+    def test_timeouts_in_grlets(self):
+        ev = greenhouse.Event(handoff=True)
+        l = []
+
+        @greenhouse.schedule
+        def f():
+            l.append(ev.wait(TESTING_TIMEOUT))
+
+        greenhouse.pause()
+        ev.set()
+        self.assertEqual(l, [False])
+
+        # the cancelled timer must not wake it again
+        greenhouse.pause_for(TESTING_TIMEOUT * 2)
+        self.assertEqual(l, [False])
+
+
 class LockTestCase(StateClearingTestCase):
     LOCK = greenhouse.Lock
 
@@ -214,6 +254,54 @@ class RLockTestCase(LockTestCase):
         lock.acquire()
         assert lock._is_owned()
 
+class HandoffLockTestCase(LockTestCase):
+    LOCK = functools.partial(greenhouse.Lock, handoff=True)
+
+    def test_release_switches_to_the_waiter(self):
+        lock = self.LOCK()
+        l = []
+
+        @greenhouse.schedule
+        def f():
+            with lock:
+                l.append(lock._is_owned())
+
+        lock.acquire()
+        greenhouse.pause()
+
+        lock.release()
+        self.assertEqual(l, [True])
+        assert not lock.locked()
+
+    def test_no_handoff_from_the_mainloop(self):
+        lock = self.LOCK()
+        l = []
+
+        @greenhouse.schedule
+        def f():
+            lock.acquire()
+            l.append(1)
+
+        lock.acquire()
+        greenhouse.pause()
+
+        # as though in a poller callback
+        state = greenhouse.scheduler.state
+        mainloop, state.mainloop = state.mainloop, greenhouse.getcurrent()
+        try:
+            lock.release()
+        finally:
+            state.mainloop = mainloop
+        assert not l
+
+        greenhouse.pause()
+        self.assertEqual(l, [1])
+
+
+class HandoffRLockTestCase(RLockTestCase):
+    LOCK = functools.partial(greenhouse.RLock, handoff=True)
+
+
 class ConditionRLockTestCase(StateClearingTestCase):
     LOCK = greenhouse.RLock
 
@@ -378,6 +466,26 @@ class BoundedSemaphoreTestCase(CommonSemaphoreTests, StateClearingTestCase):
         sem = self.SEM()
         self.assertRaises(ValueError, sem.release)
 
+class HandoffSemaphoreTestCase(SemaphoreTestCase):
+    SEM = functools.partial(greenhouse.Semaphore, handoff=True)
+
+    def test_release_switches_to_the_waiter(self):
+        sem = self.SEM()
+        l = [False]
+
+        @greenhouse.schedule
+        def f():
+            sem.acquire()
+            l[0] = True
+
+        sem.acquire()
+        greenhouse.pause()
+        sem.release()
+        assert l[0]
+
+class HandoffBoundedSemaphoreTestCase(BoundedSemaphoreTestCase):
+    SEM = functools.partial(greenhouse.BoundedSemaphore, handoff=True)
+
 class TimerTestCase(StateClearingTestCase):
     def test_pauses(self):
         l = [False]
@@ -637,6 +745,73 @@ class PriorityQueueTestCase(QueueTestCase):
             self.assertEqual(q.get(), item)
 
 
+class HandoffQueueTestCase(QueueTestCase):
+    klass = functools.partial(greenhouse.Queue, handoff=True)
+
+    def test_blocks(self):
+        q = self.klass()
+        l = [False]
+
+        @greenhouse.schedule
+        def f():
+            q.put(None)
+            l[0] = True
+
+        # the put switched straight back here, f has yet to carry on
+        q.get()
+        assert not l[0]
+        greenhouse.pause()
+        assert l[0]
+
+    def test_put_switches_to_the_getter(self):
+        q = self.klass()
+        l = []
+
+        @greenhouse.schedule
+        def f():
+            l.append(q.get())
+
+        greenhouse.pause()
+        q.put(1)
+        self.assertEqual(l, [1])
+        assert q.empty()
+
+    def test_get_switches_to_the_putter(self):
+        q = self.klass(1)
+        q.put(1)
+        l = []
+
+        @greenhouse.schedule
+        def f():
+            q.put(2)
+            l.append(q.qsize())
+
+        greenhouse.pause()
+        self.assertEqual(q.get(), 1)
+        self.assertEqual(l, [1])
+        self.assertEqual(q.get(), 2)
+
+    def test_ping_pong(self):
+        pings, pongs = self.klass(), self.klass()
+
+        @greenhouse.schedule
+        def f():
+            while 1:
+                x = pings.get()
+                if x is None:
+                    break
+                pongs.put(x + 1)
+
+        polls = greenhouse.stats()["polls"]
+        for i in xrange(100):
+            pings.put(i)
+            self.assertEqual(pongs.get(), i + 1)
+        pings.put(None)
+
+        # each ping went straight to f, only the pongs went by the mainloop
+        assert greenhouse.stats()["polls"] - polls <= 105
+
+
 class ThreadTestCase(StateClearingTestCase):
     def test_order(self):
         l = []
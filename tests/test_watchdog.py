@@ -0,0 +1,75 @@
+import time
+import unittest
+
+from greenhouse import compat, scheduler, watchdog
+
+from test_base import TESTING_TIMEOUT, StateClearingTestCase
+
+
+class WatchdogTests(StateClearingTestCase):
+    def tearDown(self):
+        watchdog.stop_watchdog()
+        super(WatchdogTests, self).tearDown()
+
+    def test_reports_blocking_greenlet(self):
+        l = []
+        watchdog.start_watchdog(TESTING_TIMEOUT,
+                lambda *args: l.append(args))
+
+        @scheduler.schedule
+        @scheduler.greenlet
+        def hog():
+            time.sleep(TESTING_TIMEOUT * 3)
+
+        scheduler.pause()
+
+        self.assertEqual(len(l), 1)
+        glet, elapsed, stack = l[0]
+        assert glet is hog
+        assert elapsed >= TESTING_TIMEOUT
+        assert "in hog" in stack
+
+    def test_reports_blocking_callback(self):
+        l = []
+        watchdog.start_watchdog(TESTING_TIMEOUT,
+                lambda *args: l.append(args))
+
+        @scheduler.schedule
+        def before():
+            pass
+
+        def hog():
+            time.sleep(TESTING_TIMEOUT * 3)
+
+        handle = scheduler.call_soon(hog)
+        scheduler.pause()
+
+        self.assertEqual(len(l), 1)
+        blamed, elapsed, stack = l[0]
+        assert blamed is handle
+        assert "in hog" in stack
+
+    def test_quiet_while_waiting(self):
+        l = []
+        watchdog.start_watchdog(TESTING_TIMEOUT,
+                lambda *args: l.append(args))
+
+        scheduler.pause_for(TESTING_TIMEOUT * 3)
+
+        @scheduler.schedule
+        def busy():
+            deadline = time.time() + TESTING_TIMEOUT * 3
+            while time.time() < deadline:
+                scheduler.pause()
+
+        scheduler.pause_for(TESTING_TIMEOUT * 4)
+        self.assertEqual(l, [])
+
+    def test_stop(self):
+        assert not watchdog.stop_watchdog()
+        watchdog.start_watchdog(TESTING_TIMEOUT)
+        assert watchdog.stop_watchdog()
+
+
+if __name__ == '__main__':
+    unittest.main()